@@ -0,0 +1,73 @@
+"""
+Activation cache for the frozen prefix of a TTTModel.
+"""
+
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from typing import Hashable, Optional
+import torch
+
+
+class ActivationCache:
+    """
+    Keeps hidden states in memory up to a byte budget, then spills to disk.
+
+    Entries are written once (first epoch) and read many times, so spilled
+    tensors are never promoted back into memory.
+    """
+
+    def __init__(self, max_memory_bytes: int = 1024 * 1024 * 1024, spill_dir: Optional[str] = None):
+        """
+        Args:
+            max_memory_bytes: Budget for tensors kept resident (on their original device)
+            spill_dir: Directory for spilled tensors (default: a fresh temp dir)
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.spill_dir = spill_dir
+        self.memory_bytes = 0
+        self._memory = OrderedDict()
+        self._spilled = {}
+        self._owns_dir = False
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._memory or key in self._spilled
+
+    def __len__(self) -> int:
+        return len(self._memory) + len(self._spilled)
+
+    def put(self, key: Hashable, tensor: torch.Tensor) -> None:
+        tensor = tensor.detach()
+        size = tensor.numel() * tensor.element_size()
+        if self.memory_bytes + size <= self.max_memory_bytes:
+            self._memory[key] = tensor
+            self.memory_bytes += size
+            return
+
+        # Over budget: write to disk and remember the original device
+        path = os.path.join(self._get_spill_dir(), f"{len(self._spilled)}.pt")
+        torch.save(tensor.cpu(), path)
+        self._spilled[key] = (path, tensor.device)
+
+    def get(self, key: Hashable) -> torch.Tensor:
+        if key in self._memory:
+            return self._memory[key]
+        path, device = self._spilled[key]
+        return torch.load(path, map_location=device, weights_only=True)
+
+    def clear(self) -> None:
+        self._memory.clear()
+        self._spilled.clear()
+        self.memory_bytes = 0
+        if self._owns_dir and self.spill_dir and os.path.isdir(self.spill_dir):
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+            self._owns_dir = False
+
+    def _get_spill_dir(self) -> str:
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="learn_doc_acts_")
+            self._owns_dir = True
+        os.makedirs(self.spill_dir, exist_ok=True)
+        return self.spill_dir
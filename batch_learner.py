@@ -0,0 +1,160 @@
+"""
+Document preparation pipeline for learning many files in one run.
+"""
+
+import glob
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+from chunk_cache import ChunkCache
+from chunker import DocumentChunker
+from config import Document
+from pdf_parser import PDFParser
+from state_store import TTTStateStore
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md")
+
+# Set in each worker process by _init_worker
+_tokenizer = None
+_known_sources = None
+
+
+@dataclass
+class PreparedDocument:
+    """A file after extraction and chunking (or the error that stopped it)."""
+    path: str
+    document: Optional[Document] = None
+    source_hash: Optional[str] = None  # TTTStateStore.file_hash of the file
+    cache_key: Optional[str] = None
+    cached: bool = False  # Chunks came from the ChunkCache
+    stored_key: Optional[str] = None  # Store key of an earlier learn of this file (nothing was extracted)
+    error: Optional[str] = None
+    prepare_seconds: float = 0.0  # Hashing, extraction and chunking time in the worker
+
+
+def find_documents(source: str) -> List[str]:
+    """Supported files under a directory (recursively) or matching a glob, sorted."""
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "**", "*"), recursive=True)
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(SUPPORTED_EXTENSIONS))
+
+
+def _init_worker(tokenizer, known_sources) -> None:
+    global _tokenizer, _known_sources
+    _tokenizer = tokenizer
+    _known_sources = known_sources
+
+
+def prepare_document(path: str, chunker_kwargs: dict, cache_dir: Optional[str] = None,
+                     tokenizer=None, known_sources: Optional[Dict[str, str]] = None) -> PreparedDocument:
+    """
+    Hash, extract and chunk one file (runs in a worker process).
+
+    Chunks are read from the cache under cache_dir when the same file was
+    chunked the same way before; the content hash matches what `learn`
+    computes, so the document store recognizes files learned either way.
+    A file whose hash is in known_sources (source hash -> store key) was
+    learned before and is not extracted at all.
+    """
+    t0 = time.perf_counter()
+    tokenizer = tokenizer or _tokenizer
+    known_sources = _known_sources if known_sources is None else known_sources
+    name = os.path.basename(path)
+    source_hash = TTTStateStore.file_hash(path)
+    cache_key = ChunkCache.make_key(source_hash, tokenizer, **chunker_kwargs)
+    if known_sources and source_hash in known_sources:
+        return PreparedDocument(
+            path=path, source_hash=source_hash, cache_key=cache_key,
+            stored_key=known_sources[source_hash], prepare_seconds=time.perf_counter() - t0
+        )
+    document = ChunkCache(cache_dir).get(cache_key) if cache_dir else None
+    cached = document is not None
+
+    if document is None:
+        chunker = DocumentChunker(tokenizer, decode_text=False, **chunker_kwargs)
+        if path.lower().endswith(".pdf"):
+            pages = list(PDFParser(workers=0).iter_pages(path))
+            text = "\n".join(page_text for _, page_text in pages)
+            chunks = list(chunker.chunk_pages(pages))
+            page_count = len(pages)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            chunks = chunker.chunk(text)
+            page_count = 1
+        document = Document(
+            id=name, filename=name, page_count=page_count,
+            total_tokens=sum(c.token_count for c in chunks), chunks=chunks,
+            content_hash=TTTStateStore.content_hash(text)
+        )
+    document.id = document.filename = name
+    return PreparedDocument(
+        path=path, document=document, source_hash=source_hash, cache_key=cache_key,
+        cached=cached, prepare_seconds=time.perf_counter() - t0
+    )
+
+
+class DocumentPrefetcher:
+    """
+    Prepares documents in a process pool while the caller trains.
+
+    At most `prefetch` documents are in flight or waiting beyond the one
+    being consumed, which bounds memory however many files there are.
+    Results come back in input order; a file that fails is reported with
+    its error instead of stopping the run.
+    """
+
+    def __init__(self, tokenizer, workers: Optional[int] = None, prefetch: int = 4,
+                 cache_dir: Optional[str] = None, known_sources: Optional[Dict[str, str]] = None,
+                 **chunker_kwargs):
+        """
+        Args:
+            tokenizer: Tokenizer to chunk with (sent once to each worker)
+            workers: Worker processes (default: CPU count)
+            prefetch: Documents prepared ahead of the consumer
+            cache_dir: ChunkCache directory to read from (None = always chunk)
+            known_sources: Source hash -> store key of files already learned,
+                which are only hashed (sent once to each worker)
+            chunker_kwargs: chunk_size, stride, boundary, dedup for DocumentChunker
+        """
+        self.tokenizer = tokenizer
+        self.workers = workers
+        self.prefetch = max(1, prefetch)
+        self.cache_dir = cache_dir
+        self.known_sources = known_sources or {}
+        self.chunker_kwargs = chunker_kwargs
+
+    def run(self, paths: List[str]) -> Iterator[PreparedDocument]:
+        # Workers are forked after the parent used the tokenizer; keep them single-threaded
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.tokenizer, self.known_sources)
+        )
+        pending = deque()
+        remaining = iter(paths)
+        try:
+            def submit():
+                for path in remaining:
+                    pending.append((path, executor.submit(
+                        prepare_document, path, self.chunker_kwargs, self.cache_dir
+                    )))
+                    return
+
+            for _ in range(self.prefetch + 1):
+                submit()
+            while pending:
+                path, future = pending.popleft()
+                try:
+                    prepared = future.result()
+                except Exception as e:
+                    prepared = PreparedDocument(path=path, error=f"{type(e).__name__}: {e}")
+                # Refill before handing over, so workers stay busy during training
+                submit()
+                yield prepared
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,292 @@
+"""
+Offline benchmarks for learn-doc.
+
+Builds a small randomly initialized Qwen2 model and a byte-level BPE
+tokenizer trained on docs/, so nothing is downloaded, then times each
+pipeline stage: chunking, PDF extraction, training epochs, session
+save/load and generation. Results are written as JSON; --baseline compares
+against an earlier run and exits non-zero on regressions.
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast, Qwen2Config
+
+from chunker import DocumentChunker
+from config import Document, LearningConfig
+from generator import Generator
+from pdf_parser import PDFParser
+from session_format import load_into_model, save_state
+from trainer import TTTTrainer
+from ttt_model import TTTModel
+
+DOCS_DIR = Path(__file__).parent.parent / "docs"
+SPECIAL_TOKENS = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+QUESTIONS = [
+    "What is the capital of France?",
+    "Who invented the World Wide Web?",
+    "Summarize the document in one sentence.",
+]
+
+
+def corpus() -> str:
+    return "\n\n".join(p.read_text(encoding="utf-8") for p in sorted(DOCS_DIR.glob("*.txt")))
+
+
+def build_tokenizer(vocab_size: int = 1024) -> PreTrainedTokenizerFast:
+    """Byte-level BPE (Qwen style) trained on docs/ in memory."""
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=SPECIAL_TOKENS,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(), show_progress=False
+    )
+    tokenizer.train_from_iterator([corpus()], trainer)
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|im_end|>", pad_token="<|endoftext|>")
+
+
+def build_model(tokenizer, hidden_size: int = 128, num_layers: int = 4, ttt_layers: int = 2,
+                device: str = "cpu", frozen_dtype: str = "auto") -> TTTModel:
+    """Random-init Qwen2 with TTT layers in the top ttt_layers blocks."""
+    config = Qwen2Config(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, intermediate_size=hidden_size * 4,
+        num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=2,
+        max_position_embeddings=4096, tie_word_embeddings=True,
+        eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+    )
+    torch.manual_seed(0)
+    # fp16 matmuls are slow on CPU; the real model runs fp16 on GPU
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    return TTTModel.from_config(
+        config, tokenizer, list(range(num_layers - ttt_layers, num_layers)),
+        device=device, dtype=dtype, frozen_dtype=frozen_dtype
+    )
+
+
+def sample_text(chars: int) -> str:
+    text = corpus()
+    return (text * (chars // len(text) + 1))[:chars]
+
+
+def timed(fn, repeats: int = 1):
+    """(result of the last call, best wall time in seconds)."""
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+def bench_chunker(tokenizer, text: str, chunk_size: int, repeats: int) -> dict:
+    chunker = DocumentChunker(tokenizer, chunk_size=chunk_size, decode_text=False)
+    chunks, seconds = timed(lambda: chunker.chunk(text), repeats)
+    tokens = sum(c.token_count for c in chunks)
+    return {
+        "chars": len(text),
+        "tokens": tokens,
+        "chunks": len(chunks),
+        "seconds": seconds,
+        "chars_per_second": len(text) / seconds,
+        "tokens_per_second": tokens / seconds,
+    }
+
+
+def bench_pdf(pages: int, workdir: str, repeats: int) -> dict:
+    import fitz
+    path = os.path.join(workdir, "bench.pdf")
+    text = corpus()
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {i + 1}\n\n{text[:2500]}", fontsize=9)
+    doc.save(path)
+    doc.close()
+
+    parser = PDFParser()
+    extracted, seconds = timed(lambda: list(parser.iter_pages(path)), repeats)
+    return {
+        "pages": len(extracted),
+        "seconds": seconds,
+        "pages_per_second": len(extracted) / seconds,
+    }
+
+
+def bench_training(model, tokenizer, text: str, chunk_size: int, epochs: int) -> dict:
+    chunks = DocumentChunker(tokenizer, chunk_size=chunk_size, decode_text=False).chunk(text)
+    document = Document(
+        id="bench", filename="bench.txt", page_count=1,
+        total_tokens=sum(c.token_count for c in chunks), chunks=chunks
+    )
+    model.reset_learning()
+    trainer = TTTTrainer(model, tokenizer, LearningConfig(
+        chunk_size=chunk_size, cache_prefix=True, focus_hard_chunks=False, inner_lr=1e-3
+    ))
+
+    # One train() call per epoch, so each epoch is timed on its own
+    epoch_rates, losses = [], []
+    for _ in range(epochs):
+        metrics, seconds = timed(lambda: trainer.train(document, epochs=1))
+        epoch_rates.append(document.total_tokens / seconds)
+        losses.append(metrics.final_loss)
+    trainer.clear_cache()
+    return {
+        "tokens": document.total_tokens,
+        "chunks": len(chunks),
+        "epoch_tokens_per_second": epoch_rates,
+        # First epoch also fills the frozen-prefix cache
+        "first_epoch_tokens_per_second": epoch_rates[0],
+        "tokens_per_second": statistics.median(epoch_rates[1:] or epoch_rates),
+        "losses": losses,
+    }, document
+
+
+def bench_session(model, document: Document, workdir: str, repeats: int) -> dict:
+    path = os.path.join(workdir, "bench.safetensors")
+    header = {"adapter_rank": model.adapter_rank, "document": {"filename": document.filename}}
+    _, save_seconds = timed(lambda: save_state(path, model.get_ttt_state(as_delta=True), header), repeats)
+    _, load_seconds = timed(lambda: load_into_model(path, model), repeats)
+    return {
+        "bytes": os.path.getsize(path),
+        "save_seconds": save_seconds,
+        "load_seconds": load_seconds,
+    }
+
+
+def bench_generation(model, tokenizer, max_tokens: int) -> dict:
+    generator = Generator(model, tokenizer)
+    torch.manual_seed(0)
+    answers = [generator.generate(q, max_tokens=max_tokens) for q in QUESTIONS]
+    # The first question also prefills the system prompt cache
+    ttfts = [a.time_to_first_token_seconds for a in answers if a.time_to_first_token_seconds is not None]
+    rates = [a.tokens_per_second for a in answers if a.tokens_per_second]
+    return {
+        "questions": len(answers),
+        "tokens_generated": [a.tokens_generated for a in answers],
+        "cold_ttft_seconds": ttfts[0] if ttfts else None,
+        "ttft_seconds": statistics.median(ttfts[1:] or ttfts) if ttfts else None,
+        "tokens_per_second": statistics.median(rates) if rates else None,
+    }
+
+
+def environment(device: str) -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "torch": torch.__version__,
+        "device": torch.cuda.get_device_name(0) if device == "cuda" else platform.processor() or "cpu",
+        "threads": torch.get_num_threads(),
+    }
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Metrics that got worse by more than tolerance (relative): rates
+    (*_per_second) going down, durations (*_seconds) going up.
+    """
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for name, value in current.items():
+        old = previous.get(name)
+        if not old:
+            continue
+        if name.endswith("_per_second"):
+            change = (old - value) / old
+        elif name.endswith("_seconds"):
+            change = (value - old) / old
+        else:
+            continue
+        if change > tolerance:
+            regressions.append(f"{name}: {old:.4g} -> {value:.4g} ({change:+.0%} worse)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="learn-doc offline benchmarks")
+    parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown (default 0.2)")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--frozen-dtype", default="auto", help="Frozen TTT weight storage (see TTTModel.from_pretrained)")
+    parser.add_argument("--hidden-size", type=int, default=128)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--chars", type=int, default=200_000, help="Text size for chunking")
+    parser.add_argument("--train-chars", type=int, default=20_000, help="Text size for training")
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--pdf-pages", type=int, default=40)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3, help="Timing repeats (best is kept)")
+    args = parser.parse_args()
+
+    tokenizer = build_tokenizer()
+    model = build_model(tokenizer, args.hidden_size, args.layers, device=args.device, frozen_dtype=args.frozen_dtype)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        print("Chunker...", file=sys.stderr)
+        results["chunker"] = bench_chunker(tokenizer, sample_text(args.chars), args.chunk_size, args.repeats)
+        print("PDF extraction...", file=sys.stderr)
+        results["pdf"] = bench_pdf(args.pdf_pages, workdir, args.repeats)
+        print("Training...", file=sys.stderr)
+        results["training"], document = bench_training(
+            model, tokenizer, sample_text(args.train_chars), args.chunk_size, args.epochs
+        )
+        print("Session save/load...", file=sys.stderr)
+        results["session"] = bench_session(model, document, workdir, args.repeats)
+        print("Generation...", file=sys.stderr)
+        results["generation"] = bench_generation(model, tokenizer, args.max_tokens)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(args.device),
+        "settings": vars(args),
+        "results": results,
+    }
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(data)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Content-addressed cache of chunked documents.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+import numpy as np
+from chunker import chunk_hash
+from config import Document, DocumentChunk
+
+# Per-chunk metadata columns in <key>.chunks.npy (-1 = no page)
+_COLUMNS = ("offset", "token_count", "start_page", "end_page", "overlap_tokens")
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of everything that decides how a tokenizer encodes text."""
+    cached = getattr(tokenizer, "_learn_doc_fingerprint", None)
+    if cached:
+        return cached
+    hasher = hashlib.sha256()
+    hasher.update(type(tokenizer).__name__.encode("utf-8"))
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        hasher.update(backend.to_str().encode("utf-8"))
+    else:
+        hasher.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    fingerprint = hasher.hexdigest()
+    try:
+        tokenizer._learn_doc_fingerprint = fingerprint
+    except AttributeError:
+        pass
+    return fingerprint
+
+
+class ChunkCache:
+    """
+    Chunked documents on disk, keyed by source file hash, tokenizer and
+    chunking parameters.
+
+    Each entry is a flat int32 array of the chunks' token ids (<key>.bin,
+    memory-mapped on load) plus a small per-chunk table (<key>.chunks.npy);
+    document fields live in index.json. A hit skips extraction and
+    tokenization entirely.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, root: str = ".chunk_cache"):
+        self.root = root
+        self._index = self._read_index()
+
+    @staticmethod
+    def make_key(source_hash: str, tokenizer, chunk_size: int, stride: Optional[int] = None,
+                 boundary: str = "token", dedup: bool = False) -> str:
+        """
+        Args:
+            source_hash: Hash of the source file bytes (TTTStateStore.file_hash)
+            tokenizer: Tokenizer the chunks were encoded with
+            chunk_size, stride, boundary, dedup: DocumentChunker parameters
+
+        Returns:
+            Cache key (hex digest)
+        """
+        params = {
+            "source": source_hash,
+            "tokenizer": tokenizer_fingerprint(tokenizer),
+            "chunk_size": chunk_size,
+            "stride": stride,
+            "boundary": boundary,
+            "dedup": dedup,
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index and os.path.exists(self._path(key, ".bin"))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str) -> Optional[Document]:
+        """Cached document with token_ids as views into a memory-mapped array (None on a miss)."""
+        if key not in self:
+            return None
+        entry = self._index[key]
+        table = np.load(self._path(key, ".chunks.npy"))
+        if entry["total_ids"]:
+            # Copy-on-write: views are writable (no torch warnings), the file never changes
+            ids = np.memmap(self._path(key, ".bin"), dtype=np.int32, mode="c", shape=(entry["total_ids"],))
+        else:
+            ids = np.empty(0, dtype=np.int32)
+
+        chunks = []
+        for index, (offset, count, start_page, end_page, overlap) in enumerate(table.tolist()):
+            token_ids = ids[offset:offset + count]
+            chunks.append(DocumentChunk(
+                index=index, text="", token_ids=token_ids, token_count=count,
+                token_hash=chunk_hash(token_ids),
+                start_page=None if start_page < 0 else start_page,
+                end_page=None if end_page < 0 else end_page,
+                overlap_tokens=overlap
+            ))
+        return Document(
+            id=entry["filename"], filename=entry["filename"], page_count=entry["page_count"],
+            total_tokens=entry["total_tokens"], chunks=chunks, content_hash=entry["content_hash"]
+        )
+
+    def put(self, key: str, document: Document) -> None:
+        """Store a fully chunked document (writes are atomic per file)."""
+        os.makedirs(self.root, exist_ok=True)
+        counts = [c.token_count for c in document.chunks]
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]) if counts else np.empty(0)
+        table = np.array([
+            (offset, c.token_count,
+             -1 if c.start_page is None else c.start_page,
+             -1 if c.end_page is None else c.end_page,
+             c.overlap_tokens)
+            for offset, c in zip(offsets, document.chunks)
+        ], dtype=np.int64).reshape(-1, len(_COLUMNS))
+
+        ids_path = self._path(key, ".bin")
+        with open(ids_path + ".tmp", "wb") as f:
+            for chunk in document.chunks:
+                f.write(np.asarray(chunk.token_ids, dtype=np.int32).tobytes())
+        os.replace(ids_path + ".tmp", ids_path)
+        table_path = self._path(key, ".chunks.npy")
+        with open(table_path + ".tmp", "wb") as f:
+            np.save(f, table)
+        os.replace(table_path + ".tmp", table_path)
+
+        self._index.pop(key, None)
+        self._index[key] = {
+            "filename": document.filename,
+            "page_count": document.page_count,
+            "total_tokens": document.total_tokens,
+            "content_hash": document.content_hash,
+            "chunks": len(counts),
+            "total_ids": int(sum(counts)),
+            "created": time.time(),
+        }
+        self._write_index()
+
+    def remove(self, key: str) -> None:
+        self._index.pop(key, None)
+        for suffix in (".bin", ".chunks.npy"):
+            if os.path.exists(self._path(key, suffix)):
+                os.remove(self._path(key, suffix))
+        self._write_index()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.root, key + suffix)
+
+    def _read_index(self) -> dict:
+        path = os.path.join(self.root, self.INDEX_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_index(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, self.INDEX_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(path + ".tmp", path)
@@ -1,7 +1,46 @@
 """Token-based text chunking for documents"""
-from typing import List
+import hashlib
+import re
+from collections import Counter
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+import numpy as np
 from transformers import PreTrainedTokenizer
 from config import DocumentChunk
+from profiling import stage
+
+# Positions where a byte-level BPE pre-tokenizer (GPT-2 / Qwen style) always
+# starts a new pre-token: a space before a non-space, or a non-space right
+# after a single newline. Text split there tokenizes exactly like the whole
+# text. Not after "\n\n": GPT-2's \s+(?!\S) splits that run into "\n" + "\n"
+# only when the next word follows it in the same call.
+_SAFE_CUT = re.compile(r" (?=\S)|(?<=\S\n)(?=\S)")
+
+# Page-number lines after digits become "#": "#", "Page #", "# of #", "#/#"
+_PAGE_NUMBER = re.compile(r"^(page\s*)?#(\s*(of|/)\s*#)?$", re.IGNORECASE)
+
+
+def chunk_hash(token_ids) -> str:
+    """Content hash of a chunk's token ids."""
+    return hashlib.blake2b(np.asarray(token_ids, dtype=np.int32).tobytes(), digest_size=16).hexdigest()
+
+
+def ends_sentence(text: str) -> bool:
+    """Text closes a sentence (or a line)."""
+    return text.rstrip(" ").endswith((".", "!", "?", "\n"))
+
+
+def ends_paragraph(text: str) -> bool:
+    """Text closes a paragraph (blank line)."""
+    return text.rstrip(" ").endswith("\n\n")
+
+
+# Chunk boundary strategies: name -> predicate on the text of the two tokens
+# before a candidate cut (None = cut after any token)
+BOUNDARIES = {
+    "token": None,
+    "sentence": ends_sentence,
+    "paragraph": ends_paragraph,
+}
 
 
 class DocumentChunker:
@@ -10,7 +49,12 @@ class DocumentChunker:
     def __init__(
         self,
         tokenizer: PreTrainedTokenizer,
-        chunk_size: int = 2048
+        chunk_size: int = 2048,
+        window_chars: int = 1 << 20,
+        decode_text: bool = True,
+        stride: Optional[int] = None,
+        boundary: Union[str, Callable[[str], bool], None] = "token",
+        dedup: bool = False
     ):
         """
         Initialize chunker.
@@ -18,9 +62,23 @@ class DocumentChunker:
         Args:
             tokenizer: HuggingFace tokenizer (e.g., Qwen2.5-1.5B tokenizer)
             chunk_size: Maximum tokens per chunk (default: 2048)
+            window_chars: Characters tokenized per call (bounds peak memory)
+            decode_text: Fill DocumentChunk.text; if False it stays "" and
+                chunk_text() decodes on demand
+            stride: Tokens between chunk starts (default: chunk_size, no overlap)
+            boundary: "token", "sentence", "paragraph" (see BOUNDARIES) or a
+                predicate on decoded text that marks where chunks may end
+            dedup: Skip chunks whose tokens repeat an earlier chunk, and strip
+                repeated header/footer lines in chunk_pages
         """
         self.tokenizer = tokenizer
         self.chunk_size = chunk_size
+        self.window_chars = window_chars
+        self.decode_text = decode_text
+        self.stride = stride
+        self.dedup = dedup
+        self._ends_unit = BOUNDARIES[boundary] if isinstance(boundary, str) else boundary
+        self._boundary_cache = {}
     
     def chunk(self, text: str) -> List[DocumentChunk]:
         """
@@ -34,25 +92,223 @@ class DocumentChunker:
         """
         if not text.strip():
             return []
+        return list(self.iter_chunks(text))
+    
+    def iter_chunks(self, text: Union[str, Iterable[str]]) -> Iterator[DocumentChunk]:
+        """
+        Yield chunks while tokenizing in bounded windows.
+        
+        Args:
+            text: Document text, or an iterable of consecutive pieces of it
+                (e.g. blocks read from a file)
+            
+        Yields:
+            DocumentChunk objects whose token_ids are int32 array views
+        """
+        pieces = [text] if isinstance(text, str) else text
+        blocks = ((self._encode(segment), None) for segment in self._segments(pieces))
+        yield from self._split(blocks)
+    
+    def chunk_pages(self, pages: Iterable[Tuple[int, str]]) -> Iterator[DocumentChunk]:
+        """
+        Chunk page texts as they arrive.
         
-        # Tokenize entire text once
-        token_ids = self.tokenizer.encode(text, add_special_tokens=False)
+        Each page is tokenized on its own and chunks are yielded as soon as
+        enough tokens are buffered, so chunking keeps pace with a streaming
+        parser instead of waiting for the whole document. With dedup, header
+        and footer lines are dropped from the third page they appear on.
         
-        # Split into chunks
-        chunks = []
-        for i in range(0, len(token_ids), self.chunk_size):
-            chunk_token_ids = token_ids[i:i + self.chunk_size]
+        Args:
+            pages: (page_number, text) pairs in order, e.g. PDFParser.iter_pages()
             
-            # Decode chunk tokens back to text
-            chunk_text = self.tokenizer.decode(chunk_token_ids, skip_special_tokens=True)
+        Yields:
+            DocumentChunk objects with start_page / end_page set
+        """
+        def blocks():
+            seen_edges = Counter()
+            for page_number, text in pages:
+                if self.dedup:
+                    text = self._strip_repeated_edges(text, seen_edges)
+                if not text.strip():
+                    continue
+                ids = self._encode(text + "\n")
+                yield ids, np.full(len(ids), page_number, dtype=np.int32)
+        
+        yield from self._split(blocks())
+    
+    def _encode(self, text: str) -> np.ndarray:
+        with stage("chunk", chars=len(text)):
+            return np.asarray(self.tokenizer.encode(text, add_special_tokens=False), dtype=np.int32)
+    
+    def _split(self, blocks: Iterator[Tuple[np.ndarray, Optional[np.ndarray]]]) -> Iterator[DocumentChunk]:
+        """
+        Cut a stream of (token_ids, token_pages) blocks into chunks.
+        
+        Chunks hold at most chunk_size tokens and start every stride tokens,
+        so consecutive chunks share chunk_size - stride tokens (recorded as
+        overlap_tokens). With a sentence/paragraph boundary, chunk ends and
+        overlap starts snap to the nearest boundary.
+        """
+        size = self.chunk_size
+        stride = min(self.stride or size, size)
+        buffer = np.empty(0, dtype=np.int32)
+        token_pages = None
+        start = 0      # first token of the next chunk
+        prev_end = 0   # end of the last emitted chunk
+        index = 0
+        seen = set()
+        
+        def emit(final):
+            nonlocal start, prev_end, index
+            end = min(start + size, len(buffer))
+            if self._ends_unit is not None and not (final and end == len(buffer)):
+                end = self._last_boundary(buffer, start + size // 2, end) or end
+            
+            ids = buffer[start:end]
+            key = ids.tobytes() if self.dedup else None
+            chunk = None
+            if key is None or key not in seen:
+                if key is not None:
+                    seen.add(key)
+                chunk = self._make_chunk(
+                    index, ids,
+                    None if token_pages is None else token_pages[start],
+                    None if token_pages is None else token_pages[end - 1],
+                    overlap_tokens=max(0, prev_end - start)
+                )
+                index += 1
+                prev_end = end
             
-            # Create DocumentChunk
-            chunk = DocumentChunk(
-                index=len(chunks),  # Sequential index
-                text=chunk_text,
-                token_ids=chunk_token_ids,
-                token_count=len(chunk_token_ids)
-            )
-            chunks.append(chunk)
-        
-        return chunks
+            next_start = end - (size - stride)
+            if self._ends_unit is not None and next_start < end:
+                next_start = self._first_boundary(buffer, next_start, end) or next_start
+            start = max(next_start, start + 1)
+            return chunk
+        
+        for ids, ids_pages in blocks:
+            # Drop tokens no future chunk can reach
+            keep = min(start, prev_end)
+            buffer = np.concatenate([buffer[keep:], ids])
+            if ids_pages is not None:
+                token_pages = ids_pages if token_pages is None else np.concatenate([token_pages[keep:], ids_pages])
+            start -= keep
+            prev_end -= keep
+            
+            while len(buffer) - start >= size:
+                chunk = emit(final=False)
+                if chunk is not None:
+                    yield chunk
+        
+        while start < len(buffer) and len(buffer) > prev_end:
+            chunk = emit(final=True)
+            if chunk is not None:
+                yield chunk
+    
+    def chunk_text(self, chunk: DocumentChunk) -> str:
+        """Chunk text, decoded from its token ids if it wasn't kept."""
+        if chunk.text or not chunk.token_count:
+            return chunk.text
+        return self.tokenizer.decode(chunk.token_ids, skip_special_tokens=True)
+
+    def _segments(self, pieces: Iterable[str]) -> Iterator[str]:
+        """Regroup text pieces into ~window_chars segments cut at safe boundaries."""
+        pending = ""
+        start = 0  # Start of the text not yielded yet
+        scanned = 0  # Past the window, pending[:scanned] holds no safe cut
+        for piece in pieces:
+            if start:
+                pending = pending[start:]
+                scanned = max(0, scanned - start)
+                start = 0
+            pending += piece
+            while len(pending) - start > self.window_chars:
+                limit = start + self.window_chars
+                cut = self._safe_cut(pending, start, limit)
+                if not cut:
+                    # No boundary in the window (e.g. text without spaces): take the first one after it
+                    match = _SAFE_CUT.search(pending, max(limit, scanned))
+                    if match is None:
+                        scanned = len(pending) - 1
+                        break
+                    cut = match.start()
+                yield pending[start:cut]
+                start = cut
+        if len(pending) > start:
+            yield pending[start:]
+
+    @staticmethod
+    def _safe_cut(text: str, start: int, limit: int) -> int:
+        """Last safe split position in (start, limit] (0 if there is none); text extends past limit."""
+        # Searched backwards from limit: a space before a non-space, or a non-space after "<non-space>\n"
+        space = text.rfind(" ", start + 1, limit)
+        newline = text.rfind("\n", start, limit)
+        while space >= 0 or newline >= 0:
+            if space > newline:
+                if not text[space + 1].isspace():
+                    return space
+                space = text.rfind(" ", start + 1, space)
+            else:
+                if not text[newline + 1].isspace() and newline > 0 and not text[newline - 1].isspace():
+                    return newline + 1
+                newline = text.rfind("\n", start, newline)
+        return 0
+
+    def _last_boundary(self, buffer: np.ndarray, lo: int, hi: int) -> int:
+        """Largest cut in (lo, hi] that follows a sentence/paragraph end (0 if none)."""
+        for i in range(hi, lo, -1):
+            if self._is_boundary(buffer, i):
+                return i
+        return 0
+    
+    def _first_boundary(self, buffer: np.ndarray, lo: int, hi: int) -> int:
+        """Smallest cut in [lo, hi) that follows a sentence/paragraph end (0 if none)."""
+        for i in range(max(lo, 1), hi):
+            if self._is_boundary(buffer, i):
+                return i
+        return 0
+    
+    def _is_boundary(self, buffer: np.ndarray, i: int) -> bool:
+        """Whether a chunk may end right before buffer[i]."""
+        # Two tokens, so a blank line split into two "\n" tokens is still seen
+        key = (int(buffer[i - 2]) if i >= 2 else -1, int(buffer[i - 1]))
+        if key not in self._boundary_cache:
+            self._boundary_cache[key] = self._ends_unit(self.tokenizer.decode([t for t in key if t >= 0]))
+        return self._boundary_cache[key]
+    
+    @staticmethod
+    def _strip_repeated_edges(text: str, seen: Counter, edge_lines: int = 2, min_pages: int = 3) -> str:
+        """
+        Drop lines near the top/bottom of a page once they have appeared at
+        the edge of min_pages pages (counting this one), i.e. running headers
+        and footers. A page-number line as the outermost line matches with
+        numbers ignored, so "Page 3 of 40" repeats "Page 2 of 40"; other lines
+        must match exactly, so headings like "Table 2:" are kept.
+        """
+        lines = text.split("\n")
+        if len(lines) <= 2 * edge_lines:
+            return text
+        edges = set(range(edge_lines)) | set(range(len(lines) - edge_lines, len(lines)))
+        keys = {}
+        for i in edges:
+            key = lines[i].strip()
+            if key:
+                numbered = re.sub(r"\d+", "#", key)
+                outermost = i in (0, len(lines) - 1)
+                keys[i] = numbered if outermost and _PAGE_NUMBER.match(numbered) else key
+        seen.update(set(keys.values()))
+        return "\n".join(
+            line for i, line in enumerate(lines) if i not in keys or seen[keys[i]] < min_pages
+        )
+    
+    def _make_chunk(self, index: int, token_ids: np.ndarray, start_page=None, end_page=None,
+                    overlap_tokens: int = 0) -> DocumentChunk:
+        return DocumentChunk(
+            index=index,
+            text=self.tokenizer.decode(token_ids, skip_special_tokens=True) if self.decode_text else "",
+            token_ids=token_ids,
+            token_count=len(token_ids),
+            token_hash=chunk_hash(token_ids),
+            start_page=None if start_page is None else int(start_page),
+            end_page=None if end_page is None else int(end_page),
+            overlap_tokens=overlap_tokens
+        )
@@ -5,10 +5,20 @@ CLI interface for learn-doc.
 import sys
 import os
 import time
+import argparse
+import hashlib
+import json
+from contextlib import contextmanager
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+# Hand the command to a running `serve` daemon before importing torch/transformers
+if __name__ == "__main__":
+    from daemon_client import forward_command
+    if forward_command(sys.argv[1:]):
+        sys.exit(0)
+
 import torch
 from tqdm import tqdm
 
@@ -18,14 +28,33 @@ from chunker import DocumentChunker
 from ttt_model import TTTModel
 from trainer import TTTTrainer
 from generator import Generator
+from state_store import TTTStateStore
+from chunk_cache import ChunkCache
+from batch_learner import DocumentPrefetcher, find_documents
+from data_parallel import default_threads, train_data_parallel
+from session_format import document_from_dict, document_to_dict, load_into_model, save_state
+from profiling import Profiler, active as active_profiler
 
 class CLInterface:
-    SESSION_FILE = ".session_state.pt"
+    SESSION_FILE = ".session_state.safetensors"
+    OPTIMIZER_FILE = ".session_state.optim.pt"
+    LEGACY_SESSION_FILE = ".session_state.pt"
+    STORE_DIR = ".ttt_store"
+    CHUNK_CACHE_DIR = ".chunk_cache"
+    # Memory cap for the learned states the store keeps resident (LRU)
+    STORE_RESIDENT_MB = int(os.environ.get("LEARN_DOC_STORE_RESIDENT_MB", "512"))
+    # Frozen W_up / W_out storage in the TTT layers (W_h is always fp32)
+    FROZEN_DTYPE = os.environ.get("LEARN_DOC_FROZEN_DTYPE", "auto")
+    # torch.compile the TTT layers (slow first call, faster afterwards)
+    COMPILE_TTT = bool(os.environ.get("LEARN_DOC_COMPILE"))
 
     def __init__(self):
         self.model = None
         self.tokenizer = None
         self.document = None
+        self.trainer_state = None
+        self.store = None
+        self.chunk_cache = None
 
     def get_model(self):
         if self.model is None:
@@ -38,85 +67,488 @@ class CLInterface:
             self.model = TTTModel.from_pretrained(
                 model_name="Qwen/Qwen2.5-0.5B-Instruct",
                 ttt_layer_indices=target_layers,
-                device=device
+                device=device,
+                frozen_dtype=self.FROZEN_DTYPE
             )
+            if self.COMPILE_TTT:
+                self.model.compile_ttt_layers()
             self.tokenizer = self.model.tokenizer
             print(f"Model loaded! TTT Active on layers: {target_layers}")
         return self.model
 
-    def save_session(self):
+    def get_store(self):
+        if self.store is None:
+            self.store = TTTStateStore(
+                self.STORE_DIR, device=self.get_model().device, max_resident_mb=self.STORE_RESIDENT_MB
+            )
+        return self.store
+
+    def get_chunk_cache(self):
+        if self.chunk_cache is None:
+            self.chunk_cache = ChunkCache(self.CHUNK_CACHE_DIR)
+        return self.chunk_cache
+
+    def save_session(self, trainer_state=None, dtype=None):
         if not self.model or not self.document: return
         print("Saving session state...")
-        ttt_weights = [layer.W_h.weight.data.clone() for layer in self.model.ttt_layers]
-        state = {"ttt_weights": ttt_weights, "document": self.document}
-        torch.save(state, self.SESSION_FILE, _use_new_zipfile_serialization=False)
+        # Learned tensors only (W_h deltas or adapter A/B) + a small JSON header
+        header = {"adapter_rank": self.model.adapter_rank, "document": document_to_dict(self.document)}
+        save_state(self.SESSION_FILE, self.model.get_ttt_state(as_delta=True), header, dtype=dtype)
+        if trainer_state is not None:
+            # Optimizer moments + step count so `learn --resume` can continue
+            torch.save(trainer_state, self.OPTIMIZER_FILE)
+        elif os.path.exists(self.OPTIMIZER_FILE):
+            os.remove(self.OPTIMIZER_FILE)
         print("Session saved.")
 
     def load_session(self):
         if self.model and self.document: return True
-        if not os.path.exists(self.SESSION_FILE): return False
+        if not os.path.exists(self.SESSION_FILE) and not os.path.exists(self.LEGACY_SESSION_FILE): return False
         try:
             model = self.get_model()
             print("Loading learned state...")
-            state = torch.load(self.SESSION_FILE, weights_only=False)
-            self.document = state["document"]
-            with torch.no_grad():
-                for layer, saved_w in zip(model.ttt_layers, state["ttt_weights"]):
-                    layer.W_h.weight.data.copy_(saved_w)
+            if os.path.exists(self.SESSION_FILE):
+                # Header first, then tensors straight from the mapped file into the TTT layers
+                header = load_into_model(self.SESSION_FILE, model)
+                self.document = document_from_dict(header["document"])
+                self.trainer_state = None
+                if os.path.exists(self.OPTIMIZER_FILE):
+                    self.trainer_state = torch.load(self.OPTIMIZER_FILE, map_location=model.device)
+            else:
+                self.load_legacy_session(model)
+            if self.document.content_hash in self.get_store():
+                self.store.active_key = self.document.content_hash
             return True
         except Exception as e:
             print(f"Error loading: {e}")
             return False
 
+    def load_legacy_session(self, model):
+        """Pickled sessions from older versions."""
+        state = torch.load(self.LEGACY_SESSION_FILE, weights_only=False)
+        self.document = state["document"]
+        self.trainer_state = state.get("trainer_state")
+        if "ttt_weights" in state:
+            # Sessions saved before adapter support
+            ttt_state = [{"W_h": w} for w in state["ttt_weights"]]
+        else:
+            ttt_state = state["ttt_state"]
+        if model.adapter_rank != state.get("adapter_rank", 0):
+            model.enable_adapters(state.get("adapter_rank", 0))
+        model.load_ttt_state(ttt_state)
+
     def run_command(self, command: str, args: list):
         if command == "run": self.cmd_run(args)
         elif command == "learn": self.cmd_learn(args)
+        elif command == "learn-batch": self.cmd_learn_batch(args)
         elif command == "interactive": self.cmd_interactive()
-        elif command == "reset": self.cmd_reset()
-        else: print("Commands: run, learn, interactive, reset")
+        elif command == "ask": self.cmd_ask(args)
+        elif command == "serve": self.cmd_serve(args)
+        elif command == "docs": self.cmd_docs()
+        elif command == "use": self.cmd_use(args)
+        elif command == "reset": self.cmd_reset(args)
+        else: print("Commands: run, learn, learn-batch, interactive, ask, docs, use, reset, serve")
 
     def cmd_run(self, args):
         self.cmd_learn(args)
         self.cmd_interactive()
 
+    def parse_learn_args(self, args):
+        parser = argparse.ArgumentParser(prog="learn")
+        parser.add_argument("file")
+        self.add_training_args(parser)
+        parser.add_argument("--no-cache", action="store_true",
+                            help="Re-extract and re-tokenize even if this file was chunked before")
+        parser.add_argument("--force", action="store_true",
+                            help="Relearn even if this text is already in the document store")
+        start = parser.add_mutually_exclusive_group()
+        start.add_argument("--resume", action="store_true",
+                           help="Continue from the saved session (weights + optimizer state)")
+        start.add_argument("--update", action="store_true",
+                           help="File changed since the session learned it: train only new/edited chunks "
+                                "(plus a replay sample) on top of the session's weights")
+        parser.add_argument("--replay", type=float, default=0.25,
+                            help="Unchanged chunks replayed per changed chunk with --update")
+        parser.add_argument("--save-optimizer", action="store_true",
+                            help="Store optimizer state in the session file")
+        self.add_profile_args(parser)
+        return parser.parse_args(args)
+
+    def parse_learn_batch_args(self, args):
+        parser = argparse.ArgumentParser(prog="learn-batch")
+        parser.add_argument("source", help="Directory (searched recursively) or glob of .pdf/.txt/.md files")
+        self.add_training_args(parser)
+        parser.add_argument("--no-cache", action="store_true",
+                            help="Re-extract and re-tokenize even for files chunked before")
+        parser.add_argument("--force", action="store_true",
+                            help="Relearn documents already in the store")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Processes extracting and chunking ahead of training (default: CPU count)")
+        parser.add_argument("--prefetch", type=int, default=4,
+                            help="Documents prepared ahead of the one being trained")
+        parser.add_argument("--summary", metavar="FILE",
+                            help="Write per-document results as JSON")
+        self.add_profile_args(parser)
+        return parser.parse_args(args)
+
+    @staticmethod
+    def add_training_args(parser):
+        parser.add_argument("--epochs", type=int, default=20)
+        parser.add_argument("--lr", type=float, default=5e-4)
+        parser.add_argument("--lr-schedule", default="constant", choices=["constant", "linear", "cosine"])
+        parser.add_argument("--patience", type=int, default=3,
+                            help="Stop after N epochs without loss improvement (0 = run all epochs)")
+        parser.add_argument("--min-delta", type=float, default=1e-3,
+                            help="Loss drop that counts as an improvement")
+        parser.add_argument("--target-loss", type=float, default=None,
+                            help="Stop revisiting chunks once their loss is at or below this")
+        parser.add_argument("--max-time", type=float, default=None,
+                            help="Wall-clock budget in seconds, e.g. --max-time 60")
+        parser.add_argument("--max-tokens", type=int, default=None,
+                            help="Budget of trained tokens")
+        parser.add_argument("--no-focus", action="store_true",
+                            help="Under a budget, keep full passes instead of focusing on high-loss chunks")
+        parser.add_argument("--chunk-size", type=int, default=512,
+                            help="Tokens per training chunk (2048 fits 16GB with --checkpoint-activations)")
+        parser.add_argument("--checkpoint-activations", action="store_true",
+                            help="Recompute TTT-block activations in backward to cut peak memory")
+        parser.add_argument("--batch-size", type=int, default=1,
+                            help="Chunks stacked into one padded micro-batch")
+        parser.add_argument("--accumulation-steps", type=int, default=1,
+                            help="Micro-batches per optimizer step")
+        parser.add_argument("--pack", action="store_true",
+                            help="Pack short chunks into shared rows instead of padding them")
+        parser.add_argument("--stride", type=int, default=None,
+                            help="Start a chunk every N tokens so chunks overlap (default: no overlap)")
+        parser.add_argument("--boundary", default="token", choices=["token", "sentence", "paragraph"],
+                            help="Snap chunk ends to sentence or paragraph boundaries")
+        parser.add_argument("--dedup", action="store_true",
+                            help="Skip repeated chunks and PDF header/footer lines")
+        parser.add_argument("--objective", choices=["lm", "masked_span", "salient"], default="lm",
+                            help="Train on every token, random spans, or numbers/named entities only")
+        parser.add_argument("--mask-ratio", type=float, default=0.15,
+                            help="Fraction of tokens trained on with --objective masked_span")
+        parser.add_argument("--update-mode", choices=["backprop", "local"], default="backprop",
+                            help="backprop: AdamW on the LM loss; local: each TTT layer updates W_h inside the forward pass")
+        parser.add_argument("--local-lr", type=float, default=1e-3,
+                            help="Step size for --update-mode local")
+        parser.add_argument("--data-parallel", type=int, default=1, metavar="N",
+                            help="Train in N CPU processes (gloo), sharding chunks and all-reducing TTT gradients")
+        parser.add_argument("--adapter-rank", type=int, default=0,
+                            help="Learn a low-rank W_h delta of this rank (0 = full W_h updates)")
+        parser.add_argument("--session-dtype", default=None, choices=["fp32", "fp16", "bf16"],
+                            help="Downcast stored deltas to shrink session/store files")
+
+    @staticmethod
+    def add_profile_args(parser):
+        parser.add_argument("--profile", metavar="FILE",
+                            help="Write per-stage timings, memory peaks and events as JSON")
+        parser.add_argument("--trace", metavar="FILE",
+                            help="Write a Chrome trace (open in chrome://tracing or Perfetto)")
+
+    @contextmanager
+    def profiling(self, opts):
+        """Collect stage timings while the block runs if --profile/--trace was given."""
+        if not (opts.profile or opts.trace):
+            yield
+            return
+        t0 = time.perf_counter()
+        with Profiler() as profiler:
+            try:
+                yield
+            finally:
+                if opts.profile: profiler.to_json(opts.profile)
+                if opts.trace: profiler.to_chrome_trace(opts.trace)
+                self.print_profile(profiler, time.perf_counter() - t0)
+
+    @staticmethod
+    def print_profile(profiler, wall_seconds):
+        print(f"\n{'stage':<24}{'count':>7}{'total s':>10}{'share':>8}")
+        summary = sorted(profiler.summary().items(), key=lambda kv: -kv[1]["total_seconds"])
+        for name, entry in summary:
+            share = entry["total_seconds"] / wall_seconds if wall_seconds > 0 else 0.0
+            print(f"{name:<24}{entry['count']:>7}{entry['total_seconds']:>10.2f}{share:>8.1%}")
+        peaks = Profiler.memory()
+        print("Peak memory: " + ", ".join(f"{k} {v / 2**20:.0f} MiB" for k, v in peaks.items()))
+
     def cmd_learn(self, args):
         if not args: print("Usage: run <file>"); return
-        file_path = args[0]
+        opts = self.parse_learn_args(args)
+        with self.profiling(opts):
+            self.learn(opts)
+
+    def learn(self, opts):
+        file_path = opts.file
         
         if torch.cuda.is_available(): torch.cuda.empty_cache()
-        model = self.get_model()
         
-        with open(file_path, 'r', encoding='utf-8') as f: text = f.read()
-        chunker = DocumentChunker(self.tokenizer, chunk_size=512)
-        chunks = chunker.chunk(text)
+        # Resume only if the saved session was learned from the same file
+        resume_state = None
+        if opts.resume and self.load_session():
+            if self.document.filename != os.path.basename(file_path):
+                print(f"Session is for {self.document.filename}; starting over.")
+            elif self.model.adapter_rank != opts.adapter_rank:
+                print(f"Session uses adapter rank {self.model.adapter_rank}; starting over.")
+            else:
+                resume_state = self.trainer_state or {}
+        # Update only from a session learned from this file, with chunk hashes to diff against
+        previous = None
+        if opts.update and self.load_session():
+            if self.document.filename != os.path.basename(file_path):
+                print(f"Session is for {self.document.filename}; learning from scratch.")
+            elif self.model.adapter_rank != opts.adapter_rank:
+                print(f"Session uses adapter rank {self.model.adapter_rank}; learning from scratch.")
+            elif any(c.token_hash is None for c in self.document.chunks):
+                print("Session predates chunk hashes; learning from scratch.")
+            else:
+                previous = self.document
+        elif opts.update:
+            print("No saved session to update; learning from scratch.")
+        model = self.get_model()
+        if resume_state is None and model.adapter_rank != opts.adapter_rank:
+            model.enable_adapters(opts.adapter_rank)
+        if active_profiler():
+            active_profiler().attach(model)
         
-        self.document = Document(
-            id=os.path.basename(file_path), filename=os.path.basename(file_path),
-            page_count=1, total_tokens=sum(c.token_count for c in chunks), chunks=chunks
+        # Same bytes, tokenizer and chunking as before: reuse the cached chunks
+        is_pdf = file_path.lower().endswith(".pdf")
+        store = self.get_store()
+        source_hash = TTTStateStore.file_hash(file_path)
+        cache = None if opts.no_cache else self.get_chunk_cache()
+        cache_key = ChunkCache.make_key(
+            source_hash, self.tokenizer, opts.chunk_size, opts.stride, opts.boundary, opts.dedup
         )
+        cached = cache.get(cache_key) if cache is not None else None
+        
+        # PDFs are streamed page by page; text files are read whole
+        if cached is not None:
+            content_hash = cached.content_hash
+        elif is_pdf:
+            parser = PDFParser()
+            page_count = parser.page_count(file_path)
+            content_hash = store.find_source(source_hash)
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f: text = f.read()
+            page_count = 1
+            content_hash = TTTStateStore.content_hash(text)
+        
+        # Same text learned before: swap its state in and skip training
+        if content_hash in store and resume_state is None and not opts.force:
+            store.activate(model, content_hash)
+            self.document = store.load_document(content_hash)
+            print(f"Already learned {self.document.filename} ({content_hash[:12]}); skipping training.")
+            self.save_session()
+            return
+        
+        if cached is not None:
+            self.document = cached
+            self.document.id = self.document.filename = os.path.basename(file_path)
+            print(f"Using cached chunks ({len(cached.chunks)} chunks, {cached.total_tokens} tokens).")
+        else:
+            chunker = DocumentChunker(
+                self.tokenizer, chunk_size=opts.chunk_size, decode_text=False,
+                stride=opts.stride, boundary=opts.boundary, dedup=opts.dedup
+            )
+            self.document = Document(
+                id=os.path.basename(file_path), filename=os.path.basename(file_path),
+                page_count=page_count, total_tokens=0, chunks=[], content_hash=content_hash
+            )
+            if is_pdf:
+                page_hasher = hashlib.sha256()
+                chunk_stream = chunker.chunk_pages(self._hashed_pages(parser.iter_pages(file_path), page_hasher))
+            else:
+                self.document.chunks = chunker.chunk(text)
+                self.document.total_tokens = sum(c.token_count for c in self.document.chunks)
 
-        epochs = 20
-        lr = 5e-4  # 0.0005
+        epochs = opts.epochs
+        lr = opts.lr
 
-        print(f"\nTraining for {epochs} epochs (LR: {lr})...")
+        print(f"\nTraining for {epochs} epochs (LR: {lr}, schedule: {opts.lr_schedule})...")
         
-        model.reset_learning()
+        # Weights are about to diverge from whatever stored state was active
+        store.active_key = None
+        if resume_state is None and previous is None:
+            model.reset_learning()
         if torch.cuda.is_available(): torch.cuda.empty_cache()
         
-        config = LearningConfig(inner_lr=lr, chunk_size=512, mask_ratio=0.0)
-        trainer = TTTTrainer(model, self.tokenizer, config)
-        
-        pbar = tqdm(total=len(chunks) * epochs)
-        final_metrics = None
+        config = self.learning_config(opts, replay_ratio=opts.replay)
+        world_size = opts.data_parallel
+        if resume_state and world_size > 1:
+            print("--resume continues in a single process.")
+            world_size = 1
         
-        for _ in range(epochs):
-            final_metrics = trainer.train_on_document(self.document, progress_callback=lambda i,t,l: pbar.update(1))
+        streaming = is_pdf and cached is None
+        if streaming and resume_state is None and previous is None and world_size == 1:
+            # First epoch trains on chunks while later pages are still being extracted
+            trainer = TTTTrainer(model, self.tokenizer, config)
+            pbar = tqdm(unit="chunk")
+            metrics = trainer.train_streaming(self.document, chunk_stream, progress_callback=lambda i,t,l: pbar.update(1))
+            pbar.close()
+        else:
+            if streaming:
+                self.document.chunks = list(chunk_stream)
+                self.document.total_tokens = sum(c.token_count for c in self.document.chunks)
+            if previous is not None:
+                changed, _ = TTTTrainer.changed_chunks(self.document, previous)
+                print(f"Update: {len(changed)} of {len(self.document.chunks)} chunks changed.")
+            if world_size > 1:
+                print(f"Data-parallel over {world_size} processes ({default_threads(world_size)} threads each).")
+            # Rank 0's share of the chunks when data-parallel
+            remaining_epochs = max(0, epochs - (resume_state or {}).get("epochs_completed", 0))
+            total = None if previous is not None else -(-len(self.document.chunks) // world_size) * remaining_epochs
+            pbar = tqdm(total=total, unit="chunk")
+            progress = lambda i,t,l: pbar.update(1)
             
-        pbar.close()
-        print(f"Final Loss: {final_metrics.final_loss:.4f}")
+            def run(trainer):
+                if resume_state:
+                    trainer.load_state_dict(resume_state)
+                    print(f"Resuming after {trainer.epochs_completed} of {epochs} epochs.")
+                if previous is not None:
+                    return trainer.train_update(self.document, previous, progress_callback=progress)
+                return trainer.train(self.document, progress_callback=progress, resume=bool(resume_state))
+            
+            trainer, metrics = train_data_parallel(model, self.tokenizer, config, world_size, run)
+            pbar.close()
+        trainer.clear_cache()
+        if streaming:
+            content_hash = page_hasher.hexdigest()
+            self.document.content_hash = content_hash
+        if cache is not None and cached is None:
+            cache.put(cache_key, self.document)
+        
+        if metrics.stop_reason:
+            print(f"Stopped after {len(metrics.loss_history)} epochs ({metrics.stop_reason}).")
+        print(f"Loss: {metrics.initial_loss:.4f} -> {metrics.final_loss:.4f} | "
+              f"{metrics.tokens_processed} tokens in {metrics.learning_time_seconds:.1f}s | "
+              f"|dW_h| = {metrics.weight_delta_norm:.4f}")
         
         model.clear_context()
-        self.save_session()
+        store.put(content_hash, model.get_ttt_state(as_delta=True), self.document,
+                  model.adapter_rank, dtype=opts.session_dtype, source_hash=source_hash)
+        store.active_key = content_hash
+        self.trainer_state = trainer.state_dict() if opts.save_optimizer else None
+        self.save_session(self.trainer_state, dtype=opts.session_dtype)
+
+    def cmd_learn_batch(self, args):
+        if not args: print("Usage: learn-batch <dir|glob>"); return
+        opts = self.parse_learn_batch_args(args)
+        with self.profiling(opts):
+            self.learn_batch(opts)
+
+    def learn_batch(self, opts):
+        """Learn every file into its own stored state; extraction/chunking runs ahead in worker processes."""
+        paths = find_documents(opts.source)
+        if not paths: print(f"No .pdf/.txt/.md files found in {opts.source}"); return
+        model = self.get_model()
+        if model.adapter_rank != opts.adapter_rank:
+            model.enable_adapters(opts.adapter_rank)
+        if active_profiler():
+            active_profiler().attach(model)
+        store = self.get_store()
+        cache = None if opts.no_cache else self.get_chunk_cache()
+        config = self.learning_config(opts)
+        # Files learned before are only hashed, not extracted again
+        known_sources = {} if opts.force else {
+            entry["source_hash"]: entry["key"] for entry in store.list_documents() if entry.get("source_hash")
+        }
+        prefetcher = DocumentPrefetcher(
+            self.tokenizer, workers=opts.workers, prefetch=opts.prefetch,
+            cache_dir=None if cache is None else cache.root, known_sources=known_sources,
+            chunk_size=opts.chunk_size, stride=opts.stride, boundary=opts.boundary, dedup=opts.dedup
+        )
+        print(f"Learning {len(paths)} documents ({opts.epochs} epochs each, LR: {opts.lr})...")
+        
+        results, last_learned = [], None
+        t0 = time.perf_counter()
+        pbar = tqdm(total=len(paths), unit="doc")
+        for prepared in prefetcher.run(paths):
+            row = {"file": prepared.path, "prepare_seconds": round(prepared.prepare_seconds, 3)}
+            document = prepared.document
+            if prepared.error:
+                row.update(status="failed", error=prepared.error)
+            elif prepared.stored_key is not None:
+                row.update(status="skipped", key=prepared.stored_key)
+            elif document.content_hash in store and not opts.force:
+                row.update(status="skipped", key=document.content_hash)
+            elif not document.chunks:
+                row.update(status="failed", error="no text")
+            else:
+                try:
+                    store.active_key = None
+                    model.reset_learning()
+                    trainer, metrics = train_data_parallel(
+                        model, self.tokenizer, config, opts.data_parallel, lambda t: t.train(document)
+                    )
+                    trainer.clear_cache()
+                    model.clear_context()
+                    store.put(document.content_hash, model.get_ttt_state(as_delta=True), document,
+                              model.adapter_rank, dtype=opts.session_dtype, source_hash=prepared.source_hash)
+                    store.active_key = last_learned = document.content_hash
+                    if cache is not None and not prepared.cached:
+                        cache.put(prepared.cache_key, document)
+                    row.update(
+                        status="learned", key=document.content_hash, chunks=len(document.chunks),
+                        tokens=document.total_tokens, initial_loss=metrics.initial_loss,
+                        final_loss=metrics.final_loss, epochs=len(metrics.loss_history),
+                        train_seconds=round(metrics.learning_time_seconds, 3), stop_reason=metrics.stop_reason
+                    )
+                except Exception as e:
+                    row.update(status="failed", error=f"{type(e).__name__}: {e}")
+            results.append(row)
+            pbar.update(1)
+            pbar.set_postfix_str(f"{os.path.basename(prepared.path)}: {row['status']}")
+        pbar.close()
+        
+        self.print_batch_summary(results, time.perf_counter() - t0)
+        if opts.summary:
+            with open(opts.summary, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        # The last learned document becomes the session's
+        if last_learned is not None:
+            self.document = store.load_document(last_learned)
+            self.trainer_state = None
+            self.save_session(dtype=opts.session_dtype)
+
+    @staticmethod
+    def print_batch_summary(results, wall_seconds):
+        counts = {status: sum(r["status"] == status for r in results) for status in ("learned", "skipped", "failed")}
+        learned = [r for r in results if r["status"] == "learned"]
+        tokens = sum(r["tokens"] for r in learned)
+        train_seconds = sum(r["train_seconds"] for r in learned)
+        print(f"\n{counts['learned']} learned, {counts['skipped']} skipped (already in store), "
+              f"{counts['failed']} failed in {wall_seconds:.1f}s")
+        if learned:
+            print(f"{tokens} tokens trained in {train_seconds:.1f}s "
+                  f"({train_seconds / wall_seconds:.0%} of wall time spent training)")
+            for r in learned:
+                print(f"  {os.path.basename(r['file'])}: {r['chunks']} chunks, loss {r['initial_loss']:.4f} -> "
+                      f"{r['final_loss']:.4f} in {r['train_seconds']:.1f}s")
+        for r in results:
+            if r["status"] == "failed":
+                print(f"  FAILED {r['file']}: {r['error']}")
+
+    @staticmethod
+    def learning_config(opts, **overrides) -> LearningConfig:
+        # Layers before the first TTT block are frozen: compute them once per chunk
+        return LearningConfig(
+            inner_lr=opts.lr, chunk_size=opts.chunk_size, mask_ratio=opts.mask_ratio, cache_prefix=True,
+            objective=opts.objective, update_mode=opts.update_mode, local_lr=opts.local_lr,
+            activation_checkpointing=opts.checkpoint_activations,
+            batch_size=opts.batch_size, accumulation_steps=opts.accumulation_steps, pack_chunks=opts.pack,
+            epochs=opts.epochs, lr_schedule=opts.lr_schedule,
+            plateau_patience=opts.patience, plateau_min_delta=opts.min_delta,
+            target_loss=opts.target_loss, time_budget_seconds=opts.max_time,
+            token_budget=opts.max_tokens, focus_hard_chunks=not opts.no_focus,
+            **overrides
+        )
+
+    @staticmethod
+    def _hashed_pages(pages, hasher):
+        """Pass pages through while hashing their text exactly like content_hash("\\n".join(...))."""
+        for i, (page_number, page_text) in enumerate(pages):
+            if i: hasher.update(b"\n")
+            hasher.update(page_text.encode("utf-8"))
+            yield page_number, page_text
 
     def cmd_interactive(self):
         if not self.model and not self.load_session(): 
@@ -130,12 +562,91 @@ class CLInterface:
             if q.lower() in ('exit', 'quit'): break
             if not q: continue
             
-            ans = gen.generate(q, max_tokens=150)
-            print(f">> {ans.text}")
+            print(">> ", end="", flush=True)
+            stream = gen.stream(q, max_tokens=150)
+            for piece in stream:
+                print(piece, end="", flush=True)
+            ans = stream.answer
+            print(f"\n   [{ans.tokens_generated} tokens, first token {ans.time_to_first_token_seconds or 0:.2f}s, "
+                  f"{ans.tokens_per_second or 0:.1f} tok/s]")
             
-    def cmd_reset(self):
-        if os.path.exists(self.SESSION_FILE): os.remove(self.SESSION_FILE)
+    def cmd_ask(self, args):
+        parser = argparse.ArgumentParser(prog="ask")
+        parser.add_argument("question", nargs="*")
+        parser.add_argument("--questions", help="File with one question per line")
+        parser.add_argument("--batch-size", type=int, default=8)
+        parser.add_argument("--max-tokens", type=int, default=150)
+        parser.add_argument("--stop", action="append", help="Stop string (repeatable)")
+        self.add_profile_args(parser)
+        opts = parser.parse_args(args)
+        if not opts.question and not opts.questions:
+            print("Usage: ask <question> | ask --questions <file>"); return
+        if not self.model and not self.load_session():
+            print("No model loaded."); return
+        with self.profiling(opts):
+            self.ask(opts)
+
+    def ask(self, opts):
+        gen = Generator(self.model, self.tokenizer)
+        if not opts.questions:
+            print(">> ", end="", flush=True)
+            for piece in gen.stream(" ".join(opts.question), max_tokens=opts.max_tokens, stop=opts.stop):
+                print(piece, end="", flush=True)
+            print()
+            return
+        
+        with open(opts.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        t0 = time.time()
+        answers = gen.generate_many(questions, batch_size=opts.batch_size, max_tokens=opts.max_tokens)
+        elapsed = time.time() - t0
+        
+        for q, ans in zip(questions, answers):
+            print(f"\nQ: {q}\n>> {ans.text}")
+        total = sum(a.tokens_generated for a in answers)
+        print(f"\n{len(questions)} questions, {total} tokens in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.1f} tok/s)")
+
+    def cmd_serve(self, args):
+        parser = argparse.ArgumentParser(prog="serve")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        opts = parser.parse_args(args)
+        
+        from daemon import ModelDaemon
+        self.get_model()
+        if self.load_session():
+            print(f"Active document: {self.document.filename}")
+        ModelDaemon(self, host=opts.host, port=opts.port).serve_forever()
+
+    def cmd_docs(self):
+        store = TTTStateStore(self.STORE_DIR)
+        docs = store.list_documents()
+        if not docs: print("No learned documents."); return
+        for entry in docs:
+            mode = f"rank {entry['adapter_rank']}" if entry["adapter_rank"] else "full W_h"
+            print(f"{entry['key'][:12]}  {entry['filename']}  {entry['total_tokens']} tokens  ({mode})")
+
+    def cmd_use(self, args):
+        if not args: print("Usage: use <filename|hash>"); return
+        store = self.get_store()
+        key = store.resolve(args[0])
+        if key is None: print(f"No unique learned document matches '{args[0]}'."); return
+        
+        store.activate(self.model, key)
+        self.model.clear_context()
+        self.document = store.load_document(key)
+        self.trainer_state = None
+        self.save_session()
+        print(f"Active document: {self.document.filename} ({key[:12]})")
+
+    def cmd_reset(self, args=()):
+        for path in (self.SESSION_FILE, self.OPTIMIZER_FILE, self.LEGACY_SESSION_FILE):
+            if os.path.exists(path): os.remove(path)
+        if "--all" in args:
+            # Also forget every stored document
+            TTTStateStore(self.STORE_DIR).clear()
         if self.model: self.model.reset_learning()
+        if self.store: self.store.active_key = None
         print("Reset.")
 
 def main():
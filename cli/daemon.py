@@ -0,0 +1,243 @@
+"""
+Long-lived model daemon: keeps the patched Qwen model resident and serves
+learn/ask/reset requests over localhost HTTP.
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from daemon_client import DAEMON_FILE
+from generator import BatchQueue, Generator
+
+# Commands that change W_h (or the active document) and need exclusive access
+EXCLUSIVE_COMMANDS = ("learn", "learn-batch", "reset", "use")
+SHARED_COMMANDS = ("docs", "ask")
+
+
+class FairRWLock:
+    """
+    FIFO reader/writer lock.
+
+    Requests are served in arrival order: consecutive readers run together,
+    a writer waits for in-flight readers to finish, and readers that arrive
+    after a writer queue behind it (no writer starvation).
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._readers = 0
+        self._writer = False
+
+    @contextmanager
+    def read(self):
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            self._cond.wait_for(lambda: self._queue[0] is ticket and not self._writer)
+            self._queue.popleft()
+            self._readers += 1
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            self._cond.wait_for(
+                lambda: self._queue[0] is ticket and not self._writer and self._readers == 0
+            )
+            self._queue.popleft()
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class _ThreadStream:
+    """Write-through stream that sends a thread's writes to its capture buffer, if it has one."""
+
+    def __init__(self, local, default):
+        self._local = local
+        self._default = default
+
+    def _target(self):
+        return getattr(self._local, "buffer", None) or self._default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+class OutputCapture:
+    """
+    Per-thread stdout/stderr capture.
+
+    redirect_stdout swaps sys.stdout for the whole process, so commands
+    running side by side under the read lock would print into each other's
+    buffers. While any capture is active, sys.stdout/sys.stderr are proxies
+    routing each capturing thread to its own buffer; the originals come back
+    when the last capture ends.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active = 0
+        self._saved = None
+
+    @contextmanager
+    def capture(self, buffer):
+        with self._lock:
+            if self._active == 0:
+                self._saved = (sys.stdout, sys.stderr)
+                sys.stdout = _ThreadStream(self._local, self._saved[0])
+                sys.stderr = _ThreadStream(self._local, self._saved[1])
+            self._active += 1
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+            with self._lock:
+                self._active -= 1
+                if self._active == 0:
+                    sys.stdout, sys.stderr = self._saved
+                    self._saved = None
+
+
+class ModelDaemon:
+    """Wraps a CLInterface whose model stays loaded between requests."""
+
+    def __init__(self, cli, host: str = "127.0.0.1", port: int = 0,
+                 max_batch_size: int = 8, max_wait_seconds: float = 0.05, max_tokens: int = 150):
+        self.cli = cli
+        self.lock = FairRWLock()
+        self.output = OutputCapture()
+        self.generator = None
+        self.max_tokens = max_tokens
+        # Concurrent /ask requests are grouped into batched generate calls
+        self.queue = BatchQueue(self._answer_batch, max_batch_size, max_wait_seconds)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def serve_forever(self):
+        host, port = self.address
+        with open(DAEMON_FILE, "w", encoding="utf-8") as f:
+            json.dump({"host": host, "port": port, "pid": os.getpid()}, f)
+        print(f"Serving on http://{host}:{port} (Ctrl+C to stop)")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if os.path.exists(DAEMON_FILE):
+                os.remove(DAEMON_FILE)
+
+    def run_command(self, command: str, args: list) -> str:
+        """Run a CLI command in-process and return what it printed."""
+        if command not in EXCLUSIVE_COMMANDS + SHARED_COMMANDS:
+            raise ValueError(f"Unsupported command: {command}")
+        lock = self.lock.write() if command in EXCLUSIVE_COMMANDS else self.lock.read()
+        with lock:
+            buf = io.StringIO()
+            with self.output.capture(buf):
+                try:
+                    self.cli.run_command(command, args)
+                except SystemExit:
+                    # argparse usage errors; the message is already in buf
+                    pass
+            return buf.getvalue()
+
+    def ask(self, question: str) -> dict:
+        if not self.cli.document:
+            raise ValueError("No document learned yet.")
+        ans = asyncio.run_coroutine_threadsafe(self.queue.submit(question), self.loop).result()
+        return {
+            "text": ans.text,
+            "tokens_generated": ans.tokens_generated,
+            "generation_time_seconds": ans.generation_time_seconds,
+            "tokens_per_second": ans.tokens_per_second,
+        }
+
+    def _answer_batch(self, questions: list) -> list:
+        # Shared: any number of batches, but never while W_h is being written
+        with self.lock.read():
+            if self.generator is None:
+                self.generator = Generator(self.cli.model, self.cli.tokenizer)
+            return self.generator.generate_batch(questions, max_tokens=self.max_tokens)
+
+    def health(self) -> dict:
+        document = self.cli.document
+        return {"status": "ok", "document": document.filename if document else None}
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/health":
+                    self._reply(200, daemon.health())
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    if self.path == "/command":
+                        result = {"output": daemon.run_command(payload["command"], payload.get("args", []))}
+                    elif self.path == "/ask":
+                        result = daemon.ask(payload["question"])
+                    elif self.path == "/shutdown":
+                        threading.Thread(target=daemon.server.shutdown, daemon=True).start()
+                        result = {"status": "stopping"}
+                    else:
+                        self._reply(404, {"error": "not found"})
+                        return
+                except Exception as e:
+                    self._reply(500, {"error": str(e)})
+                    return
+                self._reply(200, result)
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
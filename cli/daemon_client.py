@@ -0,0 +1,87 @@
+"""
+Thin client for a running `serve` daemon.
+
+Standard library only: cli.py imports this before torch/transformers so
+commands can be forwarded without loading anything heavy.
+"""
+
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from typing import Optional
+
+DAEMON_FILE = ".learn_doc_daemon.json"
+FORWARDED_COMMANDS = ("learn", "learn-batch", "ask", "interactive", "run", "reset", "docs", "use", "stop")
+
+
+def find_daemon() -> Optional[str]:
+    """Base URL of a live daemon for this directory, or None."""
+    if os.environ.get("LEARN_DOC_NO_DAEMON") or not os.path.exists(DAEMON_FILE):
+        return None
+    try:
+        with open(DAEMON_FILE, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        url = f"http://{info['host']}:{info['port']}"
+        with urllib.request.urlopen(f"{url}/health", timeout=1) as resp:
+            return url if resp.status == 200 else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def post(url: str, path: str, payload: dict) -> dict:
+    """POST JSON and return the decoded reply (raises RuntimeError on errors)."""
+    req = urllib.request.Request(
+        f"{url}{path}", data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.loads(e.read().decode("utf-8")).get("error", str(e))) from e
+
+
+def forward_command(argv: list) -> bool:
+    """
+    Run argv against a daemon if one is up. Returns False to fall back to
+    running locally.
+    """
+    if not argv or argv[0] not in FORWARDED_COMMANDS:
+        return False
+    url = find_daemon()
+    if url is None:
+        return False
+
+    command, args = argv[0], argv[1:]
+    # The daemon may run from another directory
+    args = [os.path.abspath(a) if os.path.exists(a) else a for a in args]
+    try:
+        if command == "interactive":
+            interactive(url)
+        elif command == "run":
+            print(post(url, "/command", {"command": "learn", "args": args})["output"], end="")
+            interactive(url)
+        elif command == "ask" and not any(a.startswith("-") for a in args):
+            print(f">> {post(url, '/ask', {'question': ' '.join(args)})['text']}")
+        elif command == "stop":
+            post(url, "/shutdown", {})
+            print("Daemon stopped.")
+        else:
+            print(post(url, "/command", {"command": command, "args": args})["output"], end="")
+    except RuntimeError as e:
+        print(f"Daemon error: {e}", file=sys.stderr)
+    return True
+
+
+def interactive(url: str) -> None:
+    """Chat loop where every question is answered by the daemon."""
+    print("\nChat Mode (daemon) (Type 'exit')")
+    while True:
+        q = input("\nAsk> ").strip()
+        if q.lower() in ('exit', 'quit'): break
+        if not q: continue
+
+        ans = post(url, "/ask", {"question": q})
+        print(f">> {ans['text']}")
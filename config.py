@@ -1,6 +1,6 @@
 """Simple data structures for learn-doc"""
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import List, Optional, Sequence
 from enum import Enum
 
 
@@ -18,11 +18,13 @@ class DocumentStatus(str, Enum):
 class DocumentChunk:
     """Single chunk of document text"""
     index: int
-    text: str
-    token_ids: List[int]
+    text: str  # "" when the chunker was told not to decode
+    token_ids: Sequence[int]  # list or int32 numpy view into a shared buffer
     token_count: int
     start_page: Optional[int] = None
     end_page: Optional[int] = None
+    overlap_tokens: int = 0  # Leading tokens shared with the previous chunk (context only, not trained on)
+    token_hash: Optional[str] = None  # Hash of token_ids, so `learn --update` can tell which chunks changed
 
 
 @dataclass
@@ -35,6 +37,7 @@ class Document:
     chunks: List[DocumentChunk]
     status: DocumentStatus = DocumentStatus.READY
     error_message: Optional[str] = None
+    content_hash: Optional[str] = None  # sha256 of the source text (document store key)
 
 
 @dataclass
@@ -43,7 +46,32 @@ class LearningConfig:
     inner_lr: float = 0.01
     chunk_size: int = 2048
     max_grad_norm: float = 1.0
-    mask_ratio: float = 0.15  # Percentage of tokens to mask
+    mask_ratio: float = 0.15  # Fraction of tokens the "masked_span" objective trains on
+    objective: str = "lm"  # "lm" (every token), "masked_span" or "salient" (numbers / named entities)
+    span_length: int = 3  # Tokens per span for the "masked_span" objective
+    cache_prefix: bool = False  # Reuse frozen-prefix activations across epochs
+    cache_max_memory_mb: int = 1024  # Spill cached activations to disk beyond this (split between data-parallel ranks)
+    cache_dir: Optional[str] = None  # Spill directory (default: temp dir)
+    batch_size: int = 1  # Rows per micro-batch
+    accumulation_steps: int = 1  # Micro-batches per optimizer step
+    pack_chunks: bool = False  # Pack short chunks into shared rows instead of padding
+    epochs: int = 20  # Passes over the document in TTTTrainer.train
+    lr_schedule: str = "constant"  # "constant", "linear" or "cosine"
+    warmup_steps: int = 0  # Linear LR warmup (optimizer steps)
+    min_lr_ratio: float = 0.1  # Final LR as a fraction of inner_lr for decaying schedules
+    plateau_patience: int = 0  # Stop after this many epochs without improvement (0 = off)
+    plateau_min_delta: float = 1e-3  # Minimum loss drop that counts as improvement
+    target_loss: Optional[float] = None  # Chunks at or below this loss are not revisited
+    time_budget_seconds: Optional[float] = None  # Wall-clock cap for TTTTrainer.train
+    token_budget: Optional[int] = None  # Cap on tokens trained in TTTTrainer.train
+    focus_hard_chunks: bool = True  # Under a tight budget, revisit only the highest-loss chunks
+    loss_chunk_size: int = 1024  # LM loss in blocks of this many positions, never full [seq, vocab] logits (0 = off)
+    activation_checkpointing: bool = False  # Recompute TTT-block activations in backward to save memory
+    update_mode: str = "backprop"  # "backprop" (AdamW on the LM loss) or "local" (per-layer W_h steps inside the forward)
+    local_lr: float = 1e-3  # Step size of local W_h updates
+    local_batch_size: int = 16  # Positions per local W_h step
+    replay_ratio: float = 0.25  # Unchanged chunks replayed per changed chunk in TTTTrainer.train_update
+    anchor_strength: float = 0.01  # Anchor penalty weight ("backprop") / decay toward the initial W_h ("local")
 
 
 @dataclass
@@ -53,9 +81,10 @@ class LearningMetrics:
     final_loss: float
     loss_history: List[float]
     chunks_processed: int
-    tokens_processed: int
+    tokens_processed: int  # Positions a loss was computed on (see LearningConfig.objective)
     learning_time_seconds: float
     weight_delta_norm: float
+    stop_reason: Optional[str] = None  # "plateau", "target_loss", "budget" or None (all epochs ran)
 
 
 @dataclass
@@ -64,3 +93,5 @@ class Answer:
     text: str
     tokens_generated: int
     generation_time_seconds: float
+    time_to_first_token_seconds: Optional[float] = None
+    tokens_per_second: Optional[float] = None
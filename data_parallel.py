@@ -0,0 +1,224 @@
+"""
+Data-parallel TTT learning across CPU processes (torch.distributed, gloo).
+"""
+
+import os
+import socket
+import sys
+import traceback
+from dataclasses import replace
+from typing import Callable, Optional
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from config import Document, LearningConfig
+from profiling import stage
+from trainer import TTTTrainer
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        return os.cpu_count() or 1
+
+
+def default_threads(world_size: int) -> int:
+    """Intra-op threads per process so the ranks together use every core once."""
+    return max(1, available_cpus() // world_size)
+
+
+class DataParallelTTTTrainer(TTTTrainer):
+    """
+    One rank of a data-parallel TTTTrainer.
+
+    Every rank holds the full model. Micro-batches are sharded round-robin
+    (padded by repeating from the start, as DistributedSampler does, so all
+    ranks take the same number of steps), and before each optimizer step
+    the TTT gradients, and nothing else, are averaged in one all-reduce.
+    Identical gradients and optimizer state keep W_h identical on all ranks.
+
+    Chunk losses, epoch totals and budget checks are synchronized, so every
+    rank makes the same early-stopping decisions and the collectives stay
+    in lockstep.
+    """
+
+    sync_steps = True
+
+    def __init__(self, model, tokenizer, config: LearningConfig, rank: int, world_size: int):
+        super().__init__(model, tokenizer, config)
+        self.rank = rank
+        self.world_size = world_size
+        self._grad_buffer = None
+
+    def _enable_learning(self):
+        if self.config.update_mode != "backprop":
+            raise ValueError("Data-parallel training needs update_mode='backprop'")
+        super()._enable_learning()
+
+    def _make_batches(self, chunks):
+        batches = super()._make_batches(chunks)
+        if not batches:
+            return batches
+        per_rank = -(-len(batches) // self.world_size)
+        padded = [batches[i % len(batches)] for i in range(per_rank * self.world_size)]
+        return padded[self.rank::self.world_size]
+
+    def _train_epoch(self, document: Document, batches, optimizer, set_lr, progress_callback=None,
+                     chunk_losses=None, out_of_budget=None, verbose=True):
+        """
+        TTTTrainer._train_epoch on this rank's shard, with results merged
+        across ranks. Only rank 0 reports progress and logs.
+
+        tokens stays per-rank: it feeds the budget checks, which sum it
+        across ranks in _affordable_tokens.
+        """
+        shard_losses = {}
+        loss, chunks, tokens, targets, exhausted = super()._train_epoch(
+            document, batches, optimizer, set_lr, progress_callback if self.rank == 0 else None,
+            shard_losses, out_of_budget, verbose and self.rank == 0
+        )
+        totals = torch.tensor([loss * chunks, chunks, targets, float(exhausted)], dtype=torch.float64)
+        dist.all_reduce(totals)
+        if chunk_losses is not None:
+            gathered = [None] * self.world_size
+            dist.all_gather_object(gathered, shard_losses)
+            for losses in gathered:
+                chunk_losses.update(losses)
+        loss_sum, chunks, targets, exhausted = totals.tolist()
+        return (loss_sum / chunks if chunks else 0.0), int(chunks), tokens, int(targets), exhausted > 0
+
+    def _affordable_tokens(self, t0: float, tokens_so_far: int) -> Optional[float]:
+        if self.config.token_budget is None and self.config.time_budget_seconds is None:
+            return None
+        total = torch.tensor([float(tokens_so_far)], dtype=torch.float64)
+        dist.all_reduce(total)
+        remaining = super()._affordable_tokens(t0, int(total.item()))
+        # Each rank has its own clock: agree on the tightest estimate
+        agreed = torch.tensor([float("inf") if remaining is None else remaining], dtype=torch.float64)
+        dist.all_reduce(agreed, op=dist.ReduceOp.MIN)
+        return agreed.item()
+
+    def _optimizer_step(self, optimizer, params, set_lr):
+        with stage("all_reduce"):
+            self._average_gradients(params)
+        super()._optimizer_step(optimizer, params, set_lr)
+
+    def _average_gradients(self, params) -> None:
+        """Mean of the TTT gradients over all ranks, through one flat buffer."""
+        grads = [p.grad if p.grad is not None else torch.zeros_like(p) for p in params]
+        if self._grad_buffer is None:
+            self._grad_buffer = torch.empty(sum(g.numel() for g in grads), dtype=grads[0].dtype)
+        torch.cat([g.reshape(-1) for g in grads], out=self._grad_buffer)
+        dist.all_reduce(self._grad_buffer)
+        self._grad_buffer /= self.world_size
+        offset = 0
+        for p in params:
+            mean = self._grad_buffer[offset:offset + p.numel()].view_as(p)
+            if p.grad is None:
+                p.grad = mean.clone()
+            else:
+                p.grad.copy_(mean)
+            offset += p.numel()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rank_config(config: LearningConfig, rank: int, world_size: int) -> LearningConfig:
+    """Split the prefix-cache memory budget between ranks and give each its own spill dir."""
+    return replace(
+        config,
+        cache_max_memory_mb=config.cache_max_memory_mb // world_size,
+        cache_dir=None if config.cache_dir is None else os.path.join(config.cache_dir, f"rank{rank}")
+    )
+
+
+def _run_rank(rank, world_size, port, threads, model, tokenizer, config, run):
+    torch.set_num_threads(threads)
+    dist.init_process_group(
+        "gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size
+    )
+    trainer = None
+    try:
+        trainer = DataParallelTTTTrainer(model, tokenizer, _rank_config(config, rank, world_size), rank, world_size)
+        return trainer, run(trainer)
+    finally:
+        # Ranks above 0 leave through os._exit, which skips finalizers
+        if trainer is not None:
+            trainer.clear_cache()
+        dist.destroy_process_group()
+
+
+def _worker(rank, world_size, port, threads, model, tokenizer, config, run):
+    # Rank 0 reports; the others stay quiet
+    sys.stdout = open(os.devnull, "w")
+    try:
+        _run_rank(rank, world_size, port, threads, model, tokenizer, config, run)
+        code = 0
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    sys.stderr.flush()
+    os._exit(code)
+
+
+def train_data_parallel(model, tokenizer, config: LearningConfig, world_size: int,
+                        run: Callable[[TTTTrainer], object], threads: Optional[int] = None):
+    """
+    Run `run(trainer)` on world_size ranks and return (rank-0 trainer, its result).
+
+    The calling process is rank 0; the others are forked from it, so they
+    share the already loaded model's frozen weights copy-on-write and only
+    allocate their own W_h, gradients and optimizer state. When training
+    ends, this process's model holds the learned weights (identical on
+    every rank).
+
+    config.cache_max_memory_mb is the budget of all ranks together, and
+    every rank's prefix cache is cleared when its run returns.
+
+    Args:
+        model: TTTModel on CPU
+        run: e.g. lambda trainer: trainer.train(document); called on every rank
+        threads: Intra-op threads per rank (default: available CPUs / world_size)
+
+    Example:
+        trainer, metrics = train_data_parallel(model, tokenizer, config, 8, lambda t: t.train(doc))
+    """
+    if world_size <= 1:
+        trainer = TTTTrainer(model, tokenizer, config)
+        return trainer, run(trainer)
+    if model.device.type != "cpu":
+        raise ValueError("Data-parallel training runs on CPU processes")
+    if config.update_mode != "backprop":
+        raise ValueError("Data-parallel training needs update_mode='backprop'")
+
+    threads = threads or default_threads(world_size)
+    port = _free_port()
+    ctx = mp.get_context("fork")
+    workers = [
+        ctx.Process(target=_worker, args=(rank, world_size, port, threads, model, tokenizer, config, run))
+        for rank in range(1, world_size)
+    ]
+    for worker in workers:
+        worker.start()
+
+    previous_threads = torch.get_num_threads()
+    try:
+        result = _run_rank(0, world_size, port, threads, model, tokenizer, config, run)
+    except BaseException:
+        # The other ranks would wait in a collective until the gloo timeout
+        for worker in workers:
+            worker.terminate()
+        raise
+    finally:
+        torch.set_num_threads(previous_threads)
+        for worker in workers:
+            worker.join()
+    failed = [rank for rank, worker in enumerate(workers, start=1) if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Data-parallel ranks {failed} failed")
+    return result
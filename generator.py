@@ -3,48 +3,255 @@ Generator for TTT model inference.
 """
 
 from __future__ import annotations
+import asyncio
 from time import perf_counter
+from typing import Callable, Iterator, List, Optional
 from config import Answer
+from profiling import active as active_profiler, stage
+
+# SYSTEM PROMPT: Essential for 0.5B models to separate contexts
+SYSTEM_PROMPT = (
+    "<|im_start|>system\n"
+    "You are a helpful assistant. You have learned a document via Test-Time Training.\n"
+    "1. If the user asks about the document (Whales, Crystals, 2145), use the learned information.\n"
+    "2. If the user asks general questions (People, Places, History), use your general knowledge.\n"
+    "<|im_end|>\n"
+)
 
 class Generator:
     def __init__(self, model, tokenizer) -> None:
         self.model = model
         self.tokenizer = tokenizer
     
-    def generate(self, prompt: str, max_tokens: int = 150, temperature: float = 0.4) -> Answer:
-        t0 = perf_counter()
-        
-        # SYSTEM PROMPT: Essential for 0.5B models to separate contexts
-        full_prompt = (
-            "<|im_start|>system\n"
-            "You are a helpful assistant. You have learned a document via Test-Time Training.\n"
-            "1. If the user asks about the document (Whales, Crystals, 2145), use the learned information.\n"
-            "2. If the user asks general questions (People, Places, History), use your general knowledge.\n"
-            "<|im_end|>\n"
-            f"<|im_start|>user\n{prompt}<|im_end|>\n"
-            "<|im_start|>assistant\n"
-        )
-        
-        full_output = self.model.generate(
-            full_prompt,
+    def generate(self, prompt: str, max_tokens: int = 150, temperature: float = 0.4,
+                 stop: Optional[List[str]] = None) -> Answer:
+        stream = self.stream(prompt, max_tokens, temperature, stop)
+        for _ in stream:
+            pass
+        return stream.answer
+
+    def stream(self, prompt: str, max_tokens: int = 150, temperature: float = 0.4,
+               stop: Optional[List[str]] = None) -> TextStream:
+        """
+        Answer prompt incrementally: iterate the result for text pieces.
+
+        Generation ends at <|im_end|> or as soon as any of the stop strings
+        appears (the stop string itself is not part of the answer).
+        """
+        # The system prompt's KV cache is reused across questions
+        token_ids = self.model.stream(
+            self.build_turn(prompt),
             max_new_tokens=max_tokens,
             temperature=temperature,
+            prefix=SYSTEM_PROMPT,
         )
+        return TextStream(token_ids, self.tokenizer, stop or [])
+
+    def generate_batch(self, prompts: List[str], max_tokens: int = 150, temperature: float = 0.4) -> List[Answer]:
+        """Answer several prompts with one batched model.generate call."""
+        t0 = perf_counter()
+        with stage("generate", prompts=len(prompts)):
+            # Like stream(): the cached system prompt is shared by every row
+            token_ids = self.model.generate_batch(
+                [self.build_turn(p) for p in prompts],
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                prefix=SYSTEM_PROMPT,
+            )
+        elapsed = perf_counter() - t0
         
-        # Clean output
-        generated_text = full_output
-        if "assistant\n" in generated_text:
-            generated_text = generated_text.split("assistant\n")[-1]
-            
-        generated_text = generated_text.replace("<|im_end|>", "").strip()
-        
-        t1 = perf_counter()
-        
-        return Answer(
-            text=generated_text,
-            tokens_generated=len(self.tokenizer.encode(generated_text)),
-            generation_time_seconds=t1 - t0,
+        return [
+            Answer(
+                text=self.tokenizer.decode(ids, skip_special_tokens=True).strip(),
+                tokens_generated=len(ids),
+                generation_time_seconds=elapsed,
+                tokens_per_second=len(ids) / elapsed if elapsed > 0 else None,
+            )
+            for ids in token_ids
+        ]
+
+    def generate_many(self, prompts: List[str], batch_size: int = 8, max_tokens: int = 150,
+                      temperature: float = 0.4) -> List[Answer]:
+        """
+        Answer a list of prompts in batches of batch_size.
+
+        Prompts are grouped by length so each batch needs little padding;
+        answers come back in input order.
+        """
+        order = sorted(range(len(prompts)), key=lambda i: len(self.tokenizer.encode(prompts[i])))
+        answers = [None] * len(prompts)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            batch = self.generate_batch([prompts[i] for i in idx], max_tokens, temperature)
+            for i, answer in zip(idx, batch):
+                answers[i] = answer
+        return answers
+
+    @staticmethod
+    def build_prompt(prompt: str) -> str:
+        return SYSTEM_PROMPT + Generator.build_turn(prompt)
+
+    @staticmethod
+    def build_turn(prompt: str) -> str:
+        """The per-question part of the prompt (everything after SYSTEM_PROMPT)."""
+        return (
+            f"<|im_start|>user\n{prompt}<|im_end|>\n"
+            "<|im_start|>assistant\n"
         )
         
     def compare(self, prompt: str, max_tokens: int = 150, temperature: float = 0.4):
-        pass
\ No newline at end of file
+        pass
+
+
+class TextStream:
+    """
+    One answer's text, yielded piece by piece as tokens are generated.
+
+    Once iteration finishes (or stops at a stop string), `answer` holds the
+    complete Answer with token count and timings.
+    """
+
+    def __init__(self, token_ids: Iterator[int], tokenizer, stop: List[str]):
+        self.token_ids = token_ids
+        self.tokenizer = tokenizer
+        self.stop = [s for s in stop if s]
+        self.answer: Optional[Answer] = None
+
+    def __iter__(self) -> Iterator[str]:
+        profiler = active_profiler()
+        span_start = profiler.now() if profiler else None
+        t0 = perf_counter()
+        first_token = None
+        ids: List[int] = []
+        text = ""
+        emitted = 0
+        # ids[prefix_offset:read_offset] is already in text; it is decoded again
+        # with the new tokens so merges and multi-byte characters come out right
+        prefix_offset = read_offset = 0
+        # A stop string ending in new text starts at most this far before it
+        overlap = max((len(s) for s in self.stop), default=1) - 1
+        stopped = False
+        for token in self.token_ids:
+            if first_token is None:
+                first_token = perf_counter() - t0
+            ids.append(token)
+            prefix_text = self.tokenizer.decode(ids[prefix_offset:read_offset], skip_special_tokens=True)
+            new_text = self.tokenizer.decode(ids[prefix_offset:], skip_special_tokens=True)
+            if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+                # Incomplete multi-byte character: wait for more tokens
+                continue
+            start = max(0, len(text) - overlap)
+            text += new_text[len(prefix_text):]
+            prefix_offset, read_offset = read_offset, len(ids)
+
+            cut = self._find_stop(text, start)
+            if cut >= 0:
+                text = text[:cut]
+                stopped = True
+                break
+            ready = len(text) - self._holdback(text)
+            if ready > emitted:
+                yield text[emitted:ready]
+                emitted = ready
+        # Ends the model's decode loop if we stopped early
+        if hasattr(self.token_ids, "close"):
+            self.token_ids.close()
+        if not stopped and read_offset < len(ids):
+            # Tokens still held back when generation ended
+            prefix_text = self.tokenizer.decode(ids[prefix_offset:read_offset], skip_special_tokens=True)
+            start = max(0, len(text) - overlap)
+            text += self.tokenizer.decode(ids[prefix_offset:], skip_special_tokens=True)[len(prefix_text):]
+            cut = self._find_stop(text, start)
+            if cut >= 0:
+                text = text[:cut]
+        if len(text) > emitted:
+            yield text[emitted:]
+
+        elapsed = perf_counter() - t0
+        self.answer = Answer(
+            text=text.strip(),
+            tokens_generated=len(ids),
+            generation_time_seconds=elapsed,
+            time_to_first_token_seconds=first_token,
+            tokens_per_second=len(ids) / elapsed if elapsed > 0 else None,
+        )
+        if profiler:
+            profiler.add_span("generate", span_start, elapsed, tokens=len(ids), ttft=first_token)
+
+    def _find_stop(self, text: str, start: int) -> int:
+        """Position of the earliest stop string found at or after start (-1 if none)."""
+        hits = [i for i in (text.find(s, start) for s in self.stop) if i >= 0]
+        return min(hits) if hits else -1
+
+    def _holdback(self, text: str) -> int:
+        """Characters at the end of text that may begin a stop string."""
+        held = 0
+        for s in self.stop:
+            for n in range(min(len(s) - 1, len(text)), held, -1):
+                if s.startswith(text[-n:]):
+                    held = n
+                    break
+        return held
+
+
+class BatchQueue:
+    """
+    asyncio front end that groups concurrent questions into batches.
+
+    A batch is flushed once max_batch_size questions are waiting or
+    max_wait_seconds after its first question arrived, whichever is first.
+    The blocking generate_batch call runs in the default executor so the
+    event loop keeps accepting questions meanwhile.
+    """
+
+    def __init__(self, generate_batch: Callable[[List[str]], List[Answer]],
+                 max_batch_size: int = 8, max_wait_seconds: float = 0.05):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, prompt: str) -> Answer:
+        loop = asyncio.get_running_loop()
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((prompt, future))
+        return await future
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            prompts = [prompt for prompt, _ in batch]
+            try:
+                answers = await loop.run_in_executor(None, self.generate_batch, prompts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), answer in zip(batch, answers):
+                if not future.done():
+                    future.set_result(answer)
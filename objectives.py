@@ -0,0 +1,109 @@
+"""
+Training objectives: which positions of a chunk the TTT loss is computed on.
+
+An objective takes the collated (input_ids, labels) of a micro-batch and
+returns labels with -100 everywhere it should not train. The chunked LM
+loss in TTTModel.forward_suffix only projects labelled positions, so a
+sparser objective also means fewer output-projection FLOPs.
+"""
+
+import math
+from typing import Optional
+import torch
+from config import LearningConfig
+
+
+class Objective:
+    """Full causal LM loss: every real token is a target."""
+
+    name = "lm"
+
+    def select(self, input_ids: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            input_ids: [batch, seq] token ids
+            labels: [batch, seq] labels from collation (-100 = already ignored)
+
+        Returns:
+            Labels restricted to the positions this objective trains on
+        """
+        return labels
+
+
+class MaskedSpanObjective(Objective):
+    """
+    Loss on random spans covering about mask_ratio of each row.
+
+    The model is causal, so spans are not hidden from the input; they are
+    the only positions the model has to predict from their left context.
+    Spans are redrawn every step, so repeated epochs cover different text.
+    """
+
+    name = "masked_span"
+
+    def __init__(self, mask_ratio: float = 0.15, span_length: int = 3, seed: int = 0):
+        self.mask_ratio = mask_ratio
+        self.span_length = max(1, span_length)
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def select(self, input_ids: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+        batch, seq_len = labels.shape
+        spans = max(1, math.ceil(seq_len * self.mask_ratio / self.span_length))
+        starts = torch.randint(0, seq_len, (batch, spans), generator=self.generator)
+        positions = (starts.unsqueeze(-1) + torch.arange(self.span_length)).clamp_(max=seq_len - 1)
+
+        selected = torch.zeros(batch, seq_len, dtype=torch.bool)
+        selected.scatter_(1, positions.view(batch, -1), True)
+        return labels.masked_fill(~selected.to(labels.device), -100)
+
+
+class SalientTokenObjective(Objective):
+    """
+    Loss only on salient tokens: numbers and capitalized words (names,
+    places, dates), including the sub-word pieces that continue them.
+    """
+
+    name = "salient"
+    MAX_WORD_PIECES = 4
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._token_info = {}
+
+    def select(self, input_ids: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+        unique, inverse = torch.unique(input_ids, return_inverse=True)
+        info = torch.tensor([self._info(int(t)) for t in unique.tolist()], dtype=torch.bool, device=input_ids.device)
+        salient, continues = info[:, 0][inverse], info[:, 1][inverse]
+
+        # A word's later pieces inherit salience from its first piece
+        for _ in range(self.MAX_WORD_PIECES - 1):
+            salient = salient | torch.nn.functional.pad(salient[:, :-1], (1, 0)) & continues
+        return labels.masked_fill(~salient, -100)
+
+    def _info(self, token_id: int):
+        """(starts or is a salient word, continues the previous word)"""
+        if token_id not in self._token_info:
+            text = self.tokenizer.decode([token_id])
+            word = text.strip()
+            salient = any(c.isdigit() for c in word) or (word[:1].isupper() and word[:1].isalpha())
+            continues = bool(text) and text[0].isalnum()
+            self._token_info[token_id] = (salient, continues)
+        return self._token_info[token_id]
+
+
+OBJECTIVES = {
+    "lm": Objective,
+    "masked_span": MaskedSpanObjective,
+    "salient": SalientTokenObjective,
+}
+
+
+def make_objective(config: LearningConfig, tokenizer=None, seed: Optional[int] = None) -> Objective:
+    """Build the objective named by config.objective."""
+    if config.objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective: {config.objective} (choose from {', '.join(OBJECTIVES)})")
+    if config.objective == "masked_span":
+        return MaskedSpanObjective(config.mask_ratio, config.span_length, seed or 0)
+    if config.objective == "salient":
+        return SalientTokenObjective(tokenizer)
+    return Objective()
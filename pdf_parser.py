@@ -1,6 +1,8 @@
 """PDF text extraction using PyMuPDF"""
 import fitz  # PyMuPDF
-from typing import Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+from profiling import stage
 
 
 class PDFExtractionError(Exception):
@@ -8,9 +10,25 @@ class PDFExtractionError(Exception):
     pass
 
 
+def _extract_pages(path: str, start: int, end: int) -> List[str]:
+    """Text of pages [start, end) (runs in a worker process)."""
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, end)]
+
+
 class PDFParser:
     """Extract text from PDF files using PyMuPDF"""
     
+    def __init__(self, workers: Optional[int] = None, pages_per_task: int = 8):
+        """
+        Args:
+            workers: Processes for iter_pages (default: CPU count; 0 extracts
+                in the calling process, e.g. when it is already a pool worker)
+            pages_per_task: Pages extracted per worker task
+        """
+        self.workers = workers
+        self.pages_per_task = pages_per_task
+    
     def parse(self, file_bytes: bytes) -> Tuple[str, int]:
         """
         Extract text from PDF.
@@ -45,3 +63,52 @@ class PDFParser:
         except Exception as e:
             # Wrap any exception as PDFExtractionError
             raise PDFExtractionError(f"Failed to extract text from PDF: {str(e)}") from e
+
+    def page_count(self, path: str) -> int:
+        """Number of pages (reads only the document structure)."""
+        try:
+            with fitz.open(path) as doc:
+                return len(doc)
+        except Exception as e:
+            raise PDFExtractionError(f"Failed to open PDF: {str(e)}") from e
+
+    def iter_pages(self, path: str) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (page_number, text) in page order, starting at 1.
+        
+        Page ranges are extracted in parallel by a process pool. All ranges
+        are queued up front, so workers keep extracting ahead while the
+        caller consumes earlier pages.
+        
+        Raises:
+            PDFExtractionError: If extraction fails
+        """
+        page_count = self.page_count(path)
+        ranges = [
+            (start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+        
+        # Not worth starting processes for a single task
+        if len(ranges) <= 1 or self.workers == 0:
+            try:
+                with stage("extract", pages=page_count):
+                    texts = _extract_pages(path, 0, page_count)
+            except Exception as e:
+                raise PDFExtractionError(f"Failed to extract text from PDF: {str(e)}") from e
+            yield from enumerate(texts, start=1)
+            return
+        
+        executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [executor.submit(_extract_pages, path, start, end) for start, end in ranges]
+            for (start, _), future in zip(ranges, futures):
+                try:
+                    # Time spent waiting on the pool (extraction itself runs in workers)
+                    with stage("extract", first_page=start + 1):
+                        texts = future.result()
+                except Exception as e:
+                    raise PDFExtractionError(f"Failed to extract text from PDF: {str(e)}") from e
+                yield from enumerate(texts, start=start + 1)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,224 @@
+"""
+Pipeline instrumentation: timed stages, per-TTTLinear forward/backward
+spans, memory high-water marks and free-form events.
+
+Instrumented code calls the module-level stage() / record() helpers, which
+do nothing unless a Profiler is active:
+
+    with Profiler() as profiler:
+        profiler.attach(model)          # optional per-layer timing
+        trainer.train(document)
+    profiler.to_chrome_trace("learn.trace.json")
+
+Stages used across the pipeline: extract, chunk, forward, backward,
+optimizer_step, all_reduce (data-parallel training), generate.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_active: Optional["Profiler"] = None
+_NULL = nullcontext()
+
+
+def active() -> Optional["Profiler"]:
+    """The profiler currently collecting, if any."""
+    return _active
+
+
+def stage(name: str, **args):
+    """Time a block as stage `name` on the active profiler (no-op otherwise)."""
+    if _active is None:
+        return _NULL
+    return _active.stage(name, **args)
+
+
+def record(name: str, **args) -> None:
+    """Record an instant event on the active profiler (no-op otherwise)."""
+    if _active is not None:
+        _active.record(name, **args)
+
+
+class Profiler:
+    """
+    Collects timed spans and events; callbacks registered with on() see
+    each one as it is recorded.
+
+    Spans and events are plain dicts: {"name", "start", "duration", "thread",
+    "args"} with times in seconds since the profiler was created.
+    """
+
+    def __init__(self, sync_cuda: Optional[bool] = None):
+        """
+        Args:
+            sync_cuda: Synchronize CUDA at span edges so GPU time lands in
+                the right span (default: on when CUDA is available)
+        """
+        self.sync_cuda = torch.cuda.is_available() if sync_cuda is None else sync_cuda
+        self.spans: List[dict] = []
+        self.events: List[dict] = []
+        self._callbacks: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+        self._handles = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous
+        self.detach()
+        return False
+
+    def on(self, name: str, callback: Callable[[dict], None]) -> None:
+        """Call callback(span_or_event) whenever `name` is recorded ("*" = everything)."""
+        self._callbacks[name].append(callback)
+
+    def now(self) -> float:
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter() - self._t0
+
+    @contextmanager
+    def stage(self, name: str, **args):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, self.now() - start, **args)
+
+    def add_span(self, name: str, start: float, duration: float, **args) -> None:
+        """Record a span measured elsewhere (start in profiler time, see now())."""
+        args.update(self.memory())
+        self._emit(self.spans, {
+            "name": name, "start": start, "duration": duration,
+            "thread": threading.get_ident(), "args": args,
+        })
+
+    def record(self, name: str, **args) -> None:
+        self._emit(self.events, {
+            "name": name, "start": self.now(), "duration": 0.0,
+            "thread": threading.get_ident(), "args": args,
+        })
+
+    def _emit(self, target: list, item: dict) -> None:
+        with self._lock:
+            target.append(item)
+        for callback in self._callbacks.get(item["name"], []) + self._callbacks.get("*", []):
+            callback(item)
+
+    @staticmethod
+    def memory() -> dict:
+        """Process memory high-water marks in bytes."""
+        usage = {}
+        if resource is not None:
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            scale = 1 if os.uname().sysname == "Darwin" else 1024
+            usage["cpu_peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        if torch.cuda.is_available():
+            usage["cuda_peak_allocated"] = torch.cuda.max_memory_allocated()
+        return usage
+
+    def attach(self, model) -> None:
+        """Time forward and backward of every TTTLinear in model.ttt_layers."""
+        for index, layer in zip(model.ttt_layer_indices, model.ttt_layers):
+            self._handles.extend(_LayerTimer(self, f"ttt_layer_{index}").install(layer))
+
+    def detach(self) -> None:
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def summary(self) -> dict:
+        """Per-span-name count, total/mean/max seconds and peak memory."""
+        totals = {}
+        for span in self.spans:
+            entry = totals.setdefault(span["name"], {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            entry["count"] += 1
+            entry["total_seconds"] += span["duration"]
+            entry["max_seconds"] = max(entry["max_seconds"], span["duration"])
+            for key in ("cpu_peak_rss", "cuda_peak_allocated"):
+                if key in span["args"]:
+                    entry[key] = max(entry.get(key, 0), span["args"][key])
+        for entry in totals.values():
+            entry["mean_seconds"] = entry["total_seconds"] / entry["count"]
+        return totals
+
+    def to_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"summary": self.summary(), "spans": self.spans, "events": self.events}, f, indent=2)
+
+    def to_chrome_trace(self, path: str) -> None:
+        """Write chrome://tracing / Perfetto JSON (complete and instant events, µs)."""
+        pid = os.getpid()
+        trace = [
+            {"name": s["name"], "ph": "X", "ts": s["start"] * 1e6, "dur": s["duration"] * 1e6,
+             "pid": pid, "tid": s["thread"], "args": s["args"]}
+            for s in self.spans
+        ]
+        trace += [
+            {"name": e["name"], "ph": "i", "s": "p", "ts": e["start"] * 1e6,
+             "pid": pid, "tid": e["thread"], "args": e["args"]}
+            for e in self.events
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+class _LayerTimer:
+    """
+    Forward and backward spans for one layer.
+
+    Backward starts when the gradient w.r.t. the layer output arrives and
+    ends when the gradient w.r.t. its input (or, for the first TTT layer,
+    whose input needs none, its trainable weights) has been computed.
+    """
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self._forward_start = None
+        self._backward_start = None
+
+    def install(self, layer) -> list:
+        handles = [
+            layer.register_forward_pre_hook(self._before_forward),
+            layer.register_forward_hook(self._after_forward),
+        ]
+        for param in layer.trainable_parameters():
+            handles.append(param.register_post_accumulate_grad_hook(lambda p: self._end_backward()))
+        return handles
+
+    def _before_forward(self, module, inputs):
+        self._forward_start = self.profiler.now()
+
+    def _after_forward(self, module, inputs, output):
+        start = self._forward_start
+        self.profiler.add_span(f"{self.name}.forward", start, self.profiler.now() - start)
+        if torch.is_grad_enabled() and output.requires_grad:
+            output.register_hook(self._start_backward)
+            if inputs[0].requires_grad:
+                inputs[0].register_hook(lambda grad: self._end_backward())
+
+    def _start_backward(self, grad):
+        self._backward_start = self.profiler.now()
+
+    def _end_backward(self):
+        start, self._backward_start = self._backward_start, None
+        if start is not None:
+            self.profiler.add_span(f"{self.name}.backward", start, self.profiler.now() - start)
@@ -0,0 +1,110 @@
+"""
+Compact session files: a small JSON header plus flat, mmap-able tensors.
+
+Files use the safetensors layout, so the header (document metadata,
+adapter rank, dtype) can be read without touching tensor data, and
+tensors are read straight from the memory-mapped file.
+"""
+
+import json
+from dataclasses import fields
+from typing import Dict, List, Optional
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+from config import Document, DocumentChunk, DocumentStatus
+
+FORMAT_VERSION = 1
+METADATA_KEY = "learn_doc"
+
+DTYPES = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
+
+def document_to_dict(document: Document) -> dict:
+    """Document metadata without chunk text or token ids."""
+    # Built field by field: asdict() would deep-copy every chunk's token ids
+    data = {f.name: getattr(document, f.name) for f in fields(document) if f.name != "chunks"}
+    data["status"] = document.status.value
+    data["chunks"] = [
+        {f.name: getattr(chunk, f.name) for f in fields(chunk) if f.name not in ("text", "token_ids")}
+        for chunk in document.chunks
+    ]
+    return data
+
+
+def document_from_dict(data: dict) -> Document:
+    """Rebuild a lightweight Document (chunks carry metadata only)."""
+    data = dict(data)
+    data["status"] = DocumentStatus(data["status"])
+    data["chunks"] = [
+        DocumentChunk(text="", token_ids=[], **chunk) for chunk in data["chunks"]
+    ]
+    return Document(**data)
+
+
+def save_state(path: str, ttt_state: List[Dict[str, torch.Tensor]], metadata: dict,
+               dtype: Optional[str] = None) -> None:
+    """
+    Write per-layer TTT tensors and a JSON header to path.
+
+    Args:
+        path: Output file
+        ttt_state: TTTModel.get_ttt_state(...) output
+        metadata: JSON-serializable header (document, adapter_rank, ...)
+        dtype: Optional "fp16"/"bf16"/"fp32" downcast for the stored tensors
+    """
+    target = DTYPES[dtype] if dtype else None
+    tensors = {}
+    for i, layer in enumerate(ttt_state):
+        for name, tensor in layer.items():
+            tensor = tensor.detach()
+            if target is not None:
+                tensor = tensor.to(target)
+            tensors[f"layers.{i}.{name}"] = tensor.cpu().contiguous()
+
+    header = dict(metadata, format_version=FORMAT_VERSION, num_layers=len(ttt_state))
+    save_file(tensors, path, metadata={METADATA_KEY: json.dumps(header)})
+
+
+def read_metadata(path: str) -> dict:
+    """Read only the JSON header."""
+    with safe_open(path, framework="pt") as f:
+        return json.loads(f.metadata()[METADATA_KEY])
+
+
+def load_state(path: str, device="cpu") -> List[Dict[str, torch.Tensor]]:
+    """Load every layer's tensors (as stored, no upcast) onto device."""
+    with safe_open(path, framework="pt", device=str(device)) as f:
+        num_layers = json.loads(f.metadata()[METADATA_KEY])["num_layers"]
+        state = [{} for _ in range(num_layers)]
+        for key in f.keys():
+            _, i, name = key.split(".", 2)
+            state[int(i)][name] = f.get_tensor(key)
+    return state
+
+
+def load_into_model(path: str, model) -> dict:
+    """
+    Copy stored tensors into the live TTT layers one at a time.
+
+    Each tensor is read from the mapped file and copied into place, so no
+    full copy of the session is ever materialized. Returns the header.
+    """
+    with safe_open(path, framework="pt") as f:
+        header = json.loads(f.metadata()[METADATA_KEY])
+        rank = header.get("adapter_rank", 0)
+        if model.adapter_rank != rank:
+            model.enable_adapters(rank)
+
+        names = {}
+        for key in f.keys():
+            _, i, name = key.split(".", 2)
+            names.setdefault(int(i), []).append((name, key))
+        for i, layer in enumerate(model.ttt_layers):
+            layer.load_ttt_state({name: f.get_tensor(key) for name, key in names[i]})
+    model.mark_ttt_updated()
+    return header
@@ -0,0 +1,174 @@
+"""
+Document-keyed store of learned TTT states.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import torch
+from config import Document
+from session_format import DTYPES, document_from_dict, document_to_dict, load_state, read_metadata, save_state
+
+
+class TTTStateStore:
+    """
+    Learned TTT states on disk, keyed by a hash of the document text.
+
+    A bounded LRU of states stays resident on the model's device, so
+    switching between recently used documents is a few in-place copies into
+    TTTModel.ttt_layers instead of a reload or a relearn.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, root: str = ".ttt_store", device=None, max_resident_mb: int = 512):
+        """
+        Args:
+            root: Directory holding one state file per document plus an index
+            device: Device for resident states (default: CPU)
+            max_resident_mb: Memory cap for the resident LRU
+        """
+        self.root = root
+        self.device = device or "cpu"
+        self.max_resident_bytes = max_resident_mb * 1024 * 1024
+        self.active_key: Optional[str] = None
+        self._resident = OrderedDict()
+        self._resident_bytes = 0
+        self._index = self._read_index()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """Hash of a source file's bytes (lets PDFs be recognized before extraction)."""
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def list_documents(self) -> List[dict]:
+        """Index entries (key, filename, total_tokens, adapter_rank), most recent last."""
+        return [dict(key=key, **entry) for key, entry in self._index.items()]
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Find a key by full key, unique key prefix, or filename."""
+        if name in self._index:
+            return name
+        matches = [k for k, e in self._index.items() if k.startswith(name) or e["filename"] == name]
+        if not matches:
+            return None
+        # Several versions of the same file: take the most recently learned
+        if len({self._index[k]["filename"] for k in matches}) > 1:
+            return None
+        return matches[-1]
+
+    def find_source(self, source_hash: str) -> Optional[str]:
+        """Key of the document learned from a source file with this file_hash()."""
+        for key, entry in self._index.items():
+            if entry.get("source_hash") == source_hash:
+                return key
+        return None
+
+    def put(self, key: str, ttt_state: List[Dict[str, torch.Tensor]], document: Document,
+            adapter_rank: int = 0, dtype: Optional[str] = None, source_hash: Optional[str] = None) -> None:
+        """
+        Save a learned state (copied, so later training can't alter it).
+
+        Args:
+            dtype: Optional "fp16"/"bf16" downcast, applied on disk and in memory
+            source_hash: Optional file_hash() of the source file, for find_source()
+        """
+        target = DTYPES[dtype] if dtype else None
+        state = [
+            {name: t.detach().to(self.device, dtype=target, copy=True) for name, t in layer.items()}
+            for layer in ttt_state
+        ]
+        os.makedirs(self.root, exist_ok=True)
+        save_state(
+            self._path(key), state,
+            {"adapter_rank": adapter_rank, "document": document_to_dict(document)}
+        )
+        self._index.pop(key, None)
+        self._index[key] = {
+            "filename": document.filename,
+            "total_tokens": document.total_tokens,
+            "adapter_rank": adapter_rank,
+        }
+        if source_hash:
+            self._index[key]["source_hash"] = source_hash
+        self._write_index()
+        self._make_resident(key, state)
+
+    def get(self, key: str) -> List[Dict[str, torch.Tensor]]:
+        """Learned state for key, from the resident LRU or disk."""
+        if key in self._resident:
+            self._resident.move_to_end(key)
+            return self._resident[key]
+        state = load_state(self._path(key), device=self.device)
+        self._make_resident(key, state)
+        return state
+
+    def load_document(self, key: str) -> Document:
+        """Document metadata from the file header (no tensor data is read)."""
+        return document_from_dict(read_metadata(self._path(key))["document"])
+
+    def activate(self, model, key: str) -> None:
+        """Swap the model's TTT weights in place to the state stored under key."""
+        if key == self.active_key:
+            return
+        rank = self._index[key]["adapter_rank"]
+        if model.adapter_rank != rank:
+            model.enable_adapters(rank)
+        model.load_ttt_state(self.get(key))
+        self.active_key = key
+
+    def remove(self, key: str) -> None:
+        if key in self._resident:
+            self._resident_bytes -= self._state_bytes(self._resident.pop(key))
+        self._index.pop(key, None)
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+        self._write_index()
+        if self.active_key == key:
+            self.active_key = None
+
+    def clear(self) -> None:
+        for key in list(self._index):
+            self.remove(key)
+
+    def _make_resident(self, key: str, state) -> None:
+        if key in self._resident:
+            self._resident_bytes -= self._state_bytes(self._resident.pop(key))
+        self._resident[key] = state
+        self._resident_bytes += self._state_bytes(state)
+        # Evict least recently used, but always keep the newest entry
+        while self._resident_bytes > self.max_resident_bytes and len(self._resident) > 1:
+            _, evicted = self._resident.popitem(last=False)
+            self._resident_bytes -= self._state_bytes(evicted)
+
+    @staticmethod
+    def _state_bytes(state) -> int:
+        return sum(t.numel() * t.element_size() for layer in state for t in layer.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.safetensors")
+
+    def _read_index(self) -> OrderedDict:
+        path = os.path.join(self.root, self.INDEX_FILE)
+        if not os.path.exists(path):
+            return OrderedDict()
+        with open(path, "r", encoding="utf-8") as f:
+            return OrderedDict(json.load(f))
+
+    def _write_index(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, self.INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump(self._index, f, indent=2)
@@ -0,0 +1,48 @@
+"""Tests for ActivationCache"""
+import os
+import torch
+from activation_cache import ActivationCache
+
+
+class TestActivationCache:
+    """Test in-memory storage and disk spilling"""
+
+    def test_put_get_in_memory(self):
+        """Test entries under the budget stay resident"""
+        cache = ActivationCache(max_memory_bytes=1024)
+        t = torch.ones(2, 4)
+        cache.put("a", t)
+        assert "a" in cache
+        assert len(cache) == 1
+        assert cache.memory_bytes == t.numel() * t.element_size()
+        assert torch.equal(cache.get("a"), t)
+
+    def test_spills_over_budget(self, tmp_path):
+        """Test entries over the budget are written to the spill dir"""
+        cache = ActivationCache(max_memory_bytes=64, spill_dir=str(tmp_path))
+        first = torch.zeros(4, 4)   # 64 bytes, fits
+        second = torch.arange(16.0).reshape(4, 4)
+        cache.put(0, first)
+        cache.put(1, second)
+        
+        assert cache.memory_bytes == 64
+        assert len(os.listdir(tmp_path)) == 1
+        assert torch.equal(cache.get(1), second)
+
+    def test_clear_removes_owned_spill_dir(self):
+        """Test clear() deletes a temp spill dir it created"""
+        cache = ActivationCache(max_memory_bytes=0)
+        cache.put("x", torch.ones(3))
+        spill_dir = cache.spill_dir
+        assert os.path.isdir(spill_dir)
+        
+        cache.clear()
+        assert len(cache) == 0
+        assert not os.path.exists(spill_dir)
+
+    def test_detaches_tensors(self):
+        """Test cached tensors do not keep an autograd graph alive"""
+        cache = ActivationCache()
+        w = torch.ones(2, requires_grad=True)
+        cache.put("y", w * 2)
+        assert not cache.get("y").requires_grad
@@ -0,0 +1,84 @@
+"""Tests for the batch document preparation pipeline"""
+import pytest
+from batch_learner import DocumentPrefetcher, find_documents, prepare_document
+from benchmarks.run_benchmarks import build_tokenizer
+from chunk_cache import ChunkCache
+from chunker import DocumentChunker
+from state_store import TTTStateStore
+
+CHUNKING = {"chunk_size": 32, "stride": None, "boundary": "token", "dedup": False}
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    return build_tokenizer(vocab_size=400)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.txt").write_text("The capital of France is Paris. " * 20, encoding="utf-8")
+    (tmp_path / "sub" / "b.md").write_text("Tim Berners-Lee invented the Web.", encoding="utf-8")
+    (tmp_path / "notes.bin").write_bytes(b"\x00")
+    return tmp_path
+
+
+class TestPrepare:
+    """Test per-file hashing, chunking and cache lookups"""
+
+    def test_find_documents(self, corpus):
+        """Directories are searched recursively for supported files"""
+        paths = find_documents(str(corpus))
+        assert [p[len(str(corpus)) + 1:] for p in paths] == ["a.txt", "sub/b.md"]
+        assert find_documents(str(corpus / "*.txt")) == [str(corpus / "a.txt")]
+
+    def test_matches_single_learn(self, corpus, tokenizer):
+        """Same chunks and content hash as chunking the file directly"""
+        text = (corpus / "a.txt").read_text(encoding="utf-8")
+        prepared = prepare_document(str(corpus / "a.txt"), CHUNKING, tokenizer=tokenizer)
+        expected = DocumentChunker(tokenizer, chunk_size=32, decode_text=False).chunk(text)
+        assert prepared.error is None and not prepared.cached
+        assert prepared.document.content_hash == TTTStateStore.content_hash(text)
+        assert [c.token_ids.tolist() for c in prepared.document.chunks] == [c.token_ids.tolist() for c in expected]
+
+    def test_reads_cache(self, corpus, tokenizer, tmp_path):
+        """A file chunked before is served from the ChunkCache"""
+        cache_dir = str(tmp_path / "cache")
+        first = prepare_document(str(corpus / "a.txt"), CHUNKING, cache_dir, tokenizer=tokenizer)
+        ChunkCache(cache_dir).put(first.cache_key, first.document)
+        second = prepare_document(str(corpus / "a.txt"), CHUNKING, cache_dir, tokenizer=tokenizer)
+        assert second.cached
+        assert second.document.total_tokens == first.document.total_tokens
+
+    def test_skips_known_source(self, corpus, tokenizer):
+        """A file already in the store is hashed but never extracted"""
+        path = corpus / "scan.pdf"
+        path.write_bytes(b"not really a pdf")
+        known = {TTTStateStore.file_hash(str(path)): "stored-key"}
+        prepared = prepare_document(str(path), CHUNKING, tokenizer=tokenizer, known_sources=known)
+        assert prepared.stored_key == "stored-key"
+        assert prepared.document is None and prepared.error is None
+        with pytest.raises(Exception):
+            prepare_document(str(path), CHUNKING, tokenizer=tokenizer)
+
+
+class TestPrefetcher:
+    """Test the worker pool pipeline"""
+
+    def test_order_and_failures(self, corpus, tokenizer):
+        """Results come back in input order; a bad file doesn't stop the run"""
+        paths = [str(corpus / "a.txt"), str(corpus / "missing.txt"), str(corpus / "sub" / "b.md")]
+        prefetcher = DocumentPrefetcher(tokenizer, workers=2, prefetch=1, **CHUNKING)
+        results = list(prefetcher.run(paths))
+        assert [r.path for r in results] == paths
+        assert results[1].error.startswith("FileNotFoundError")
+        assert results[0].document.chunks and results[2].document.filename == "b.md"
+
+    def test_known_sources_reach_workers(self, corpus, tokenizer):
+        """Workers skip the files the store already has"""
+        paths = [str(corpus / "a.txt"), str(corpus / "sub" / "b.md")]
+        known = {TTTStateStore.file_hash(paths[1]): "b-key"}
+        prefetcher = DocumentPrefetcher(tokenizer, workers=1, known_sources=known, **CHUNKING)
+        results = list(prefetcher.run(paths))
+        assert results[0].stored_key is None and results[0].document.chunks
+        assert results[1].stored_key == "b-key" and results[1].document is None
@@ -0,0 +1,34 @@
+"""Tests for the offline benchmark harness"""
+import torch
+from benchmarks.run_benchmarks import build_model, build_tokenizer, compare
+
+
+class TestOfflineModel:
+    """Test the random-init model used by the benchmarks"""
+
+    def test_builds_without_download(self):
+        """Tokenizer and TTT model are built locally and run"""
+        tokenizer = build_tokenizer(vocab_size=400)
+        model = build_model(tokenizer, hidden_size=32, num_layers=2, ttt_layers=1)
+        assert model.ttt_layer_indices == [1]
+        ids = torch.tensor([tokenizer.encode("The capital of France is Paris.")])
+        out = model.forward_suffix(model.forward_prefix(ids), labels=ids)
+        assert torch.isfinite(out.loss)
+
+
+class TestCompare:
+    """Test regression detection"""
+
+    def test_flags_slower_rates_and_durations(self):
+        """Lower rates and longer durations beyond tolerance are regressions"""
+        baseline = {"training": {"tokens_per_second": 100.0}, "session": {"load_seconds": 1.0, "bytes": 10}}
+        current = {"training": {"tokens_per_second": 70.0}, "session": {"load_seconds": 1.1, "bytes": 99}}
+        regressions = compare(current, baseline, tolerance=0.2)
+        assert len(regressions) == 1
+        assert regressions[0].startswith("training.tokens_per_second")
+
+    def test_improvements_pass(self):
+        """Faster results are not regressions"""
+        baseline = {"generation": {"ttft_seconds": 0.5, "tokens_per_second": 10.0}}
+        current = {"generation": {"ttft_seconds": 0.1, "tokens_per_second": 50.0}}
+        assert compare(current, baseline, tolerance=0.1) == []
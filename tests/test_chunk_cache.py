@@ -0,0 +1,58 @@
+"""Tests for the chunked-document cache"""
+import numpy as np
+from chunk_cache import ChunkCache
+from chunker import chunk_hash
+from config import Document, DocumentChunk
+
+
+class FakeTokenizer:
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def get_vocab(self):
+        return self.vocab
+
+
+def make_document():
+    ids = np.arange(10, dtype=np.int32)
+    chunks = [
+        DocumentChunk(index=0, text="", token_ids=ids[:6], token_count=6, start_page=1, end_page=2),
+        DocumentChunk(index=1, text="", token_ids=ids[4:], token_count=6, start_page=2, end_page=2, overlap_tokens=2),
+    ]
+    return Document(id="a.pdf", filename="a.pdf", page_count=2, total_tokens=12, chunks=chunks, content_hash="abc")
+
+
+class TestChunkCache:
+    """Test storing and memory-mapped loading of chunked documents"""
+
+    def test_round_trip(self, tmp_path):
+        """Chunks come back with the same ids and metadata, from a fresh instance"""
+        key = ChunkCache.make_key("src", FakeTokenizer({"a": 0}), 512)
+        ChunkCache(str(tmp_path)).put(key, make_document())
+
+        cache = ChunkCache(str(tmp_path))
+        assert key in cache
+        document = cache.get(key)
+        assert document.content_hash == "abc" and document.page_count == 2
+        assert [c.token_ids.tolist() for c in document.chunks] == [list(range(6)), list(range(4, 10))]
+        assert [(c.start_page, c.end_page, c.overlap_tokens) for c in document.chunks] == [(1, 2, 0), (2, 2, 2)]
+        assert isinstance(document.chunks[0].token_ids.base, np.memmap)
+        assert document.chunks[1].token_hash == chunk_hash(np.arange(4, 10))
+
+    def test_key_depends_on_inputs(self):
+        """Different source, tokenizer or chunking parameters give different keys"""
+        tokenizer = FakeTokenizer({"a": 0})
+        base = ChunkCache.make_key("src", tokenizer, 512)
+        assert base == ChunkCache.make_key("src", tokenizer, 512)
+        assert base != ChunkCache.make_key("other", tokenizer, 512)
+        assert base != ChunkCache.make_key("src", FakeTokenizer({"b": 0}), 512)
+        assert base != ChunkCache.make_key("src", tokenizer, 256)
+        assert base != ChunkCache.make_key("src", tokenizer, 512, boundary="sentence")
+
+    def test_miss_and_remove(self, tmp_path):
+        """Unknown and removed keys miss"""
+        cache = ChunkCache(str(tmp_path))
+        assert cache.get("missing") is None
+        cache.put("k", make_document())
+        cache.remove("k")
+        assert "k" not in cache and cache.get("k") is None
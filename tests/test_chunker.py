@@ -1,4 +1,5 @@
 """Tests for DocumentChunker - Step 2.4, 2.5, 2.6"""
+from collections import Counter
 import pytest
 from transformers import AutoTokenizer
 from chunker import DocumentChunker
@@ -97,3 +98,80 @@ class TestDocumentChunker:
         # Check indices are sequential 0, 1, 2, ...
         for i, chunk in enumerate(chunks):
             assert chunk.index == i
+    
+    def test_chunk_pages_tracks_page_range(self, tokenizer):
+        """Test chunk_pages streams chunks with start/end pages"""
+        chunker = DocumentChunker(tokenizer, chunk_size=50)
+        pages = [(1, "First page. " * 20), (2, ""), (3, "Third page. " * 20)]
+        chunks = list(chunker.chunk_pages(iter(pages)))
+        
+        assert [c.index for c in chunks] == list(range(len(chunks)))
+        assert all(c.token_count <= 50 for c in chunks)
+        assert chunks[0].start_page == 1
+        assert chunks[-1].end_page == 3
+        assert all(c.start_page <= c.end_page for c in chunks)
+        assert not any(c.start_page == 2 or c.end_page == 2 for c in chunks)
+    
+    def test_windowed_tokenization_matches_full_encode(self, tokenizer):
+        """Test small tokenization windows give the same ids as one encode"""
+        text = "Numbers 12345, words\n\n  indented (parens) don't stop. " * 200
+        original_token_ids = tokenizer.encode(text, add_special_tokens=False)
+        
+        chunker = DocumentChunker(tokenizer, chunk_size=100, window_chars=64, decode_text=False)
+        pieces = [text[i:i + 50] for i in range(0, len(text), 50)]
+        chunks = list(chunker.iter_chunks(pieces))
+        
+        assert [int(t) for c in chunks for t in c.token_ids] == original_token_ids
+        assert all(c.text == "" for c in chunks)
+        assert chunker.chunk_text(chunks[0]) == tokenizer.decode(original_token_ids[:100])
+    
+    def test_window_after_blank_line_matches_full_encode(self, tokenizer):
+        """Test a window boundary right after "\n\nword" still gives the ids of one encode"""
+        text = "The whale\n\nsings" * 20
+        chunker = DocumentChunker(tokenizer, chunk_size=50, window_chars=12, decode_text=False)
+        chunks = list(chunker.iter_chunks(text))
+        
+        assert [int(t) for c in chunks for t in c.token_ids] == tokenizer.encode(text, add_special_tokens=False)
+    
+    def test_stride_records_overlap(self, tokenizer):
+        """Test sliding windows record overlap and cover every token once"""
+        chunker = DocumentChunker(tokenizer, chunk_size=100, stride=75)
+        text = "Whales sing about crystals in the year 2145. " * 60
+        chunks = chunker.chunk(text)
+        
+        assert chunks[0].overlap_tokens == 0
+        assert all(c.overlap_tokens == 25 for c in chunks[1:-1])
+        new_tokens = [int(t) for c in chunks for t in c.token_ids[c.overlap_tokens:]]
+        assert new_tokens == tokenizer.encode(text, add_special_tokens=False)
+    
+    def test_sentence_boundary_and_dedup(self, tokenizer):
+        """Test sentence snapping ends chunks on a period and dedup drops repeats"""
+        chunker = DocumentChunker(tokenizer, chunk_size=50, boundary="sentence")
+        text = "This sentence is about whales and their crystal songs. " * 30
+        chunks = chunker.chunk(text)
+        assert all(c.text.rstrip().endswith(".") for c in chunks[:-1])
+        
+        deduped = DocumentChunker(tokenizer, chunk_size=50, boundary="sentence", dedup=True).chunk(text)
+        assert len(deduped) < len(chunks)
+
+    def test_strip_repeated_edges_keeps_headings(self):
+        """Test only lines repeated at the edges of several pages are stripped"""
+        seen = Counter()
+        pages = [
+            f"Annual Report\nTable {n}:\n{year} revenue grew.\nMore body text.\n{year}\nPage {n} of 9"
+            for n, year in [(2, 2019), (3, 2020), (4, 2021), (5, 2022)]
+        ]
+        stripped = [DocumentChunker._strip_repeated_edges(page, seen) for page in pages]
+        
+        assert stripped[:2] == pages[:2]
+        assert stripped[2] == "Table 4:\n2021 revenue grew.\nMore body text.\n2021"
+        assert stripped[3] == "Table 5:\n2022 revenue grew.\nMore body text.\n2022"
+
+    def test_segments_cut_at_last_safe_boundary(self):
+        """Test windows end at the last safe cut, or the first one after a window without any"""
+        chunker = DocumentChunker(None, window_chars=16)
+        text = "alpha beta gamma\ndelta " + "x" * 40 + " omega epsilon"
+        segments = list(chunker._segments(text[i:i + 5] for i in range(0, len(text), 5)))
+        
+        assert "".join(segments) == text
+        assert segments == ["alpha beta", " gamma\ndelta", " " + "x" * 40, " omega epsilon"]
@@ -112,6 +112,27 @@ class TestLearningConfig:
         assert config.chunk_size == 2048
         assert config.max_grad_norm == 1.0
         assert config.mask_ratio == 0.15
+        assert config.cache_prefix is False
+        assert config.cache_max_memory_mb == 1024
+        assert config.cache_dir is None
+        assert config.batch_size == 1
+        assert config.accumulation_steps == 1
+        assert config.pack_chunks is False
+        assert config.epochs == 20
+        assert config.lr_schedule == "constant"
+        assert config.warmup_steps == 0
+        assert config.plateau_patience == 0
+        assert config.target_loss is None
+        assert config.time_budget_seconds is None
+        assert config.token_budget is None
+        assert config.focus_hard_chunks is True
+        assert config.loss_chunk_size == 1024
+        assert config.activation_checkpointing is False
+        assert config.objective == "lm"
+        assert config.span_length == 3
+        assert config.update_mode == "backprop"
+        assert config.local_batch_size == 16
+        assert config.anchor_strength == 0.01
 
     def test_custom_config(self):
         """Test custom LearningConfig values"""
@@ -148,6 +169,7 @@ class TestLearningMetrics:
         assert metrics.tokens_processed == 8192
         assert metrics.learning_time_seconds == 12.5
         assert metrics.weight_delta_norm == 0.15
+        assert metrics.stop_reason is None
 
     def test_metrics_loss_decrease(self):
         """Test that metrics can track loss decrease"""
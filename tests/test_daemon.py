@@ -0,0 +1,86 @@
+"""Tests for the serve daemon's locking and output capture"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "cli"))
+
+from daemon import FairRWLock, ModelDaemon
+
+
+class TestFairRWLock:
+    """Test FIFO reader/writer ordering"""
+
+    def test_readers_share(self):
+        """Readers hold the lock at the same time"""
+        lock = FairRWLock()
+        inside = threading.Barrier(2, timeout=2)
+
+        def reader():
+            with lock.read():
+                inside.wait()
+
+        threads = [threading.Thread(target=reader) for _ in range(2)]
+        for t in threads: t.start()
+        for t in threads: t.join(3)
+        assert not inside.broken
+
+    def test_writer_is_not_starved(self):
+        """Readers arriving after a queued writer wait behind it"""
+        lock = FairRWLock()
+        order = []
+
+        def writer():
+            with lock.write():
+                order.append("write")
+
+        def reader():
+            with lock.read():
+                order.append("read")
+
+        with lock.read():
+            w = threading.Thread(target=writer); w.start()
+            time.sleep(0.1)
+            r = threading.Thread(target=reader); r.start()
+            time.sleep(0.1)
+            assert order == []
+        w.join(2); r.join(2)
+        assert order == ["write", "read"]
+
+
+class OverlappingCLI:
+    """Fake CLInterface whose commands print around a shared barrier."""
+
+    def __init__(self):
+        self.document = None
+        self.barrier = threading.Barrier(2, timeout=2)
+
+    def run_command(self, command, args):
+        print(f"{args[0]} start")
+        self.barrier.wait()
+        print(f"{args[0]} end", file=sys.stderr)
+
+
+class TestOutputCapture:
+    """Test that concurrent shared commands keep their output apart"""
+
+    def test_concurrent_docs(self):
+        """Each overlapping command gets only its own output; sys.stdout is restored"""
+        stdout, stderr = sys.stdout, sys.stderr
+        daemon = ModelDaemon(OverlappingCLI())
+        outputs = {}
+
+        def run(tag):
+            outputs[tag] = daemon.run_command("docs", [tag])
+
+        try:
+            threads = [threading.Thread(target=run, args=(tag,)) for tag in ("a", "b")]
+            for t in threads: t.start()
+            for t in threads: t.join(3)
+        finally:
+            daemon.server.server_close()
+            daemon.loop.call_soon_threadsafe(daemon.loop.stop)
+        assert not daemon.cli.barrier.broken
+        assert outputs == {"a": "a start\na end\n", "b": "b start\nb end\n"}
+        assert sys.stdout is stdout and sys.stderr is stderr
@@ -0,0 +1,79 @@
+"""Tests for data-parallel TTT training"""
+import tempfile
+from dataclasses import replace
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import torch
+from benchmarks.run_benchmarks import build_model, build_tokenizer, sample_text
+from chunker import DocumentChunker
+from config import Document, DocumentChunk, LearningConfig
+from data_parallel import DataParallelTTTTrainer, _rank_config, default_threads, train_data_parallel
+from trainer import TTTTrainer
+
+
+def make_chunks(n):
+    return [DocumentChunk(index=i, text="", token_ids=np.arange(4), token_count=4) for i in range(n)]
+
+
+class TestSharding:
+    """Test how micro-batches are split between ranks"""
+
+    def test_round_robin_with_padding(self):
+        """Every rank gets the same number of batches, padded from the start"""
+        shards = [
+            DataParallelTTTTrainer(SimpleNamespace(), None, LearningConfig(), rank, 3)._make_batches(make_chunks(7))
+            for rank in range(3)
+        ]
+        indices = [[batch[0][0].index for batch in shard] for shard in shards]
+        assert indices == [[0, 3, 6], [1, 4, 0], [2, 5, 1]]
+
+    def test_default_threads(self):
+        """At least one thread per rank"""
+        assert default_threads(10_000) == 1
+
+
+class TestTrainDataParallel:
+    """Test multi-process training against a single process"""
+
+    def test_matches_gradient_accumulation(self):
+        """Two ranks give the same W_h as one process accumulating two micro-batches"""
+        tokenizer = build_tokenizer(vocab_size=400)
+        model = build_model(tokenizer, hidden_size=32, num_layers=2, ttt_layers=1)
+        chunks = DocumentChunker(tokenizer, chunk_size=48, decode_text=False).chunk(sample_text(1500))[:6]
+        document = Document(id="d", filename="d", page_count=1,
+                            total_tokens=sum(c.token_count for c in chunks), chunks=chunks)
+
+        model.reset_learning()
+        single = TTTTrainer(model, tokenizer, LearningConfig(inner_lr=1e-3, epochs=2, accumulation_steps=2))
+        expected_metrics = single.train(document)
+        expected = model.ttt_layers[0].W_h.weight.detach().clone()
+
+        model.reset_learning()
+        _, metrics = train_data_parallel(
+            model, tokenizer, LearningConfig(inner_lr=1e-3, epochs=2), 2, lambda t: t.train(document)
+        )
+        torch.testing.assert_close(model.ttt_layers[0].W_h.weight.detach(), expected)
+        assert metrics.loss_history == pytest.approx(expected_metrics.loss_history)
+        assert metrics.chunks_processed == expected_metrics.chunks_processed
+
+    def test_rejects_local_updates(self):
+        """Local W_h updates can't be averaged through gradients"""
+        model = SimpleNamespace(device=torch.device("cpu"))
+        with pytest.raises(ValueError):
+            train_data_parallel(model, None, LearningConfig(update_mode="local"), 2, lambda t: None)
+
+    def test_prefix_caches_cleaned_up(self, tmp_path, monkeypatch):
+        """Every rank removes its spill dir, and the memory budget is shared"""
+        monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+        tokenizer = build_tokenizer(vocab_size=400)
+        model = build_model(tokenizer, hidden_size=32, num_layers=2, ttt_layers=1)
+        chunks = DocumentChunker(tokenizer, chunk_size=48, decode_text=False).chunk(sample_text(800))[:4]
+        document = Document(id="d", filename="d", page_count=1,
+                            total_tokens=sum(c.token_count for c in chunks), chunks=chunks)
+
+        config = LearningConfig(inner_lr=1e-3, epochs=2, cache_prefix=True, cache_max_memory_mb=0)
+        trainer, _ = train_data_parallel(model, tokenizer, config, 2, lambda t: t.train(document))
+        assert list(tmp_path.iterdir()) == []
+        assert trainer.config.cache_max_memory_mb == 0
+        assert _rank_config(replace(config, cache_max_memory_mb=1024), 1, 4).cache_max_memory_mb == 256
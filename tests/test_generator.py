@@ -0,0 +1,109 @@
+"""Tests for streaming and batched answering"""
+import asyncio
+from config import Answer
+from generator import BatchQueue, TextStream
+
+
+class CharTokenizer:
+    """One token per character"""
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+
+
+class ByteTokenizer:
+    """One token per UTF-8 byte"""
+
+    def decode(self, ids, skip_special_tokens=True):
+        return bytes(ids).decode("utf-8", errors="replace")
+
+
+def char_ids(text):
+    yield from (ord(c) for c in text)
+
+
+def echo_batch(calls):
+    def generate_batch(prompts):
+        calls.append(list(prompts))
+        return [Answer(text=p.upper(), tokens_generated=1, generation_time_seconds=0.0) for p in prompts]
+    return generate_batch
+
+
+class TestBatchQueue:
+    """Test BatchQueue flushing"""
+
+    def test_flushes_on_batch_size(self):
+        """Concurrent questions are split into full batches, in order"""
+        calls = []
+
+        async def main():
+            queue = BatchQueue(echo_batch(calls), max_batch_size=3, max_wait_seconds=1.0)
+            answers = await asyncio.gather(*[queue.submit(f"q{i}") for i in range(6)])
+            await queue.close()
+            return answers
+
+        answers = asyncio.run(main())
+        assert [a.text for a in answers] == [f"Q{i}" for i in range(6)]
+        assert calls == [["q0", "q1", "q2"], ["q3", "q4", "q5"]]
+
+    def test_flushes_on_deadline(self):
+        """A lone question is answered after the deadline"""
+        calls = []
+
+        async def main():
+            queue = BatchQueue(echo_batch(calls), max_batch_size=8, max_wait_seconds=0.01)
+            answer = await queue.submit("only")
+            await queue.close()
+            return answer
+
+        assert asyncio.run(main()).text == "ONLY"
+        assert calls == [["only"]]
+
+    def test_errors_reach_every_caller(self):
+        """A failing batch raises in each waiting submit"""
+        def fail(prompts):
+            raise RuntimeError("boom")
+
+        async def main():
+            queue = BatchQueue(fail, max_batch_size=2, max_wait_seconds=0.01)
+            results = await asyncio.gather(queue.submit("a"), queue.submit("b"), return_exceptions=True)
+            await queue.close()
+            return results
+
+        assert all(isinstance(r, RuntimeError) for r in asyncio.run(main()))
+
+
+class TestTextStream:
+    """Test incremental text and stop strings"""
+
+    def test_pieces_join_to_answer(self):
+        """Streamed pieces add up to the answer text and token count"""
+        stream = TextStream(char_ids("hello world"), CharTokenizer(), [])
+        assert "".join(stream) == "hello world"
+        assert stream.answer.text == "hello world"
+        assert stream.answer.tokens_generated == 11
+        assert stream.answer.time_to_first_token_seconds is not None
+
+    def test_stops_at_stop_string(self):
+        """Generation stops at a stop string, which is never emitted"""
+        stream = TextStream(char_ids("answer\nQuestion: more"), CharTokenizer(), ["\nQuestion:"])
+        pieces = list(stream)
+        assert "".join(pieces) == "answer"
+        assert all("Q" not in p for p in pieces)
+        assert stream.answer.tokens_generated == len("answer\nQuestion:")
+
+    def test_multibyte_and_split_stop(self):
+        """Characters split across tokens and stop strings split across steps are handled"""
+        stream = TextStream(iter("café ok STOP!".encode("utf-8")), ByteTokenizer(), ["STOP"])
+        pieces = list(stream)
+        assert "".join(pieces) == "café ok "
+        assert all("\ufffd" not in p for p in pieces)
+
+    def test_decodes_only_new_tokens(self):
+        """Each step decodes a bounded window, not the whole answer"""
+        tokenizer = CharTokenizer()
+        lengths = []
+        decode = tokenizer.decode
+        tokenizer.decode = lambda ids, **kwargs: lengths.append(len(ids)) or decode(ids)
+        assert "".join(TextStream(char_ids("x" * 500), tokenizer, ["\nQuestion:"])) == "x" * 500
+        assert max(lengths) <= 2
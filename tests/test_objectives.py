@@ -0,0 +1,68 @@
+"""Tests for training objectives"""
+import pytest
+import torch
+from config import LearningConfig
+from objectives import MaskedSpanObjective, Objective, SalientTokenObjective, make_objective
+
+
+class WordTokenizer:
+    """One token per vocabulary entry; decode joins the pieces."""
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def decode(self, ids):
+        return "".join(self.vocab[i] for i in ids)
+
+
+class TestMakeObjective:
+    """Tests for the objective registry"""
+
+    def test_default_is_full_lm(self):
+        """Default config trains on every label"""
+        labels = torch.arange(10).view(1, -1)
+        objective = make_objective(LearningConfig())
+        assert type(objective) is Objective
+        assert torch.equal(objective.select(labels, labels), labels)
+
+    def test_unknown_objective(self):
+        """Unknown names are rejected"""
+        with pytest.raises(ValueError):
+            make_objective(LearningConfig(objective="mlm"))
+
+
+class TestMaskedSpanObjective:
+    """Tests for random span selection"""
+
+    def test_keeps_about_mask_ratio(self):
+        """Roughly mask_ratio of positions keep their labels, in spans"""
+        labels = torch.arange(1000).repeat(4, 1)
+        selected = MaskedSpanObjective(mask_ratio=0.15, span_length=3).select(labels, labels)
+        kept = (selected != -100).float().mean().item()
+        assert 0.08 < kept <= 0.15
+        assert torch.equal(selected[selected != -100], labels[selected != -100])
+
+    def test_does_not_modify_labels(self):
+        """Input labels are left untouched (they may alias input_ids)"""
+        labels = torch.arange(100).view(1, -1)
+        MaskedSpanObjective(mask_ratio=0.5).select(labels, labels)
+        assert torch.equal(labels, torch.arange(100).view(1, -1))
+
+    def test_keeps_ignored_labels_ignored(self):
+        """Positions already at -100 stay ignored"""
+        labels = torch.full((2, 50), -100)
+        selected = MaskedSpanObjective(mask_ratio=1.0).select(labels, labels)
+        assert (selected == -100).all()
+
+
+class TestSalientTokenObjective:
+    """Tests for number / named-entity selection"""
+
+    def test_selects_numbers_and_names(self):
+        """Numbers and capitalized words, including their continuation pieces"""
+        vocab = ["The", " tower", " in", " Par", "is", " is", " 3", "30", " m", " tall", "."]
+        tokenizer = WordTokenizer(vocab)
+        ids = torch.arange(len(vocab)).view(1, -1)
+        selected = SalientTokenObjective(tokenizer).select(ids, ids.clone())
+        picked = [vocab[i] for i in selected[selected != -100].tolist()]
+        assert picked == ["The", " Par", "is", " 3", "30"]
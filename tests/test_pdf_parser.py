@@ -1,4 +1,5 @@
 """Tests for PDFParser - Step 2.2, 2.3"""
+import fitz
 import pytest
 from pdf_parser import PDFParser, PDFExtractionError
 
@@ -55,3 +56,34 @@ class TestPDFParser:
         corrupt_pdf = b"%PDF-1.4\ncorrupt content here"
         with pytest.raises(PDFExtractionError):
             parser.parse(corrupt_pdf)
+
+
+class TestPDFParserPages:
+    """Test PDFParser.iter_pages() streaming extraction"""
+    
+    @pytest.fixture
+    def pdf_path(self, tmp_path):
+        """Write a 20-page PDF with one numbered line per page"""
+        doc = fitz.open()
+        for i in range(20):
+            doc.new_page().insert_text((72, 72), f"Page number {i + 1}")
+        path = tmp_path / "pages.pdf"
+        doc.save(str(path))
+        doc.close()
+        return str(path)
+    
+    def test_iter_pages_in_order(self, pdf_path):
+        """Pages come back numbered from 1, in order, across worker tasks"""
+        parser = PDFParser(workers=2, pages_per_task=3)
+        pages = list(parser.iter_pages(pdf_path))
+        
+        assert parser.page_count(pdf_path) == 20
+        assert [n for n, _ in pages] == list(range(1, 21))
+        assert all(f"Page number {n}" in text for n, text in pages)
+    
+    def test_iter_pages_invalid_file_raises_error(self, tmp_path):
+        """A non-PDF path raises PDFExtractionError"""
+        path = tmp_path / "bad.pdf"
+        path.write_bytes(b"not a pdf file at all")
+        with pytest.raises(PDFExtractionError):
+            list(PDFParser().iter_pages(str(path)))
@@ -0,0 +1,69 @@
+"""Tests for pipeline profiling hooks"""
+import json
+from types import SimpleNamespace
+import torch
+import profiling
+from profiling import Profiler, record, stage
+from ttt_linear import TTTLinear
+
+
+class TestProfiler:
+    """Test stage/event collection and export"""
+
+    def test_inactive_is_noop(self):
+        """Module helpers do nothing without an active profiler"""
+        assert profiling.active() is None
+        with stage("forward"):
+            pass
+        record("epoch", loss=1.0)
+
+    def test_collects_stages_and_callbacks(self):
+        """Stages become spans, callbacks see them, summary aggregates"""
+        seen = []
+        with Profiler(sync_cuda=False) as profiler:
+            profiler.on("forward", lambda span: seen.append(span["args"]["tokens"]))
+            for tokens in (3, 5):
+                with stage("forward", tokens=tokens):
+                    pass
+            record("epoch", loss=2.0)
+        assert profiling.active() is None
+        assert seen == [3, 5]
+        assert profiler.summary()["forward"]["count"] == 2
+        assert profiler.events[0]["args"]["loss"] == 2.0
+
+    def test_chrome_trace(self, tmp_path):
+        """Trace has complete events for spans and instant events"""
+        with Profiler(sync_cuda=False) as profiler:
+            with stage("chunk"):
+                pass
+            record("epoch")
+        path = tmp_path / "trace.json"
+        profiler.to_chrome_trace(str(path))
+        events = json.loads(path.read_text())["traceEvents"]
+        assert [e["ph"] for e in events] == ["X", "i"]
+        assert events[0]["name"] == "chunk"
+
+
+class TestLayerTiming:
+    """Test per-TTTLinear forward/backward spans"""
+
+    def test_forward_and_backward_spans(self):
+        """Each attached layer gets one forward and one backward span"""
+        layers = [TTTLinear(8, 16, 8), TTTLinear(8, 16, 8)]
+        for layer in layers:
+            for p in (layer.W_up.weight, layer.W_out.weight):
+                p.requires_grad_(False)
+        model = SimpleNamespace(ttt_layer_indices=[4, 5], ttt_layers=layers)
+
+        with Profiler(sync_cuda=False) as profiler:
+            profiler.attach(model)
+            x = torch.randn(1, 3, 8)
+            layers[1](layers[0](x)).sum().backward()
+        names = sorted(span["name"] for span in profiler.spans)
+        assert names == [
+            "ttt_layer_4.backward", "ttt_layer_4.forward",
+            "ttt_layer_5.backward", "ttt_layer_5.forward",
+        ]
+        # Hooks are removed on exit
+        layers[0](x)
+        assert len(profiler.spans) == 4
@@ -0,0 +1,61 @@
+"""Tests for the safetensors-based session format"""
+import torch
+from config import Document, DocumentChunk, DocumentStatus
+from session_format import document_from_dict, document_to_dict, load_state, read_metadata, save_state
+
+
+def make_document():
+    chunks = [
+        DocumentChunk(index=0, text="Chunk 1", token_ids=[1, 2], token_count=2, start_page=1, end_page=1),
+        DocumentChunk(index=1, text="Chunk 2", token_ids=[3], token_count=1),
+    ]
+    return Document(id="doc", filename="doc.txt", page_count=1, total_tokens=3,
+                    chunks=chunks, content_hash="abc")
+
+
+class TestDocumentDict:
+    """Test Document <-> header dict conversion"""
+
+    def test_drops_text_and_token_ids(self):
+        """Test chunk payloads are not written to the header"""
+        data = document_to_dict(make_document())
+        assert "token_ids" not in data["chunks"][0]
+        assert "text" not in data["chunks"][0]
+        assert data["status"] == "ready"
+
+    def test_roundtrip_metadata(self):
+        """Test metadata survives the roundtrip"""
+        doc = document_from_dict(document_to_dict(make_document()))
+        assert doc.filename == "doc.txt"
+        assert doc.status == DocumentStatus.READY
+        assert doc.content_hash == "abc"
+        assert [c.token_count for c in doc.chunks] == [2, 1]
+        assert doc.chunks[0].start_page == 1
+
+
+class TestSaveLoadState:
+    """Test tensor storage and header access"""
+
+    def test_roundtrip(self, tmp_path):
+        """Test per-layer tensors and header are preserved"""
+        path = str(tmp_path / "s.safetensors")
+        state = [{"W_h_delta": torch.randn(3, 4)}, {"W_h_delta": torch.randn(3, 4)}]
+        save_state(path, state, {"adapter_rank": 0})
+        
+        loaded = load_state(path)
+        assert len(loaded) == 2
+        assert torch.equal(loaded[1]["W_h_delta"], state[1]["W_h_delta"])
+        
+        header = read_metadata(path)
+        assert header["adapter_rank"] == 0
+        assert header["num_layers"] == 2
+
+    def test_downcast(self, tmp_path):
+        """Test optional fp16/bf16 storage"""
+        path = str(tmp_path / "s.safetensors")
+        state = [{"adapter_A": torch.randn(2, 4), "adapter_B": torch.randn(4, 2)}]
+        save_state(path, state, {}, dtype="bf16")
+        
+        loaded = load_state(path)
+        assert loaded[0]["adapter_A"].dtype == torch.bfloat16
+        assert torch.allclose(loaded[0]["adapter_B"].float(), state[0]["adapter_B"], atol=1e-1)
@@ -0,0 +1,89 @@
+"""Tests for TTTStateStore"""
+import torch
+from config import Document
+from state_store import TTTStateStore
+
+
+def make_state(value, size=4):
+    return [{"W_h": torch.full((size, size), float(value))} for _ in range(2)]
+
+
+def make_document(name):
+    return Document(id=name, filename=name, page_count=1, total_tokens=10, chunks=[])
+
+
+class FakeModel:
+    """Minimal stand-in exposing the TTTModel state API"""
+
+    def __init__(self):
+        self.adapter_rank = 0
+        self.state = make_state(0)
+
+    def enable_adapters(self, rank):
+        self.adapter_rank = rank
+
+    def load_ttt_state(self, states):
+        for mine, theirs in zip(self.state, states):
+            mine["W_h"].copy_(theirs["W_h"])
+
+
+class TestTTTStateStore:
+    """Test document-keyed storage, LRU residency and activation"""
+
+    def test_content_hash_is_stable(self):
+        """Test the same text always maps to the same key"""
+        assert TTTStateStore.content_hash("abc") == TTTStateStore.content_hash("abc")
+        assert TTTStateStore.content_hash("abc") != TTTStateStore.content_hash("abd")
+
+    def test_put_get_roundtrip(self, tmp_path):
+        """Test a stored state can be read back from a fresh store"""
+        store = TTTStateStore(str(tmp_path))
+        store.put("k1", make_state(1), make_document("a.txt"))
+        assert "k1" in store
+        
+        reopened = TTTStateStore(str(tmp_path))
+        assert "k1" in reopened
+        assert torch.equal(reopened.get("k1")[0]["W_h"], torch.ones(4, 4))
+        assert reopened.load_document("k1").filename == "a.txt"
+
+    def test_put_copies_tensors(self, tmp_path):
+        """Test later in-place changes to the source do not leak into the store"""
+        store = TTTStateStore(str(tmp_path))
+        live = make_state(1)
+        store.put("k1", live, make_document("a.txt"))
+        live[0]["W_h"].fill_(7)
+        assert torch.equal(store.get("k1")[0]["W_h"], torch.ones(4, 4))
+
+    def test_lru_eviction_respects_cap(self, tmp_path):
+        """Test the resident set stays under the memory cap"""
+        store = TTTStateStore(str(tmp_path), max_resident_mb=0)
+        store.put("k1", make_state(1), make_document("a.txt"))
+        store.put("k2", make_state(2), make_document("b.txt"))
+        assert list(store._resident) == ["k2"]
+        # Evicted entries still load from disk
+        assert torch.equal(store.get("k1")[1]["W_h"], torch.ones(4, 4))
+
+    def test_activate_swaps_in_place(self, tmp_path):
+        """Test activate copies the stored weights into the model"""
+        store = TTTStateStore(str(tmp_path))
+        store.put("k1", make_state(3), make_document("a.txt"), adapter_rank=2)
+        model = FakeModel()
+        live = model.state[0]["W_h"]
+        
+        store.activate(model, "k1")
+        assert model.adapter_rank == 2
+        assert model.state[0]["W_h"] is live
+        assert torch.equal(live, torch.full((4, 4), 3.0))
+        assert store.active_key == "k1"
+
+    def test_resolve_and_remove(self, tmp_path):
+        """Test lookup by filename/prefix and removal"""
+        store = TTTStateStore(str(tmp_path))
+        store.put("abc123", make_state(1), make_document("a.txt"))
+        assert store.resolve("a.txt") == "abc123"
+        assert store.resolve("abc") == "abc123"
+        assert store.resolve("missing") is None
+        
+        store.remove("abc123")
+        assert "abc123" not in store
+        assert store.list_documents() == []
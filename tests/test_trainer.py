@@ -0,0 +1,303 @@
+"""Tests for TTTTrainer schedules, stopping rules, batching, resuming and incremental re-learning"""
+from dataclasses import replace
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import torch
+from benchmarks.run_benchmarks import build_model, build_tokenizer, sample_text
+import trainer as trainer_module
+from chunker import DocumentChunker, chunk_hash
+from config import Document, DocumentChunk, LearningConfig
+from trainer import TTTTrainer
+
+
+def make_document(texts):
+    chunks = [
+        DocumentChunk(index=i, text="", token_ids=ids, token_count=len(ids), token_hash=chunk_hash(ids))
+        for i, ids in enumerate(np.array([ord(c) for c in t], dtype=np.int32) for t in texts)
+    ]
+    return Document(id="d", filename="d.txt", page_count=1, total_tokens=sum(c.token_count for c in chunks), chunks=chunks)
+
+
+class TestTrainUpdate:
+    """Test chunk diffing and replay selection for learn --update"""
+
+    def test_changed_chunks(self):
+        """Edited and added chunks are changed, the rest unchanged"""
+        previous = make_document(["alpha", "beta", "gamma"])
+        document = make_document(["alpha", "BETA", "gamma", "delta"])
+        changed, unchanged = TTTTrainer.changed_chunks(document, previous)
+        assert [c.index for c in changed] == [1, 3]
+        assert [c.index for c in unchanged] == [0, 2]
+
+    def test_trains_changed_plus_replay(self):
+        """Only changed chunks and replay_ratio replayed chunks are trained on"""
+        previous = make_document([f"chunk {i}" for i in range(10)])
+        document = make_document([f"chunk {i}" for i in range(8)] + ["new 8", "new 9"])
+        trainer = TTTTrainer(SimpleNamespace(), None, LearningConfig(replay_ratio=1.0))
+        trained = []
+        trainer.train = lambda doc, epochs, callback: trained.append(doc)
+
+        trainer.train_update(document, previous)
+        indices = [c.index for c in trained[0].chunks]
+        assert len(indices) == 4 and {8, 9} <= set(indices)
+        assert indices == sorted(indices)
+        assert len(document.chunks) == 10
+
+
+class TestResume:
+    """Test that a run restored from state_dict continues where it stopped"""
+
+    def setup_method(self):
+        self.tokenizer = build_tokenizer(vocab_size=400)
+        self.model = build_model(self.tokenizer, hidden_size=32, num_layers=2, ttt_layers=1, frozen_dtype="fp32")
+        chunks = DocumentChunker(self.tokenizer, chunk_size=48, decode_text=False).chunk(sample_text(1000))[:4]
+        self.document = Document(id="d", filename="d", page_count=1,
+                                 total_tokens=sum(c.token_count for c in chunks), chunks=chunks)
+        self.config = LearningConfig(inner_lr=1e-2, epochs=3, lr_schedule="cosine", warmup_steps=3,
+                                     focus_hard_chunks=False)
+
+    def test_state_dict_round_trip(self):
+        """A fresh trainer restores optimizer moments and counters"""
+        trainer = TTTTrainer(self.model, self.tokenizer, self.config)
+        trainer.train(self.document, epochs=1)
+        state = trainer.state_dict()
+
+        restored = TTTTrainer(self.model, self.tokenizer, self.config)
+        restored.load_state_dict(state)
+        assert restored.global_step == trainer.global_step == len(self.document.chunks)
+        assert restored.epochs_completed == 1
+        for saved, loaded in zip(state["optimizer"]["state"].values(),
+                                 restored.state_dict()["optimizer"]["state"].values()):
+            torch.testing.assert_close(loaded["exp_avg"], saved["exp_avg"])
+            torch.testing.assert_close(loaded["exp_avg_sq"], saved["exp_avg_sq"])
+
+    def test_resume_continues_schedule(self):
+        """Stopping after one epoch and resuming equals one uninterrupted run"""
+        self.model.reset_learning()
+        full = TTTTrainer(self.model, self.tokenizer, self.config).train(self.document)
+        expected = self.model.ttt_layers[0].W_h.weight.detach().clone()
+
+        self.model.reset_learning()
+        first = TTTTrainer(self.model, self.tokenizer, replace(self.config, token_budget=self.document.total_tokens))
+        stopped = first.train(self.document)
+        assert stopped.stop_reason == "budget" and len(stopped.loss_history) == 1
+
+        resumed = TTTTrainer(self.model, self.tokenizer, self.config)
+        resumed.load_state_dict(first.state_dict())
+        rest = resumed.train(self.document, resume=True)
+        assert len(rest.loss_history) == 2
+        assert resumed.epochs_completed == 3
+        assert stopped.loss_history + rest.loss_history == pytest.approx(full.loss_history)
+        torch.testing.assert_close(self.model.ttt_layers[0].W_h.weight.detach(), expected)
+
+
+class TestTrainStreaming:
+    """Test streaming the first epoch against train() on the finished document"""
+
+    def test_matches_train(self):
+        """Warmup runs once across the streamed and the later epochs"""
+        tokenizer = build_tokenizer(vocab_size=400)
+        model = build_model(tokenizer, hidden_size=32, num_layers=2, ttt_layers=1, frozen_dtype="fp32")
+        chunks = DocumentChunker(tokenizer, chunk_size=48, decode_text=False).chunk(sample_text(1000))[:4]
+        config = LearningConfig(inner_lr=1e-2, epochs=3, warmup_steps=6)
+
+        model.reset_learning()
+        expected_metrics = TTTTrainer(model, tokenizer, config).train(
+            Document(id="d", filename="d", page_count=1, total_tokens=0, chunks=chunks)
+        )
+        expected = model.ttt_layers[0].W_h.weight.detach().clone()
+
+        model.reset_learning()
+        document = Document(id="d", filename="d", page_count=1, total_tokens=0, chunks=[])
+        metrics = TTTTrainer(model, tokenizer, config).train_streaming(document, iter(chunks))
+        assert document.chunks == chunks
+        assert metrics.loss_history == pytest.approx(expected_metrics.loss_history)
+        torch.testing.assert_close(model.ttt_layers[0].W_h.weight.detach(), expected)
+
+
+class TestInterrupted:
+    """Test that a failed or interrupted run leaves TTT learning disabled"""
+
+    @pytest.mark.parametrize("streaming", [False, True])
+    @pytest.mark.parametrize("update_mode", ["backprop", "local"])
+    def test_learning_disabled(self, streaming, update_mode):
+        """An exception mid-epoch still turns off gradients and local updates"""
+        tokenizer = build_tokenizer(vocab_size=400)
+        model = build_model(tokenizer, hidden_size=32, num_layers=2, ttt_layers=1, frozen_dtype="fp32")
+        chunks = DocumentChunker(tokenizer, chunk_size=48, decode_text=False).chunk(sample_text(300))[:2]
+        document = Document(id="d", filename="d", page_count=1, total_tokens=0, chunks=[] if streaming else chunks)
+        trainer = TTTTrainer(model, tokenizer, LearningConfig(epochs=2, update_mode=update_mode))
+
+        def interrupt(*args):
+            raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            if streaming:
+                trainer.train_streaming(document, iter(chunks), progress_callback=interrupt)
+            else:
+                trainer.train(document, progress_callback=interrupt)
+        layer = model.ttt_layers[0]
+        assert layer.local_lr == 0.0
+        assert not layer.W_h.weight.requires_grad
+        assert not model.model.training
+
+
+def make_chunks(lengths):
+    return [
+        DocumentChunk(index=i, text="", token_ids=np.arange(1, n + 1, dtype=np.int32) + i, token_count=n)
+        for i, n in enumerate(lengths)
+    ]
+
+
+class TestBatching:
+    """Test micro-batch grouping, packing and collation"""
+
+    def make_trainer(self, **kwargs):
+        model = SimpleNamespace(device=torch.device("cpu"))
+        return TTTTrainer(model, SimpleNamespace(pad_token_id=0), LearningConfig(**kwargs))
+
+    def test_short_tail_runs_alone(self):
+        """Full-size chunks share batches and the short tail chunk is not padded against them"""
+        batches = self.make_trainer(batch_size=2)._make_batches(make_chunks([8, 8, 8, 3]))
+        assert [[row[0].index for row in batch] for batch in batches] == [[0, 1], [2], [3]]
+
+    def test_packing_fills_rows(self):
+        """Short chunks are packed into rows no longer than the longest chunk"""
+        batches = self.make_trainer(batch_size=2, pack_chunks=True)._make_batches(make_chunks([8, 5, 3, 4, 4]))
+        rows = [[c.index for c in row] for batch in batches for row in batch]
+        assert rows == [[0], [1, 2], [3, 4]]
+
+    def test_collate_masks_segments_and_padding(self):
+        """Packed segments and padding get segment ids, and no label crosses a boundary"""
+        chunks = make_chunks([3, 2, 4])
+        input_ids, labels, segment_ids = self.make_trainer()._collate([[chunks[0], chunks[1]], [chunks[2]]])
+        assert segment_ids.tolist() == [[1, 1, 1, 2, 2], [1, 1, 1, 1, 0]]
+        assert input_ids[1, 4] == 0
+        assert labels.tolist() == [[-100, 2, 3, -100, 3], [-100, 4, 5, 6, -100]]
+
+    def test_plain_batch_has_no_segments(self):
+        """Equal-length single-chunk rows use the plain causal path"""
+        chunks = make_chunks([4, 4])
+        input_ids, labels, segment_ids = self.make_trainer()._collate([[chunks[0]], [chunks[1]]])
+        assert segment_ids is None
+        assert torch.equal(labels, input_ids)
+
+
+class TestBatchedTraining:
+    """Test that batching and packing change speed, not what is learned"""
+
+    def setup_method(self):
+        self.tokenizer = build_tokenizer(vocab_size=400)
+        self.model = build_model(self.tokenizer, hidden_size=32, num_layers=2, ttt_layers=1, frozen_dtype="fp32")
+        self.chunks = DocumentChunker(self.tokenizer, chunk_size=24, decode_text=False).chunk(sample_text(600))[:4]
+        self.document = Document(id="d", filename="d", page_count=1,
+                                 total_tokens=sum(c.token_count for c in self.chunks), chunks=self.chunks)
+
+    def test_packed_loss_is_token_mean(self):
+        """A packed row's loss is the token-weighted mean of running each chunk alone"""
+        trainer = TTTTrainer(self.model, self.tokenizer, LearningConfig())
+        short = [replace(c, token_ids=c.token_ids[:n], token_count=n) for c, n in zip(self.chunks, (10, 7))]
+        with torch.no_grad():
+            losses = []
+            for chunk in short:
+                ids = torch.as_tensor(chunk.token_ids, dtype=torch.long).unsqueeze(0)
+                losses.append(self.model.forward_suffix(self.model.forward_prefix(ids), labels=ids).loss)
+            input_ids, labels, segment_ids = trainer._collate([short])
+            hidden = self.model.forward_prefix(input_ids, segment_ids=segment_ids)
+            packed = self.model.forward_suffix(hidden, labels=labels, segment_ids=segment_ids).loss
+        expected = (losses[0] * 9 + losses[1] * 6) / 15
+        torch.testing.assert_close(packed, expected)
+
+    def test_accumulation_matches_batch(self):
+        """accumulation_steps=2 over single chunks takes the same steps as batches of 2"""
+        assert len({c.token_count for c in self.chunks}) == 1
+        weights = []
+        for config in (LearningConfig(accumulation_steps=2), LearningConfig(batch_size=2)):
+            self.model.reset_learning()
+            TTTTrainer(self.model, self.tokenizer, replace(config, inner_lr=1e-2, epochs=2)).train(self.document)
+            weights.append(self.model.ttt_layers[0].W_h.weight.detach().clone())
+        torch.testing.assert_close(weights[0], weights[1])
+
+
+class ScriptedTrainer(TTTTrainer):
+    """TTTTrainer whose epochs report scripted chunk losses instead of running a model"""
+
+    def __init__(self, config, loss, clock=None):
+        model = SimpleNamespace(
+            enable_ttt_learning=lambda: None, disable_ttt_learning=lambda: None,
+            ttt_parameters=lambda: [torch.nn.Parameter(torch.zeros(1))], ttt_layers=[]
+        )
+        super().__init__(model, None, config)
+        self.loss = loss  # (epoch, chunk index) -> loss
+        self.clock = clock
+        self.trained = []  # Chunk indices per epoch
+
+    def _train_epoch(self, document, batches, optimizer, set_lr, progress_callback=None,
+                     chunk_losses=None, out_of_budget=None, verbose=True):
+        losses, tokens, exhausted = [], 0, False
+        for idx, batch in enumerate(batches):
+            if idx > 0 and out_of_budget(tokens):
+                exhausted = True
+                break
+            chunk = batch[0][0]
+            chunk_losses[chunk.index] = self.loss(self.epochs_completed, chunk.index)
+            losses.append(chunk_losses[chunk.index])
+            tokens += chunk.token_count
+            if self.clock is not None:
+                self.clock[0] += chunk.token_count
+        self.trained.append([batch[0][0].index for batch in batches[:len(losses)]])
+        return sum(losses) / max(1, len(losses)), len(losses), tokens, tokens - len(losses), exhausted
+
+
+class TestStopping:
+    """Test early stopping and budgets in TTTTrainer.train"""
+
+    def setup_method(self):
+        chunks = make_chunks([11] * 4)
+        self.document = Document(id="d", filename="d", page_count=1, total_tokens=44, chunks=chunks)
+
+    def test_plateau(self):
+        """Stops once plateau_patience epochs bring no improvement"""
+        trainer = ScriptedTrainer(LearningConfig(epochs=10, plateau_patience=2), lambda epoch, i: 1.0)
+        metrics = trainer.train(self.document)
+        assert metrics.stop_reason == "plateau"
+        assert len(metrics.loss_history) == 3
+        assert metrics.tokens_processed == 3 * 40
+
+    def test_target_loss(self):
+        """Chunks at target_loss are dropped, and training stops when none are left"""
+        trainer = ScriptedTrainer(LearningConfig(epochs=10, target_loss=0.5), lambda epoch, i: (i + 1) / (epoch + 1))
+        metrics = trainer.train(self.document)
+        assert metrics.stop_reason == "target_loss"
+        assert trainer.trained == [[0, 1, 2, 3], [0, 1, 2, 3], [1, 2, 3], [1, 2, 3], [2, 3], [2, 3], [3], [3]]
+        assert metrics.tokens_processed == 20 * 10
+
+    def test_token_budget(self):
+        """token_budget stops mid-epoch; focus_hard_chunks off keeps full epochs"""
+        trainer = ScriptedTrainer(LearningConfig(epochs=10, token_budget=110, focus_hard_chunks=False),
+                                  lambda epoch, i: 1.0 / (epoch + 1))
+        metrics = trainer.train(self.document)
+        assert metrics.stop_reason == "budget"
+        assert trainer.trained == [[0, 1, 2, 3], [0, 1, 2, 3], [0, 1]]
+        assert metrics.tokens_processed == 10 * 10
+
+    def test_time_budget(self, monkeypatch):
+        """time_budget_seconds is spent at the observed tokens-per-second rate"""
+        clock = [0.0]
+        monkeypatch.setattr(trainer_module.time, "perf_counter", lambda: clock[0])
+        trainer = ScriptedTrainer(LearningConfig(epochs=10, time_budget_seconds=88, focus_hard_chunks=False),
+                                  lambda epoch, i: 1.0 / (epoch + 1), clock)
+        metrics = trainer.train(self.document)
+        assert metrics.stop_reason == "budget"
+        assert trainer.trained == [[0, 1, 2, 3], [0, 1, 2, 3]]
+        assert metrics.tokens_processed == 8 * 10
+
+    def test_focus_hard_chunks(self):
+        """Under a tight budget, later epochs revisit only the highest-loss chunks"""
+        trainer = ScriptedTrainer(LearningConfig(epochs=4, token_budget=88),
+                                  lambda epoch, i: [0.1, 0.9, 0.2, 0.8][i])
+        metrics = trainer.train(self.document)
+        assert metrics.stop_reason is None
+        assert trainer.trained == [[0, 1, 2, 3], [1], [1], [1, 3]]
+        assert metrics.tokens_processed == 8 * 10
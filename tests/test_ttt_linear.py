@@ -0,0 +1,183 @@
+"""Tests for TTTLinear precision, fused forward, local updates and adapters"""
+import pytest
+import torch
+import torch.nn.functional as F
+from ttt_linear import Int8Linear, TTTLinear
+
+
+def make_layer():
+    torch.manual_seed(0)
+    layer = TTTLinear(8, 16, 8)
+    layer.snapshot_initial()
+    return layer
+
+
+class TestFusedForward:
+    """Test the packed gate/up path"""
+
+    def test_matches_separate_projections(self):
+        """Output, input gradient and W_h gradient match the plain SwiGLU"""
+        layer = make_layer()
+        for p in (layer.W_up.weight, layer.W_out.weight):
+            p.requires_grad_(False)
+        assert layer.W_h.weight.data_ptr() == layer._gate_up.data_ptr()
+
+        x = torch.randn(2, 5, 8, requires_grad=True)
+        layer(x).square().sum().backward()
+        grad_x, grad_w = x.grad.clone(), layer.W_h.weight.grad.clone()
+        x.grad = layer.W_h.weight.grad = None
+
+        out = F.linear(F.silu(F.linear(x, layer.W_h.weight)) * F.linear(x, layer.W_up.weight), layer.W_out.weight)
+        out.square().sum().backward()
+        assert torch.allclose(grad_x, x.grad, atol=1e-6)
+        assert torch.allclose(grad_w, layer.W_h.weight.grad, atol=1e-6)
+
+    def test_packing_survives_updates_and_moves(self):
+        """Optimizer steps and .to() keep W_h and the packed buffer in sync"""
+        layer = make_layer()
+        layer(torch.randn(1, 3, 8)).sum().backward()
+        torch.optim.SGD([layer.W_h.weight], lr=0.1).step()
+        assert torch.equal(layer._gate_up[:16], layer.W_h.weight)
+
+        layer.to(torch.float64)
+        assert layer._gate_up.dtype == torch.float64
+        assert layer.W_h.weight.data_ptr() == layer._gate_up.data_ptr()
+
+    def test_mixed_dtypes_unpack(self):
+        """Reduced-precision frozen weights fall back to separate GEMMs"""
+        layer = make_layer()
+        layer.set_frozen_dtype("bf16")
+        assert layer._gate_up is None
+
+
+class TestFrozenDtype:
+    """Test reduced-precision frozen weights"""
+
+    @pytest.mark.parametrize("dtype", ["fp16", "bf16", "int8"])
+    def test_close_to_fp32(self, dtype):
+        """Outputs and W_h gradients stay close to the fp32 layer"""
+        layer = make_layer()
+        x = torch.randn(2, 4, 8)
+        expected = layer(x)
+        expected.sum().backward()
+        expected_grad = layer.W_h.weight.grad.clone()
+        layer.W_h.weight.grad = None
+
+        layer.set_frozen_dtype(dtype)
+        out = layer(x)
+        out.sum().backward()
+        assert layer.W_h.weight.dtype == torch.float32
+        assert torch.allclose(out, expected, atol=0.05)
+        assert torch.allclose(layer.W_h.weight.grad, expected_grad, atol=0.05)
+
+    def test_initial_kept_low_only_when_exact(self):
+        """_W_h_initial drops to fp16 only if that loses nothing"""
+        layer = make_layer()
+        layer.set_frozen_dtype("fp16")
+        assert layer._W_h_initial.dtype == torch.float32
+
+        with torch.no_grad():
+            layer.W_h.weight.copy_(layer.W_h.weight.half().float())
+        layer.set_frozen_dtype("fp16")
+        assert layer._W_h_initial.dtype == torch.float16
+        assert layer.get_weight_delta() == 0.0
+
+    def test_int8_roundtrip(self):
+        """Int8Linear dequantizes to within one step per row"""
+        weight = torch.randn(16, 8)
+        linear = Int8Linear(weight)
+        assert linear.weight_int8.dtype == torch.int8
+        assert (linear.weight - weight).abs().max() <= linear.scale.max() / 2 + 1e-6
+
+
+class TestLocalUpdates:
+    """Test the in-forward W_h update"""
+
+    def test_matches_autograd_step(self):
+        """One block equals an SGD step on the local loss, masked by segment"""
+        layer = make_layer()
+        x = torch.randn(2, 5, 8)
+        segment_ids = torch.tensor([[1, 1, 1, 2, 2], [1, 1, 1, 1, 0]])
+
+        weight = layer.W_h.weight.detach().clone().requires_grad_(True)
+        y = layer.W_out(F.silu(F.linear(x, weight)) * layer.W_up(x))
+        pair = ((segment_ids[:, :-1] == segment_ids[:, 1:]) & (segment_ids[:, 1:] != 0)).float()
+        loss = 0.5 * (((y[:, :-1] - y[:, 1:].detach()) ** 2).sum(-1) * pair).sum() / pair.sum()
+        loss.backward()
+
+        layer.enable_local_updates(0.1, batch_size=5)
+        layer.segment_ids = segment_ids
+        with torch.no_grad():
+            out = layer(x)
+        assert torch.allclose(out, y.detach(), atol=1e-6)
+        assert torch.allclose(layer.W_h.weight, weight.detach() - 0.1 * weight.grad, atol=1e-6)
+
+    def test_decay_pulls_toward_initial(self):
+        """With no local signal, decay shrinks the learned delta"""
+        layer = make_layer()
+        with torch.no_grad():
+            layer.W_h.weight.add_(1.0)
+        layer.enable_local_updates(0.1, decay=1.0)
+        with torch.no_grad():
+            layer(torch.randn(1, 1, 8))  # lookahead-free block: no local gradient
+            layer(torch.zeros(1, 2, 8))  # zero input: zero gradient, decay only
+        assert torch.allclose(layer.W_h.weight - layer._W_h_initial, torch.full((16, 8), 0.9))
+
+    def test_grad_mode_is_untouched(self):
+        """With autograd on, forward is the plain SwiGLU and W_h stays put"""
+        layer = make_layer()
+        layer.enable_local_updates(0.1)
+        before = layer.W_h.weight.detach().clone()
+        layer(torch.randn(1, 6, 8))
+        assert torch.equal(layer.W_h.weight, before)
+
+
+class TestAdapter:
+    """Test low-rank adapter mode"""
+
+    def test_fresh_adapter_is_identity(self):
+        """B starts at zero, so enabling an adapter leaves the output unchanged"""
+        layer = make_layer()
+        x = torch.randn(2, 5, 8)
+        expected = layer(x)
+        layer.enable_adapter(4)
+        assert layer.trainable_parameters() == [layer.adapter_A, layer.adapter_B]
+        assert torch.allclose(layer(x), expected, atol=1e-6)
+
+    def test_anchor_penalty_is_delta_norm(self):
+        """The rank x rank form equals ||B @ A||_F^2"""
+        layer = make_layer()
+        layer.enable_adapter(3)
+        with torch.no_grad():
+            layer.adapter_B.normal_()
+        expected = torch.linalg.matrix_norm(layer.adapter_B @ layer.adapter_A) ** 2
+        assert torch.allclose(layer.anchor_penalty(), expected, rtol=1e-5)
+
+    def test_state_round_trip_and_reset(self):
+        """get/load_ttt_state restore A and B; reset_weights zeroes B only"""
+        layer = make_layer()
+        layer.enable_adapter(2)
+        with torch.no_grad():
+            layer.adapter_B.normal_()
+        state = {k: v.clone() for k, v in layer.get_ttt_state().items()}
+        x = torch.randn(1, 3, 8)
+        expected = layer(x)
+
+        layer.reset_weights()
+        assert torch.equal(layer.adapter_B, torch.zeros_like(layer.adapter_B))
+        assert torch.equal(layer.adapter_A, state["adapter_A"])
+        layer.load_ttt_state(state)
+        assert torch.equal(layer.adapter_B, state["adapter_B"])
+        assert torch.equal(layer(x), expected)
+
+    def test_disable_restores_full_mode(self):
+        """enable_adapter(0) trains W_h again with a fresh anchor"""
+        layer = make_layer()
+        weight = layer.W_h.weight.detach().clone()
+        layer.enable_adapter(2)
+        assert layer._W_h_initial.numel() == 0
+        layer.enable_adapter(0)
+        assert layer.adapter_rank == 0 and layer.adapter_A is None
+        assert layer.trainable_parameters() == [layer.W_h.weight]
+        assert torch.equal(layer._W_h_initial, weight)
+        assert layer.anchor_penalty().item() == 0.0
@@ -0,0 +1,163 @@
+"""Tests for TTTModel's split forward, chunked loss, checkpointing and prompt cache"""
+import pytest
+import torch
+from benchmarks.run_benchmarks import build_model, build_tokenizer, sample_text
+from chunker import DocumentChunker
+from config import Document, LearningConfig
+from generator import SYSTEM_PROMPT, Generator
+from trainer import TTTTrainer
+
+
+@pytest.fixture(scope="module")
+def model():
+    tokenizer = build_tokenizer(vocab_size=400)
+    model = build_model(tokenizer, hidden_size=32, num_layers=3, ttt_layers=1, frozen_dtype="fp32")
+    model.enable_ttt_learning()
+    model.eval()  # Same forward in both paths (no dropout)
+    return model
+
+
+def make_ids(model, length=24):
+    torch.manual_seed(1)
+    return torch.randint(0, model.model.config.vocab_size, (2, length))
+
+
+def loss_and_grad(model, ids, **kwargs):
+    model.ttt_layers[0].W_h.weight.grad = None
+    loss = model.forward_suffix(model.forward_prefix(ids), labels=ids, **kwargs).loss
+    loss.backward()
+    return loss.detach(), model.ttt_layers[0].W_h.weight.grad.clone()
+
+
+class TestInstall:
+    """Test how TTT layers are installed into the base model"""
+
+    def test_auto_dtype_is_lossless_and_packed(self):
+        """On CPU, "auto" keeps W_up / W_out in fp32 and packs them with the pretrained W_h"""
+        tokenizer = build_tokenizer(vocab_size=400)
+        model = build_model(tokenizer, hidden_size=32, num_layers=2, ttt_layers=1)
+        layer = model.ttt_layers[0]
+        assert layer.frozen_dtype == "fp32"
+        assert layer.W_up.weight.dtype == layer.W_out.weight.dtype == torch.float32
+        assert layer._gate_up is not None
+        assert layer.W_h.weight.data_ptr() == layer._gate_up.data_ptr()
+        assert torch.equal(layer._gate_up[32 * 4:], layer.W_up.weight)
+
+
+class TestSplitForward:
+    """Test forward_prefix + forward_suffix against the plain HF forward"""
+
+    def test_matches_hf_loss(self, model):
+        """Same loss and logits as the full model"""
+        ids = make_ids(model)
+        with torch.no_grad():
+            expected = model(ids, labels=ids)
+            out = model.forward_suffix(model.forward_prefix(ids), labels=ids)
+        assert model.prefix_length == 2
+        torch.testing.assert_close(out.loss, expected.loss)
+        torch.testing.assert_close(out.logits, expected.logits)
+
+    def test_chunked_loss_matches(self, model):
+        """loss_chunk_size gives the same loss and W_h gradient without logits"""
+        ids = make_ids(model)
+        loss, grad = loss_and_grad(model, ids)
+        out = model.forward_suffix(model.forward_prefix(ids), labels=ids, loss_chunk_size=7)
+        assert out.logits is None
+        chunked_loss, chunked_grad = loss_and_grad(model, ids, loss_chunk_size=7)
+        torch.testing.assert_close(chunked_loss, loss)
+        torch.testing.assert_close(chunked_grad, grad)
+
+    def test_checkpointing_keeps_gradient(self, model):
+        """Recomputing TTT blocks in backward leaves the W_h gradient unchanged"""
+        ids = make_ids(model)
+        loss, grad = loss_and_grad(model, ids)
+        model.activation_checkpointing = True
+        try:
+            checkpointed_loss, checkpointed_grad = loss_and_grad(model, ids)
+        finally:
+            model.activation_checkpointing = False
+        torch.testing.assert_close(checkpointed_loss, loss)
+        torch.testing.assert_close(checkpointed_grad, grad)
+
+
+class TestPromptCache:
+    """Test the system-prompt KV cache used by stream(prefix=...)"""
+
+    def setup_method(self):
+        self.tokenizer = build_tokenizer(vocab_size=400)
+        self.model = build_model(self.tokenizer, hidden_size=32, num_layers=2, ttt_layers=1, frozen_dtype="fp32")
+        self.model.disable_ttt_learning()
+        self.turn = Generator.build_turn("What do whales sing?")
+
+    def cached_entry(self):
+        list(self.model.stream(self.turn, max_new_tokens=2, temperature=0, prefix=SYSTEM_PROMPT))
+        return self.model._prompt_cache.get(SYSTEM_PROMPT)
+
+    def test_reused_across_questions(self):
+        """The prefix is prefilled once and its cache is not extended by decoding"""
+        first = self.cached_entry()
+        length = first[1].get_seq_length()
+        assert self.cached_entry() is first
+        assert first[1].get_seq_length() == length == first[0].shape[1]
+
+    @pytest.mark.parametrize("change", ["load_ttt_state", "reset_learning", "mark_ttt_updated"])
+    def test_dropped_when_weights_change(self, change):
+        """Loading, resetting or stepping TTT weights invalidates the cache"""
+        first = self.cached_entry()
+        if change == "load_ttt_state":
+            self.model.load_ttt_state(self.model.get_ttt_state())
+        else:
+            getattr(self.model, change)()
+        assert SYSTEM_PROMPT not in self.model._prompt_cache
+        assert self.cached_entry() is not first
+
+    def test_optimizer_step_drops_cache(self):
+        """A training step marks the TTT weights updated"""
+        first = self.cached_entry()
+        chunks = DocumentChunker(self.tokenizer, chunk_size=24, decode_text=False).chunk(sample_text(100))[:1]
+        document = Document(id="d", filename="d", page_count=1, total_tokens=chunks[0].token_count, chunks=chunks)
+        TTTTrainer(self.model, self.tokenizer, LearningConfig()).train(document, epochs=1)
+        assert self.model._prompt_cache == {}
+        assert self.cached_entry() is not first
+
+    def test_matches_uncached(self):
+        """Sampling after the cached prefix gives the same tokens as the full prompt"""
+        torch.manual_seed(3)
+        cached = list(self.model.stream(self.turn, max_new_tokens=12, temperature=1.0, prefix=SYSTEM_PROMPT))
+        torch.manual_seed(3)
+        uncached = list(self.model.stream(SYSTEM_PROMPT + self.turn, max_new_tokens=12, temperature=1.0))
+        assert len(cached) == 12
+        assert cached == uncached
+
+
+class TestGenerateBatch:
+    """Test batched generation against one prompt at a time"""
+
+    def test_left_padding_matches_single(self):
+        """Rows of different lengths give the same greedy tokens as separate calls"""
+        tokenizer = build_tokenizer(vocab_size=400)
+        model = build_model(tokenizer, hidden_size=32, num_layers=2, ttt_layers=1, frozen_dtype="fp32")
+        model.disable_ttt_learning()
+        tokenizer.padding_side = "right"  # The shared setting must not matter
+        prompts = ["Whales sing", "Crystals in the year 2145 glow when the whales sing"]
+        batched = model.generate_batch(prompts, max_new_tokens=6, temperature=0)
+        single = [model.generate_batch([p], max_new_tokens=6, temperature=0)[0] for p in prompts]
+        assert batched == single
+        assert tokenizer.padding_side == "right"
+
+    def test_cached_prefix_matches_full_prompt(self):
+        """A prefix from the prompt cache gives the same tokens as prefilling it in every row"""
+        tokenizer = build_tokenizer(vocab_size=400)
+        model = build_model(tokenizer, hidden_size=32, num_layers=2, ttt_layers=1, frozen_dtype="fp32")
+        model.disable_ttt_learning()
+        with torch.no_grad():  # Larger weights so greedy decoding does not repeat one token
+            for param in model.model.parameters():
+                if param.dim() == 2:
+                    param.normal_(0, 0.3)
+        prefix = "Crystals glow"
+        prompts = [" when whales sing", " in the year 2145 when the whales sing"]
+        batched = model.generate_batch(prompts, max_new_tokens=6, temperature=0, prefix=prefix)
+        full = [model.generate_batch([prefix + p], max_new_tokens=6, temperature=0)[0] for p in prompts]
+        assert batched == full
+        assert len(set(map(tuple, full))) == 2
+        assert model._prompt_cache[prefix][1].get_seq_length() == model._prompt_cache[prefix][0].shape[1]
@@ -2,75 +2,622 @@
 TTT Trainer - Implements the Inner Loop (Learning).
 """
 
+import math
+import random
 import time
+from contextlib import nullcontext
+from dataclasses import replace
+from typing import Iterable, List, Optional, Tuple
 import torch
 from torch.optim import AdamW
-from config import Document, LearningConfig, LearningMetrics
+from config import Document, DocumentChunk, LearningConfig, LearningMetrics
+from activation_cache import ActivationCache
+from objectives import make_objective
+from profiling import active as active_profiler, record, stage
+
+# A row only joins a micro-batch if padding it to the batch's longest row
+# wastes at most this fraction of that row (the short tail chunk runs alone).
+PAD_TOLERANCE = 0.125
 
 class TTTTrainer:
+    # Take every optimizer step even when a micro-batch's loss was NaN
+    # (data-parallel ranks must all join each gradient all-reduce)
+    sync_steps = False
+    
     def __init__(self, model, tokenizer, config: LearningConfig):
         self.model = model
         self.tokenizer = tokenizer
         self.config = config
+        self.optimizer = None
+        self.global_step = 0
+        self.epochs_completed = 0
+        self._prefix_cache = None
+        self.model.activation_checkpointing = config.activation_checkpointing
+        self.objective = make_objective(config, tokenizer)
+        if config.cache_prefix:
+            self._prefix_cache = ActivationCache(
+                max_memory_bytes=config.cache_max_memory_mb * 1024 * 1024,
+                spill_dir=config.cache_dir
+            )
+    
+    def clear_cache(self):
+        """Drop cached prefix activations (and any spill files)."""
+        if self._prefix_cache is not None:
+            self._prefix_cache.clear()
+    
+    def _make_batches(self, chunks: List[DocumentChunk]) -> List[List[List[DocumentChunk]]]:
+        """
+        Group chunks into micro-batches of rows (batch -> rows -> chunks).
+        
+        With pack_chunks, short chunks share a row (first-fit decreasing up to
+        the longest chunk). Rows are then grouped longest-first, and a row that
+        would need more than PAD_TOLERANCE padding starts a new batch, so
+        full-size chunks never get padded and the short tail chunk runs alone.
+        """
+        batch_size = max(1, self.config.batch_size)
+        if batch_size == 1 and not self.config.pack_chunks:
+            return [[[chunk]] for chunk in chunks]
+        
+        if self.config.pack_chunks:
+            capacity = max(c.token_count for c in chunks)
+            rows, free = [], []
+            for chunk in sorted(chunks, key=lambda c: c.token_count, reverse=True):
+                for r, space in enumerate(free):
+                    if chunk.token_count <= space:
+                        rows[r].append(chunk)
+                        free[r] -= chunk.token_count
+                        break
+                else:
+                    rows.append([chunk])
+                    free.append(capacity - chunk.token_count)
+        else:
+            rows = [[chunk] for chunk in chunks]
+        
+        batches, longest = [], 0
+        for row in sorted(rows, key=lambda r: sum(c.token_count for c in r), reverse=True):
+            length = sum(c.token_count for c in row)
+            if batches and len(batches[-1]) < batch_size and length >= (1 - PAD_TOLERANCE) * longest:
+                batches[-1].append(row)
+            else:
+                batches.append([row])
+                longest = length
+        return batches
+    
+    def _collate(self, batch: List[List[DocumentChunk]]):
+        """
+        Build (input_ids, labels, segment_ids) for a micro-batch.
+        
+        segment_ids is None when every row is one unpadded chunk, so the plain
+        causal path is used. Otherwise 0 marks padding and 1..k the chunks
+        packed into a row; labels are -100 on padding and segment starts.
+        A chunk's overlap_tokens (already trained on in the previous chunk)
+        stay as context but get -100 labels too.
+        """
+        device = self.model.device
+        lengths = [sum(c.token_count for c in row) for row in batch]
+        seq_len = max(lengths)
+        plain = all(len(row) == 1 for row in batch) and min(lengths) == seq_len
+        
+        pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else 0
+        input_ids = torch.full((len(batch), seq_len), pad_id, dtype=torch.long)
+        segment_ids = torch.zeros((len(batch), seq_len), dtype=torch.long)
+        for r, row in enumerate(batch):
+            pos = 0
+            for s, chunk in enumerate(row, start=1):
+                n = chunk.token_count
+                input_ids[r, pos:pos + n] = torch.as_tensor(chunk.token_ids, dtype=torch.long)
+                segment_ids[r, pos:pos + n] = s
+                pos += n
+        
+        input_ids = input_ids.to(device)
+        overlaps = any(c.overlap_tokens for row in batch for c in row)
+        if plain and not overlaps:
+            return input_ids, input_ids, None
+        
+        if plain:
+            labels = input_ids.clone()
+            segment_ids = None
+        else:
+            segment_ids = segment_ids.to(device)
+            labels = input_ids.masked_fill(segment_ids == 0, -100)
+            starts = torch.ones_like(segment_ids, dtype=torch.bool)
+            starts[:, 1:] = segment_ids[:, 1:] != segment_ids[:, :-1]
+            labels = labels.masked_fill(starts, -100)
+        
+        if overlaps:
+            for r, row in enumerate(batch):
+                pos = 0
+                for chunk in row:
+                    labels[r, pos:pos + chunk.overlap_tokens] = -100
+                    pos += chunk.token_count
+        return input_ids, labels, segment_ids
+    
+    def _prefix_hidden(self, document: Document, batch, input_ids, segment_ids):
+        """Frozen-prefix hidden states for a micro-batch, computed once per chunk."""
+        keys = [[(document.id, c.index, c.token_count) for c in row] for row in batch]
+        if not all(key in self._prefix_cache for row in keys for key in row):
+            hidden = self.model.forward_prefix(input_ids, segment_ids=segment_ids)
+            for r, row in enumerate(batch):
+                pos = 0
+                for chunk, key in zip(row, keys[r]):
+                    n = chunk.token_count
+                    self._prefix_cache.put(key, hidden[r:r + 1, pos:pos + n].clone())
+                    pos += n
+            return hidden
+        
+        if segment_ids is None:
+            return torch.cat([self._prefix_cache.get(row[0]) for row in keys], dim=0)
+        
+        first = self._prefix_cache.get(keys[0][0])
+        hidden = first.new_zeros(input_ids.shape + (first.shape[-1],))
+        for r, row in enumerate(batch):
+            pos = 0
+            for chunk, key in zip(row, keys[r]):
+                n = chunk.token_count
+                hidden[r, pos:pos + n] = self._prefix_cache.get(key)[0]
+                pos += n
+        return hidden
+    
+    def _params(self):
+        return self.model.ttt_parameters()
 
-    def train_on_document(self, document: Document, progress_callback=None):
+    def _enable_learning(self):
         self.model.enable_ttt_learning()
+        if self.config.update_mode == "local":
+            self.model.enable_local_updates(
+                self.config.local_lr, self.config.local_batch_size, self.config.anchor_strength
+            )
+        elif self.config.update_mode != "backprop":
+            raise ValueError(f"Unknown update_mode: {self.config.update_mode}")
+
+    def _get_optimizer(self):
+        """One AdamW for the trainer's lifetime, so moments survive across epochs."""
+        if self.optimizer is None:
+            self.optimizer = AdamW(self._params(), lr=self.config.inner_lr)
+        return self.optimizer
+
+    def _lr_factor(self, step: int, total_steps: int) -> float:
+        """LR multiplier: linear warmup, then constant / linear / cosine decay."""
+        warmup = self.config.warmup_steps
+        if step < warmup:
+            return (step + 1) / warmup
+        if self.config.lr_schedule == "constant" or total_steps <= warmup:
+            return 1.0
+        
+        progress = min(1.0, (step - warmup) / max(1, total_steps - warmup))
+        floor = self.config.min_lr_ratio
+        if self.config.lr_schedule == "linear":
+            return floor + (1 - floor) * (1 - progress)
+        if self.config.lr_schedule == "cosine":
+            return floor + (1 - floor) * 0.5 * (1 + math.cos(math.pi * progress))
+        raise ValueError(f"Unknown lr_schedule: {self.config.lr_schedule}")
+
+    def state_dict(self) -> dict:
+        """Optimizer state and step count, for saving alongside a session."""
+        return {
+            "optimizer": self.optimizer.state_dict() if self.optimizer is not None else None,
+            "global_step": self.global_step,
+            "epochs_completed": self.epochs_completed,
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        """Restore state from state_dict() so training continues where it stopped."""
+        if state.get("optimizer") is not None:
+            self._get_optimizer().load_state_dict(state["optimizer"])
+        self.global_step = state.get("global_step", 0)
+        self.epochs_completed = state.get("epochs_completed", 0)
+
+    def train(self, document: Document, epochs: Optional[int] = None, progress_callback=None,
+              resume: bool = False) -> LearningMetrics:
+        """
+        Run several epochs over the document with one optimizer and LR schedule.
+        
+        Stops early on a loss plateau, once every chunk reaches target_loss, or
+        when the time/token budget runs out. Under a tight budget the remaining
+        epochs only revisit the chunks with the highest loss.
+        
+        Args:
+            document: Chunked document to learn
+            epochs: Maximum number of passes (default: config.epochs)
+            progress_callback: Called as (chunk_index, total_chunks, loss) per chunk
+            resume: Continue the run restored by load_state_dict(): train only the
+                epochs not completed yet, with the LR schedule at global_step
+        """
+        epochs = self.config.epochs if epochs is None else epochs
+        self._enable_learning()
+        optimizer = self._get_optimizer()
+        
+        # The schedule spans the whole run, so a resumed run carries on where it stopped
+        start_step = 0 if resume else self.global_step
+        total_steps = epochs * self._steps_per_epoch(document)
+        if resume:
+            epochs = max(0, epochs - self.epochs_completed)
+        return self._train_epochs(
+            document, epochs, optimizer, self._lr_setter(optimizer, start_step, total_steps), progress_callback
+        )
+
+    def _steps_per_epoch(self, document: Document) -> int:
+        accumulation_steps = max(1, self.config.accumulation_steps)
+        return -(-len(self._make_batches(document.chunks)) // accumulation_steps)
+
+    def _lr_setter(self, optimizer, start_step: int, total_steps: int):
+        """set_lr callback for a run that began at start_step and lasts total_steps."""
+        def set_lr():
+            factor = self._lr_factor(self.global_step - start_step, total_steps)
+            for group in optimizer.param_groups:
+                group["lr"] = self.config.inner_lr * factor
+        return set_lr
+
+    def _train_epochs(self, document: Document, epochs: int, optimizer, set_lr,
+                      progress_callback=None) -> LearningMetrics:
+        """The epoch loop of train(), with its early stopping and budgets."""
+        t0 = time.perf_counter()
+        loss_history = []
+        chunks_processed = 0
+        tokens_processed = 0
+        target_tokens = 0
+        chunk_losses = {}
+        active = list(document.chunks)
+        best_loss = float('inf')
+        stale_epochs = 0
+        stop_reason = None
+        
+        try:
+            for epoch in range(epochs):
+                # Chunks that already hit the target loss are done
+                if self.config.target_loss is not None and chunk_losses:
+                    active = [c for c in active if chunk_losses.get(c.index, float('inf')) > self.config.target_loss]
+                    if not active:
+                        stop_reason = "target_loss"
+                        break
+                
+                epoch_chunks = active
+                affordable = self._affordable_tokens(t0, tokens_processed)
+                if affordable is not None:
+                    if affordable <= 0:
+                        stop_reason = "budget"
+                        break
+                    per_epoch = affordable / (epochs - epoch)
+                    if self.config.focus_hard_chunks and chunk_losses and per_epoch < sum(c.token_count for c in active):
+                        epoch_chunks = self._hardest_chunks(active, chunk_losses, per_epoch)
+                
+                def out_of_budget(done):
+                    remaining = self._affordable_tokens(t0, tokens_processed + done)
+                    return remaining is not None and remaining <= 0
+                
+                batches = self._make_batches(epoch_chunks)
+                epoch_loss, chunks, tokens, targets, exhausted = self._train_epoch(
+                    document, batches, optimizer, set_lr, progress_callback, chunk_losses, out_of_budget
+                )
+                loss_history.append(epoch_loss)
+                chunks_processed += chunks
+                tokens_processed += tokens
+                target_tokens += targets
+                self.epochs_completed += 1
+                self._record_epoch(epoch_loss, chunks, tokens)
+                
+                if exhausted:
+                    stop_reason = "budget"
+                    break
+                
+                # Plateau on the latest loss of every chunk, so focused epochs stay comparable
+                if self.config.plateau_patience > 0:
+                    doc_loss = sum(chunk_losses.values()) / max(1, len(chunk_losses))
+                    if doc_loss < best_loss - self.config.plateau_min_delta:
+                        best_loss = doc_loss
+                        stale_epochs = 0
+                    else:
+                        stale_epochs += 1
+                        if stale_epochs >= self.config.plateau_patience:
+                            stop_reason = "plateau"
+                            break
+        finally:
+            self.model.disable_ttt_learning()
+        
+        weight_delta_norm = math.sqrt(sum(l.get_weight_delta() ** 2 for l in self.model.ttt_layers))
+        return LearningMetrics(
+            initial_loss=loss_history[0] if loss_history else 0.0,
+            final_loss=loss_history[-1] if loss_history else 0.0,
+            loss_history=loss_history,
+            chunks_processed=chunks_processed,
+            tokens_processed=target_tokens,
+            learning_time_seconds=time.perf_counter() - t0,
+            weight_delta_norm=weight_delta_norm,
+            stop_reason=stop_reason
+        )
+
+    def _record_epoch(self, loss: float, chunks: int, tokens: int) -> None:
+        """Epoch event for an active profiler, with each TTT layer's |W_h - W_0|."""
+        if active_profiler() is None:
+            return
+        record(
+            "epoch", epoch=self.epochs_completed, loss=loss, chunks=chunks, tokens=tokens,
+            weight_deltas=[layer.get_weight_delta() for layer in self.model.ttt_layers]
+        )
+
+    def _affordable_tokens(self, t0: float, tokens_so_far: int) -> Optional[float]:
+        """Tokens left under the time/token budgets, or None if unconstrained."""
+        limits = []
+        if self.config.token_budget is not None:
+            limits.append(self.config.token_budget - tokens_so_far)
+        if self.config.time_budget_seconds is not None:
+            elapsed = time.perf_counter() - t0
+            remaining = self.config.time_budget_seconds - elapsed
+            if remaining <= 0:
+                return 0
+            if tokens_so_far > 0:
+                limits.append(remaining * tokens_so_far / elapsed)
+        return min(limits) if limits else None
+
+    def _hardest_chunks(self, chunks: List[DocumentChunk], chunk_losses: dict, token_target: float) -> List[DocumentChunk]:
+        """Highest-loss chunks (unseen first) up to token_target tokens, in document order."""
+        ranked = sorted(chunks, key=lambda c: chunk_losses.get(c.index, float('inf')), reverse=True)
+        picked, tokens = [], 0
+        for chunk in ranked:
+            if picked and tokens + chunk.token_count > token_target:
+                break
+            picked.append(chunk)
+            tokens += chunk.token_count
+        return sorted(picked, key=lambda c: c.index)
+
+    @staticmethod
+    def changed_chunks(document: Document, previous: Document) -> Tuple[List[DocumentChunk], List[DocumentChunk]]:
+        """(chunks whose tokens are not in previous, chunks previous already had), by token_hash."""
+        known = {c.token_hash for c in previous.chunks}
+        changed = [c for c in document.chunks if c.token_hash is None or c.token_hash not in known]
+        unchanged = [c for c in document.chunks if c.token_hash is not None and c.token_hash in known]
+        return changed, unchanged
+
+    def train_update(self, document: Document, previous: Document, epochs: Optional[int] = None,
+                     progress_callback=None) -> LearningMetrics:
+        """
+        Learn a new version of a document on top of the weights learned from
+        the previous one.
         
-        params = [l.W_h.weight for l in self.model.ttt_layers]
-        optimizer = AdamW(params, lr=self.config.inner_lr)
+        Only added or edited chunks are trained on, plus replay_ratio
+        unchanged chunks per changed chunk (a fixed random sample) so the
+        update doesn't erase what the rest of the document taught.
+        
+        Args:
+            document: New version, chunked with token hashes
+            previous: Version the current weights were learned from
+            epochs: Maximum number of passes (default: config.epochs)
+            progress_callback: Called as (chunk_index, total_chunks, loss) per chunk
+        """
+        changed, unchanged = self.changed_chunks(document, previous)
+        replay_count = min(len(unchanged), math.ceil(self.config.replay_ratio * len(changed)))
+        replay = random.Random(len(document.chunks)).sample(unchanged, replay_count)
+        chunks = sorted(changed + replay, key=lambda c: c.index)
+        return self.train(replace(document, chunks=chunks), epochs, progress_callback)
+
+    def train_on_document(self, document: Document, progress_callback=None):
+        """Single epoch; kept for callers that drive their own loop."""
+        return self.train(document, epochs=1, progress_callback=progress_callback)
+
+    def train_streaming(self, document: Document, chunks: Iterable[DocumentChunk], epochs: Optional[int] = None,
+                        progress_callback=None) -> LearningMetrics:
+        """
+        Learn a document whose chunks are still being produced.
+        
+        The first epoch trains on chunks as they arrive (appending them to
+        document.chunks), so a long PDF starts training while later pages
+        are still being extracted. The remaining epochs run as in train()
+        on the complete document, continuing the same LR schedule, within
+        whatever budget is left.
+        
+        Args:
+            document: Document to fill; its chunk list is extended in place
+            chunks: Chunk iterator, e.g. DocumentChunker.chunk_pages(...)
+            epochs: Maximum number of passes (default: config.epochs)
+            progress_callback: Called as (chunk_index, chunks_so_far, loss) per chunk
+        """
+        epochs = self.config.epochs if epochs is None else epochs
+        t0 = time.perf_counter()
+        
+        self._enable_learning()
+        optimizer = self._get_optimizer()
+        start_step = self.global_step
+        # Total length is unknown while streaming: warmup only, decay comes later
+        set_lr = self._lr_setter(optimizer, start_step, 0)
+        
+        def out_of_budget(done):
+            remaining = self._affordable_tokens(t0, tokens_processed + done)
+            return remaining is not None and remaining <= 0
+        
+        group_size = max(1, self.config.batch_size) * max(1, self.config.accumulation_steps)
+        chunk_losses = {}
+        pending = []
+        chunks_processed = 0
+        tokens_processed = 0
+        target_tokens = 0
+        exhausted = False
+        
+        def flush():
+            nonlocal chunks_processed, tokens_processed, target_tokens, exhausted
+            if not exhausted:
+                _, done, tokens, targets, exhausted = self._train_epoch(
+                    document, self._make_batches(pending), optimizer, set_lr, progress_callback,
+                    chunk_losses, out_of_budget, verbose=chunks_processed == 0
+                )
+                chunks_processed += done
+                tokens_processed += tokens
+                target_tokens += targets
+                exhausted = exhausted or out_of_budget(0)
+            pending.clear()
+        
+        try:
+            # Keep consuming after a budget stop so the document is complete
+            for chunk in chunks:
+                document.chunks.append(chunk)
+                pending.append(chunk)
+                if len(pending) >= group_size:
+                    flush()
+            if pending:
+                flush()
+            
+            document.total_tokens = sum(c.token_count for c in document.chunks)
+            self.epochs_completed += 1
+            first_loss = sum(chunk_losses.values()) / max(1, len(chunk_losses))
+            self._record_epoch(first_loss, chunks_processed, tokens_processed)
+            
+            if exhausted or epochs <= 1:
+                weight_delta_norm = math.sqrt(sum(l.get_weight_delta() ** 2 for l in self.model.ttt_layers))
+                return LearningMetrics(
+                    initial_loss=first_loss,
+                    final_loss=first_loss,
+                    loss_history=[first_loss],
+                    chunks_processed=chunks_processed,
+                    tokens_processed=target_tokens,
+                    learning_time_seconds=time.perf_counter() - t0,
+                    weight_delta_norm=weight_delta_norm,
+                    stop_reason="budget" if exhausted else None
+                )
+            
+            # Later epochs get whatever is left of the budgets
+            config = self.config
+            elapsed = time.perf_counter() - t0
+            self.config = replace(
+                config,
+                time_budget_seconds=None if config.time_budget_seconds is None else config.time_budget_seconds - elapsed,
+                token_budget=None if config.token_budget is None else config.token_budget - tokens_processed
+            )
+            try:
+                # Same run: warmup is not repeated and decay spans all epochs
+                total_steps = epochs * self._steps_per_epoch(document)
+                rest = self._train_epochs(
+                    document, epochs - 1, optimizer, self._lr_setter(optimizer, start_step, total_steps),
+                    progress_callback
+                )
+            finally:
+                self.config = config
+            
+            return LearningMetrics(
+                initial_loss=first_loss,
+                final_loss=rest.final_loss if rest.loss_history else first_loss,
+                loss_history=[first_loss] + rest.loss_history,
+                chunks_processed=chunks_processed + rest.chunks_processed,
+                tokens_processed=target_tokens + rest.tokens_processed,
+                learning_time_seconds=time.perf_counter() - t0,
+                weight_delta_norm=rest.weight_delta_norm,
+                stop_reason=rest.stop_reason
+            )
+        finally:
+            self.model.disable_ttt_learning()
+
+    def _train_epoch(self, document: Document, batches, optimizer, set_lr, progress_callback=None,
+                     chunk_losses=None, out_of_budget=None, verbose=True):
+        """
+        One pass over the batches.
+        
+        Returns (mean_loss, chunks, tokens, target_tokens, exhausted): tokens
+        counts inputs (what budgets meter), target_tokens the positions the
+        objective computed a loss on.
+        
+        Records each chunk's latest loss in chunk_losses and stops between
+        micro-batches once out_of_budget(tokens_so_far) is true.
+        
+        With update_mode "local" the TTT layers update W_h themselves during
+        a no-grad forward; the loss is only measured and the optimizer unused.
+        """
+        params = self._params()
+        accumulation_steps = max(1, self.config.accumulation_steps)
+        local = self.config.update_mode == "local"
         
         total_loss = 0
         steps = 0
+        chunks_done = 0
+        tokens_done = 0
+        targets_done = 0
+        pending = False
+        exhausted = False
         
-        for idx, chunk in enumerate(document.chunks):
-            input_ids = torch.tensor([chunk.token_ids], device=self.model.device)
+        for idx, batch in enumerate(batches):
+            if idx > 0 and out_of_budget is not None and out_of_budget(tokens_done):
+                exhausted = True
+                break
             
-            # 1. Forward Pass
-            outputs = self.model(input_ids=input_ids, labels=input_ids)
-            task_loss = outputs.loss
+            input_ids, labels, segment_ids = self._collate(batch)
+            labels = self.objective.select(input_ids, labels)
+            # Positions that are actually predicted (labels are shifted by one)
+            target_tokens = int((labels[:, 1:] != -100).sum())
             
-            # 2. Regularization (The Anchor)
-            reg_loss = 0.0
-            for layer in self.model.ttt_layers:
-                diff = layer.W_h.weight - layer._W_h_initial
-                reg_loss += torch.sum(diff ** 2)
+            # 1. Forward Pass: frozen prefix without autograd (cached when enabled),
+            # graph only through the TTT suffix
+            with torch.no_grad() if local else nullcontext(), stage("forward", tokens=int(input_ids.numel())):
+                if self._prefix_cache is not None:
+                    hidden = self._prefix_hidden(document, batch, input_ids, segment_ids)
+                else:
+                    hidden = self.model.forward_prefix(input_ids, segment_ids=segment_ids)
+                outputs = self.model.forward_suffix(
+                    hidden, labels=labels, segment_ids=segment_ids, loss_chunk_size=self.config.loss_chunk_size
+                )
+            task_loss = outputs.loss
             
-            # FIXED: Reduced strength to 0.01 to balance the scales
-            # Reg is ~40, Task is ~0.4.
-            # 40 * 0.01 = 0.4. Now they are equal!
-            strength = 0.01
-            loss = task_loss + (strength * reg_loss)
+            if local:
+                # W_h already moved; the anchor is the layers' decay toward W_0
+                self.global_step += 1
+                self.model.mark_ttt_updated()
+                loss = task_loss
+                if verbose and idx == 0 and self.epochs_completed % 5 == 0:
+                    print(f" [Epoch {self.epochs_completed}] Task: {task_loss.item():.4f} (local updates)")
+            else:
+                # 2. Regularization (The Anchor)
+                reg_loss = 0.0
+                for layer in self.model.ttt_layers:
+                    reg_loss += layer.anchor_penalty()
+                
+                # anchor_strength weights ||dW_h||^2 against the task loss
+                strength = self.config.anchor_strength
+                loss = task_loss + (strength * reg_loss)
+                
+                # LOGGING: Verify balance
+                if verbose and idx == 0 and self.epochs_completed % 5 == 0:
+                    print(f" [Epoch {self.epochs_completed}] Task: {task_loss.item():.4f} | Reg: {reg_loss.item():.4f} (x{strength}) = {loss.item():.4f}")
             
-            # LOGGING: Verify balance
-            if idx == 0 and steps % 5 == 0: 
-                print(f" [Step {steps}] Task: {task_loss.item():.4f} | Reg: {reg_loss.item():.4f} (x{strength}) = {loss.item():.4f}")
-
+            batch_chunks = [chunk for row in batch for chunk in row]
             if torch.isnan(loss):
-                if progress_callback: progress_callback(idx, len(document.chunks), float('nan'))
-                continue
+                if progress_callback:
+                    for chunk in batch_chunks:
+                        progress_callback(chunk.index, len(document.chunks), float('nan'))
+                pending = pending or (self.sync_steps and not local)
+            else:
+                # 3. Accumulate; scale so the effective step matches one big batch
+                if not local:
+                    with stage("backward"):
+                        (loss / accumulation_steps).backward()
+                    pending = True
+                
+                current_loss = task_loss.item()
+                record("loss", step=self.global_step, loss=current_loss, target_tokens=target_tokens)
+                total_loss += current_loss
+                steps += 1
+                chunks_done += len(batch_chunks)
+                tokens_done += sum(c.token_count for c in batch_chunks)
+                targets_done += target_tokens
+                if chunk_losses is not None:
+                    for chunk in batch_chunks:
+                        chunk_losses[chunk.index] = current_loss
+                
+                if progress_callback:
+                    for chunk in batch_chunks:
+                        progress_callback(chunk.index, len(document.chunks), current_loss)
+            
+            # 4. Update every accumulation_steps micro-batches
+            if pending and (idx + 1) % accumulation_steps == 0:
+                self._optimizer_step(optimizer, params, set_lr)
+                pending = False
+        
+        # Flush a partial accumulation (end of epoch or budget stop)
+        if pending:
+            self._optimizer_step(optimizer, params, set_lr)
+        
+        return (total_loss / steps if steps > 0 else 0.0), chunks_done, tokens_done, targets_done, exhausted
 
-            # 3. Update
-            loss.backward()
+    def _optimizer_step(self, optimizer, params, set_lr):
+        with stage("optimizer_step"):
             torch.nn.utils.clip_grad_norm_(params, 0.5)
-            
+            set_lr()
             optimizer.step()
             optimizer.zero_grad()
-            
-            current_loss = task_loss.item()
-            total_loss += current_loss
-            steps += 1
-            
-            if progress_callback:
-                progress_callback(idx, len(document.chunks), current_loss)
-        
-        self.model.disable_ttt_learning()
-        
-        return LearningMetrics(
-            initial_loss=0.0,
-            final_loss=total_loss / steps if steps > 0 else 0.0,
-            loss_history=[],
-            chunks_processed=steps,
-            tokens_processed=0,
-            learning_time_seconds=0,
-            weight_delta_norm=0
-        )
\ No newline at end of file
+        self.global_step += 1
+        self.model.mark_ttt_updated()
@@ -2,10 +2,116 @@
 TTT-Linear layer: A SwiGLU MLP layer where the Gate (W_h) is trainable at test time.
 """
 
+import math
+from typing import Dict, List, Optional
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+# Storage for the frozen W_up / W_out ("int8" = weight-only, per-row scales)
+FROZEN_DTYPES = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+    "int8": torch.int8,
+}
+
+
+class Int8Linear(nn.Module):
+    """
+    Frozen bias-free linear layer with int8 weights and one fp32 scale per
+    output row. Weights are widened to the input dtype per call, so it
+    stays differentiable w.r.t. its input (unlike dynamic quantization).
+    """
+
+    def __init__(self, weight: torch.Tensor):
+        super().__init__()
+        weight = weight.detach().float()
+        scale = weight.abs().amax(dim=1).clamp(min=1e-8) / 127
+        self.out_features, self.in_features = weight.shape
+        self.register_buffer("weight_int8", torch.round(weight / scale[:, None]).to(torch.int8))
+        self.register_buffer("scale", scale)
+
+    @property
+    def weight(self) -> torch.Tensor:
+        """Dequantized fp32 weight."""
+        return self.weight_int8.float() * self.scale[:, None]
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        # Scale after the matmul: x @ (q * s)^T == (x @ q^T) * s
+        return F.linear(x, self.weight_int8.to(x.dtype)) * self.scale.to(x.dtype)
+
+
+class FusedSwiGLU(torch.autograd.Function):
+    """
+    SiLU(x W_h^T + gate_delta) * (x W_up^T) from one GEMM against the packed
+    [W_h; W_up] weight.
+
+    W_h is passed separately (it is a view into gate_up) so that only that
+    half receives a gradient. Backward works from the saved GEMM output
+    instead of keeping SiLU intermediates, and skips d_up unless the input
+    needs a gradient.
+    """
+
+    @staticmethod
+    def forward(ctx, x, w_h, gate_up, gate_delta=None):
+        gate, up = F.linear(x, gate_up).chunk(2, dim=-1)
+        if gate_delta is not None:
+            gate = gate + gate_delta
+        ctx.save_for_backward(x, gate_up, gate, up)
+        return F.silu(gate) * up
+
+    @staticmethod
+    def backward(ctx, grad):
+        x, gate_up, gate, up = ctx.saved_tensors
+        sig = torch.sigmoid(gate)
+        grad_gate = grad * up * sig * (1 + gate * (1 - sig))
+        grad_x = grad_w_h = None
+        if ctx.needs_input_grad[0]:
+            grad_up = grad * gate * sig
+            grad_x = torch.cat([grad_gate, grad_up], dim=-1) @ gate_up
+        if ctx.needs_input_grad[1]:
+            grad_w_h = grad_gate.reshape(-1, grad_gate.shape[-1]).t() @ x.reshape(-1, x.shape[-1])
+        return grad_x, grad_w_h, None, grad_gate if ctx.needs_input_grad[3] else None
+
+
+class SwiGLU(torch.autograd.Function):
+    """SiLU(gate) * up that saves only its inputs for backward."""
+
+    @staticmethod
+    def forward(ctx, gate, up):
+        ctx.save_for_backward(gate, up)
+        return F.silu(gate) * up
+
+    @staticmethod
+    def backward(ctx, grad):
+        gate, up = ctx.saved_tensors
+        sig = torch.sigmoid(gate)
+        grad_gate = grad_up = None
+        if ctx.needs_input_grad[0]:
+            grad_gate = grad * up * sig * (1 + gate * (1 - sig))
+        if ctx.needs_input_grad[1]:
+            grad_up = grad * gate * sig
+        return grad_gate, grad_up
+
+
+def fused_swiglu(x: torch.Tensor, w_h: torch.Tensor, gate_up: torch.Tensor,
+                 gate_delta: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """SiLU(x W_h^T + gate_delta) * (x W_up^T) from one packed GEMM."""
+    return FusedSwiGLU.apply(x, w_h, gate_up, gate_delta)
+
+
+_compiled_swiglu = None
+
+
+def compiled_swiglu():
+    """fused_swiglu under torch.compile, compiled once and shared by every layer."""
+    global _compiled_swiglu
+    if _compiled_swiglu is None:
+        _compiled_swiglu = torch.compile(fused_swiglu, dynamic=True)
+    return _compiled_swiglu
+
+
 class TTTLinear(nn.Module):
     """
     SwiGLU layer where W_h (Gate) acts as the 'Fast Weight' memory.
@@ -15,6 +121,21 @@ class TTTLinear(nn.Module):
         up   = W_up(x)     <-- Frozen
         hidden = SiLU(gate) * up
         output = W_out(hidden) <-- Frozen
+
+    Adapter mode (enable_adapter) freezes W_h and learns a low-rank delta
+    instead: gate = W_h(x) + B(A(x)), with A: [rank, input], B: [hidden, rank].
+
+    Only W_h needs fp32. The frozen W_up / W_out can be stored in fp16,
+    bf16 or int8 (set_frozen_dtype); their matmuls then run in that
+    precision, autocast style, while the gate and its gradient stay fp32.
+
+    When W_h and W_up share a dtype they are packed into one [2*hidden,
+    input] buffer (W_h / W_up are views into it), so the gate and up
+    projections run as a single GEMM. enable_compile() additionally runs that
+    GEMM and the activation through torch.compile.
+
+    Local update mode (enable_local_updates) learns W_h inside no-grad
+    forward passes instead of through a global backward: see _forward_local.
     """
 
     def __init__(self, input_dim: int, hidden_dim: int, output_dim: int):
@@ -31,27 +152,55 @@ class TTTLinear(nn.Module):
         self.register_buffer('_W_h_initial', torch.empty(hidden_dim, input_dim))
         self._initialized = False
 
+        # Packed [W_h; W_up] (None while their dtypes differ) and compile mode
+        self._gate_up = None
+        self.compiled = False
+
+        # Low-rank delta (adapter mode only)
+        self.adapter_rank = 0
+        self.adapter_A = None
+        self.adapter_B = None
+
+        # Storage precision of W_up / W_out (see set_frozen_dtype)
+        self.frozen_dtype = "fp32"
+
+        # Local (in-forward) W_h updates; lr 0 = off
+        self.local_lr = 0.0
+        self.local_batch_size = 16
+        self.local_decay = 0.0
+        # [batch, seq] segment ids of the current forward (0 = padding), set by TTTModel
+        self.segment_ids = None
+
+        self.snapshot_initial()
+        self._pack_gate_up()
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """Standard SwiGLU forward pass."""
         # 1. Capture original dtype (likely float16)
         original_dtype = x.dtype
         
         # 2. Cast input to layer's dtype (float32) for stable training
+        x_in = x
         target_dtype = self.W_h.weight.dtype
         if x.dtype != target_dtype:
             x = x.to(target_dtype)
 
-        # Save initial weights on first run if not done
-        if not self._initialized:
-            with torch.no_grad():
-                self._W_h_initial = self.W_h.weight.data.clone()
-                self._initialized = True
-
-        # 3. Perform calculations in Float32
-        gate = self.W_h(x)
-        up = self.W_up(x)
-        hidden = F.silu(gate) * up
-        output = self.W_out(hidden)
+        if self.local_lr and not self.adapter_rank and not torch.is_grad_enabled():
+            output = self._forward_local(x)
+            return output.to(original_dtype) if output.dtype != original_dtype else output
+
+        # 3. Gate in Float32; frozen matmuls in their storage precision
+        gate_delta = F.linear(F.linear(x, self.adapter_A), self.adapter_B) if self.adapter_rank else None
+        if self._gate_up is not None:
+            swiglu = compiled_swiglu() if self.compiled else fused_swiglu
+            hidden = swiglu(x, self.W_h.weight, self._gate_up, gate_delta)
+        else:
+            gate = self.W_h(x)
+            if gate_delta is not None:
+                gate = gate + gate_delta
+            up = self._frozen(self.W_up, x_in).to(gate.dtype)
+            hidden = SwiGLU.apply(gate, up)
+        output = self._frozen(self.W_out, hidden)
         
         # 4. Cast output back to original dtype (float16) to satisfy next layers
         if output.dtype != original_dtype:
@@ -59,9 +208,218 @@ class TTTLinear(nn.Module):
             
         return output
 
+    def set_frozen_dtype(self, dtype: str) -> None:
+        """
+        Store W_up / W_out as "fp32", "fp16", "bf16" or "int8" (weight-only).
+
+        W_h stays fp32. _W_h_initial is kept in the low precision too when
+        that holds it exactly (e.g. a gate loaded from an fp16 checkpoint).
+        """
+        target = FROZEN_DTYPES[dtype]
+        for name in ("W_up", "W_out"):
+            linear = getattr(self, name)
+            weight = linear.weight.detach()
+            if target == torch.int8:
+                setattr(self, name, Int8Linear(weight))
+                continue
+            if isinstance(linear, Int8Linear):
+                linear = nn.Linear(linear.in_features, linear.out_features, bias=False, device=weight.device)
+                linear.weight.requires_grad_(False)
+                setattr(self, name, linear)
+            linear.weight.data = weight.to(target)
+        self.frozen_dtype = dtype
+        if self.adapter_rank == 0:
+            self.snapshot_initial()
+        self._pack_gate_up()
+
+    def enable_compile(self, enabled: bool = True) -> None:
+        """Run the gate/up GEMM and activation through torch.compile (packed layout only)."""
+        self.compiled = enabled
+
+    def _pack_gate_up(self) -> None:
+        """Place W_h and W_up in one buffer if they share a dtype (else unpack)."""
+        w_h, w_up = self.W_h.weight, self.W_up.weight
+        if isinstance(self.W_up, Int8Linear) or w_h.dtype != w_up.dtype or w_h.device != w_up.device:
+            self._gate_up = None
+            return
+        with torch.no_grad():
+            packed = torch.cat([w_h.data, w_up.data])
+        hidden_dim = w_h.shape[0]
+        w_h.data = packed[:hidden_dim]
+        w_up.data = packed[hidden_dim:]
+        self._gate_up = packed
+
+    def _apply(self, fn, *args, **kwargs):
+        # .to() / .cuda() give W_h and W_up fresh storage: pack them again
+        super()._apply(fn, *args, **kwargs)
+        if self._gate_up is not None:
+            self._pack_gate_up()
+        return self
+
+    def _frozen(self, linear: nn.Module, x: torch.Tensor) -> torch.Tensor:
+        """Run a frozen projection in its storage precision (fp32 for int8)."""
+        weight_dtype = linear.weight_int8.dtype if isinstance(linear, Int8Linear) else linear.weight.dtype
+        compute_dtype = weight_dtype if weight_dtype.is_floating_point else self.W_h.weight.dtype
+        return linear(x if x.dtype == compute_dtype else x.to(compute_dtype))
+
+    def enable_local_updates(self, lr: float, batch_size: int = 16, decay: float = 0.0) -> None:
+        """
+        Update W_h during no-grad forward passes (lr 0 turns it off).
+
+        Args:
+            lr: Step size of the local gradient step
+            batch_size: Positions per mini-batch (one W_h step each)
+            decay: Pull of W_h back toward _W_h_initial per step (the anchor)
+        """
+        if not self._initialized:
+            self.snapshot_initial()
+        self.local_lr = lr
+        self.local_batch_size = max(1, batch_size)
+        self.local_decay = decay
+
+    def _forward_local(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Forward pass that also trains W_h, mini-batch TTT style.
+
+        The sequence is processed in blocks of local_batch_size positions.
+        Each block's output uses W_h as it was before the block, then W_h
+        takes one step on the block's self-supervised loss
+
+            0.5 * ||y_t - sg(y_{t+1})||^2   (y = layer output, same segment only)
+
+        i.e. the memory learns to map each position onto what comes next.
+        The W_h gradient is written out by hand, so no graph is kept and the
+        cost is about two extra matmuls per block. Decay toward
+        _W_h_initial replaces the anchor penalty:
+
+            W_h <- W_0 + (1 - lr * decay) * (W_h - W_0) - lr * grad
+        """
+        batch, seq_len = x.shape[:2]
+        segment_ids = self.segment_ids
+        if segment_ids is not None and segment_ids.shape != (batch, seq_len):
+            # Incremental decoding: the ids belong to another call
+            segment_ids = None
+        weight = self.W_h.weight.data
+        step = self.local_batch_size
+        outputs = []
+
+        for start in range(0, seq_len, step):
+            end = min(start + step, seq_len)
+            # One position of lookahead for the last target of the block
+            xb = x[:, start:min(end + 1, seq_len)]
+            gate = F.linear(xb, weight)
+            up = self._frozen(self.W_up, xb).to(gate.dtype)
+            sig = torch.sigmoid(gate)
+            y = self._frozen(self.W_out, gate * sig * up).to(gate.dtype)
+            outputs.append(y[:, :end - start])
+
+            if y.shape[1] < 2:
+                continue
+            error = y[:, :-1] - y[:, 1:]
+            if segment_ids is not None:
+                seg = segment_ids[:, start:start + y.shape[1]]
+                pair = (seg[:, :-1] == seg[:, 1:]) & (seg[:, 1:] != 0)
+                error = error * pair.unsqueeze(-1).to(error.dtype)
+                count = int(pair.sum())
+            else:
+                count = error.shape[0] * error.shape[1]
+            if count == 0:
+                continue
+
+            # Backprop of the block loss through W_out and SiLU(gate) * up, by hand
+            d_hidden = error @ self.W_out.weight.to(error.dtype)
+            d_gate = d_hidden * up[:, :-1] * sig[:, :-1] * (1 + gate[:, :-1] * (1 - sig[:, :-1]))
+            grad = d_gate.reshape(-1, d_gate.shape[-1]).t() @ xb[:, :-1].reshape(-1, xb.shape[-1])
+
+            if self.local_decay:
+                weight.sub_(weight - self._W_h_initial, alpha=self.local_lr * self.local_decay)
+            weight.sub_(grad, alpha=self.local_lr / count)
+
+        return torch.cat(outputs, dim=1)
+
+    def enable_adapter(self, rank: int) -> None:
+        """
+        Switch to a rank-`rank` delta on a frozen W_h (rank 0 = full W_h updates).
+
+        Any learned state is discarded. In adapter mode W_h never changes, so
+        the full _W_h_initial copy is released.
+        """
+        self.reset_weights()
+        weight = self.W_h.weight
+        hidden_dim, input_dim = weight.shape
+
+        if rank <= 0:
+            self.adapter_rank = 0
+            self.adapter_A = None
+            self.adapter_B = None
+            self.snapshot_initial()
+            return
+
+        self.adapter_rank = rank
+        # B starts at zero so the layer is unchanged until trained
+        self.adapter_A = nn.Parameter(torch.empty(rank, input_dim, device=weight.device, dtype=weight.dtype))
+        self.adapter_B = nn.Parameter(torch.zeros(hidden_dim, rank, device=weight.device, dtype=weight.dtype))
+        nn.init.kaiming_uniform_(self.adapter_A, a=math.sqrt(5))
+        self._W_h_initial = torch.empty(0, device=weight.device, dtype=weight.dtype)
+        self._initialized = True
+
+    def trainable_parameters(self) -> List[nn.Parameter]:
+        """Parameters updated at test time."""
+        if self.adapter_rank:
+            return [self.adapter_A, self.adapter_B]
+        return [self.W_h.weight]
+
+    def anchor_penalty(self) -> torch.Tensor:
+        """Squared Frobenius norm of the learned delta (for anchor regularization)."""
+        if self.adapter_rank:
+            # ||B A||_F^2 = sum((B^T B) * (A A^T)): rank x rank instead of hidden x input
+            return torch.sum((self.adapter_B.t() @ self.adapter_B) * (self.adapter_A @ self.adapter_A.t()))
+        return torch.sum((self.W_h.weight - self._W_h_initial) ** 2)
+
+    def get_ttt_state(self, as_delta: bool = False) -> Dict[str, torch.Tensor]:
+        """
+        Learned tensors only: W_h in full mode, A/B in adapter mode.
+
+        With as_delta, full mode returns W_h - _W_h_initial instead, which
+        survives downcasting to fp16/bf16 far better than W_h itself.
+        """
+        if self.adapter_rank:
+            return {"adapter_A": self.adapter_A.data, "adapter_B": self.adapter_B.data}
+        if as_delta:
+            return {"W_h_delta": self.W_h.weight.data - self._W_h_initial}
+        return {"W_h": self.W_h.weight.data}
+
+    def load_ttt_state(self, state: Dict[str, torch.Tensor]) -> None:
+        """Copy tensors from get_ttt_state() back in place (casting as needed)."""
+        with torch.no_grad():
+            if self.adapter_rank:
+                self.adapter_A.data.copy_(state["adapter_A"])
+                self.adapter_B.data.copy_(state["adapter_B"])
+            elif "W_h_delta" in state:
+                self.W_h.weight.data.copy_(self._W_h_initial)
+                self.W_h.weight.data.add_(state["W_h_delta"].to(self.W_h.weight.device, self.W_h.weight.dtype))
+            else:
+                self.W_h.weight.data.copy_(state["W_h"])
+
+    def snapshot_initial(self) -> None:
+        """Record the current W_h as the reset/anchor point."""
+        with torch.no_grad():
+            weight = self.W_h.weight.data
+            initial = weight.clone()
+            low = FROZEN_DTYPES.get(self.frozen_dtype, weight.dtype)
+            if low.is_floating_point and low != weight.dtype:
+                candidate = weight.to(low)
+                if torch.equal(candidate.to(weight.dtype), weight):
+                    initial = candidate
+            self._W_h_initial = initial
+            self._initialized = True
+
     def reset_weights(self) -> None:
         """Restore W_h to pre-trained state."""
-        if self._initialized:
+        if self.adapter_rank:
+            with torch.no_grad():
+                self.adapter_B.data.zero_()
+        elif self._initialized:
             with torch.no_grad():
                 self.W_h.weight.data.copy_(self._W_h_initial)
 
@@ -69,5 +427,4 @@ class TTTLinear(nn.Module):
         """Measure how much we've learned."""
         if not self._initialized: return 0.0
         with torch.no_grad():
-            delta = self.W_h.weight - self._W_h_initial
-            return torch.norm(delta).item()
\ No newline at end of file
+            return torch.sqrt(self.anchor_penalty()).item()
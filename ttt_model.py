@@ -2,11 +2,18 @@
 TTTModel - Qwen2.5-0.5B with TTT-Linear layers.
 """
 
-from typing import List, Optional
+import copy
+from typing import Dict, Iterator, List, Optional
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from ttt_linear import TTTLinear
+from transformers.generation.logits_process import (
+    LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper, TopPLogitsWarper
+)
+from transformers.modeling_outputs import CausalLMOutputWithPast
+from ttt_linear import FROZEN_DTYPES, TTTLinear
 
 class TTTModel(nn.Module):
     def __init__(self, base_model: nn.Module, tokenizer, ttt_layers: List[TTTLinear]):
@@ -15,9 +22,37 @@ class TTTModel(nn.Module):
         self.tokenizer = tokenizer
         self.ttt_layers = ttt_layers
         self.device = base_model.device
+        
+        # Indices of the transformer blocks whose MLP is a TTTLinear
+        self.ttt_layer_indices = [
+            idx for idx, layer in enumerate(base_model.model.layers)
+            if isinstance(layer.mlp, TTTLinear)
+        ]
+        
+        # Bumped whenever TTT weights change; keys the prompt-prefix KV cache
+        self.ttt_version = 0
+        self._prompt_cache = {}
+        
+        # Recompute TTT-block activations in backward instead of storing them
+        self.activation_checkpointing = False
+
+    @property
+    def prefix_length(self) -> int:
+        """Number of frozen transformer blocks before the first TTT block."""
+        return min(self.ttt_layer_indices) if self.ttt_layer_indices else len(self.model.model.layers)
 
     @classmethod
-    def from_pretrained(cls, model_name="Qwen/Qwen2.5-0.5B-Instruct", ttt_layer_indices=None, device="cuda"):
+    def from_pretrained(cls, model_name="Qwen/Qwen2.5-0.5B-Instruct", ttt_layer_indices=None, device="cuda",
+                        frozen_dtype: str = "auto"):
+        """
+        Load the base model and swap the chosen MLPs for TTTLinear layers.
+        
+        Args:
+            frozen_dtype: Storage for the frozen W_up / W_out: "fp32", "fp16",
+                "bf16", "int8" (weight-only), or "auto" = the base model's
+                dtype on GPU and fp32 on CPU (where fp16 matmuls are slow).
+                "auto" never loses precision; bf16 and int8 are opt-in
+        """
         tokenizer = AutoTokenizer.from_pretrained(model_name)
         if tokenizer.pad_token is None:
             tokenizer.pad_token = tokenizer.eos_token
@@ -29,11 +64,33 @@ class TTTModel(nn.Module):
             device_map=device
         )
         
-        ttt_layers = cls._replace_mlp_layers(base_model, ttt_layer_indices)
+        ttt_layers = cls._replace_mlp_layers(base_model, ttt_layer_indices, cls._resolve_frozen_dtype(base_model, frozen_dtype))
         return cls(base_model, tokenizer, ttt_layers)
     
     @classmethod
-    def _replace_mlp_layers(cls, model, layer_indices):
+    def from_config(cls, config, tokenizer, ttt_layer_indices=None, device="cpu",
+                    dtype=torch.float16, frozen_dtype: str = "auto"):
+        """
+        Randomly initialized model from a transformers config, without any
+        download (benchmarks, tests). Same TTT layer installation as
+        from_pretrained.
+        """
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        base_model = AutoModelForCausalLM.from_config(config, dtype=dtype).to(device)
+        base_model.eval()
+        ttt_layers = cls._replace_mlp_layers(base_model, ttt_layer_indices, cls._resolve_frozen_dtype(base_model, frozen_dtype))
+        return cls(base_model, tokenizer, ttt_layers)
+    
+    @staticmethod
+    def _resolve_frozen_dtype(base_model, frozen_dtype: str) -> str:
+        if frozen_dtype != "auto":
+            return frozen_dtype
+        names = {dtype: name for name, dtype in FROZEN_DTYPES.items()}
+        return names[base_model.dtype] if base_model.device.type == "cuda" else "fp32"
+    
+    @classmethod
+    def _replace_mlp_layers(cls, model, layer_indices, frozen_dtype="fp32"):
         ttt_layers = []
         transformer_layers = model.model.layers
         if layer_indices is None: layer_indices = list(range(len(transformer_layers)))
@@ -51,15 +108,21 @@ class TTTModel(nn.Module):
                 output_dim=mlp.gate_proj.in_features
             )
             
-            # Copy Weights and CAST TO FLOAT32
-            # This is the key fix for "Loss: nan"
+            # Copy Weights; W_h is CAST TO FLOAT32
+            # This is the key fix for "Loss: nan" (only the trained gate needs it)
             with torch.no_grad():
                 ttt_layer.W_h.weight.data = mlp.gate_proj.weight.data.float()
-                ttt_layer.W_up.weight.data = mlp.up_proj.weight.data.float()
-                ttt_layer.W_out.weight.data = mlp.down_proj.weight.data.float()
+                ttt_layer.W_up.weight.data = mlp.up_proj.weight.data
+                ttt_layer.W_out.weight.data = mlp.down_proj.weight.data
+            # The packed [W_h; W_up] buffer still holds the random init
+            ttt_layer._pack_gate_up()
             
-            # Move to device (GPU) but keep as Float32
-            ttt_layer.to(device=mlp.gate_proj.weight.device, dtype=torch.float32)
+            # Move to device (GPU); W_h stays Float32
+            ttt_layer.to(device=mlp.gate_proj.weight.device)
+            
+            # Frozen weights to their storage dtype; this also anchors on the
+            # pre-trained gate now, before any saved state is loaded
+            ttt_layer.set_frozen_dtype(frozen_dtype)
             
             # Replace
             layer.mlp = ttt_layer
@@ -67,14 +130,62 @@ class TTTModel(nn.Module):
             
         return ttt_layers
 
+    @property
+    def adapter_rank(self) -> int:
+        return self.ttt_layers[0].adapter_rank if self.ttt_layers else 0
+
+    def enable_adapters(self, rank: int):
+        """Learn a rank-`rank` delta per TTT layer instead of full W_h (0 = full W_h)."""
+        for layer in self.ttt_layers:
+            layer.enable_adapter(rank)
+        self.mark_ttt_updated()
+
+    def ttt_parameters(self) -> List[nn.Parameter]:
+        return [p for layer in self.ttt_layers for p in layer.trainable_parameters()]
+
+    def get_ttt_state(self, as_delta: bool = False) -> List[Dict[str, torch.Tensor]]:
+        """Learned tensors of every TTT layer (see TTTLinear.get_ttt_state)."""
+        return [layer.get_ttt_state(as_delta) for layer in self.ttt_layers]
+
+    def load_ttt_state(self, states: List[Dict[str, torch.Tensor]]):
+        for layer, state in zip(self.ttt_layers, states):
+            layer.load_ttt_state(state)
+        self.mark_ttt_updated()
+
+    def mark_ttt_updated(self):
+        """Record that TTT weights changed (drops cached prompt prefixes)."""
+        self.ttt_version += 1
+        self._prompt_cache.clear()
+
     def enable_ttt_learning(self):
         self.model.train()
         for param in self.model.parameters():
             param.requires_grad = False
-        for layer in self.ttt_layers:
-            layer.W_h.weight.requires_grad = True
+        for param in self.ttt_parameters():
+            param.requires_grad = True
             
+    def compile_ttt_layers(self, enabled: bool = True):
+        """
+        Opt into torch.compile for the TTT layers' fused gate/up + SwiGLU.
+        
+        One compiled function (dynamic shapes) is shared by every layer, so
+        it compiles once rather than per layer and sequence length.
+        """
+        for layer in self.ttt_layers:
+            layer.enable_compile(enabled)
+
+    def enable_local_updates(self, lr: float, batch_size: int = 16, decay: float = 0.0):
+        """
+        Let every TTT layer update W_h inside no-grad forward passes
+        (TTTLinear._forward_local); lr 0 turns it back off.
+        """
+        if lr and self.adapter_rank:
+            raise ValueError("Local updates train W_h directly; disable adapters first")
+        for layer in self.ttt_layers:
+            layer.enable_local_updates(lr, batch_size, decay)
+
     def disable_ttt_learning(self):
+        self.enable_local_updates(0.0)
         self.model.eval()
         for param in self.model.parameters():
             param.requires_grad = False
@@ -82,6 +193,7 @@ class TTTModel(nn.Module):
     def reset_learning(self):
         for layer in self.ttt_layers:
             layer.reset_weights()
+        self.mark_ttt_updated()
             
     def clear_context(self):
         if hasattr(self.model, '_past_key_values'):
@@ -90,12 +202,256 @@ class TTTModel(nn.Module):
     def forward(self, input_ids, labels=None):
         return self.model(input_ids=input_ids, labels=labels)
 
+    def forward_prefix(self, input_ids: torch.Tensor, segment_ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """
+        Run the frozen blocks [0, prefix_length) and return their hidden states.
+        
+        Nothing below the first TTT block is trainable, so the result only
+        depends on input_ids and can be reused across epochs.
+        """
+        inner = self.model.model
+        with torch.no_grad():
+            hidden_states = inner.embed_tokens(input_ids)
+            hidden_states = self._run_layers(hidden_states, inner.layers[:self.prefix_length], segment_ids)
+        return hidden_states
+
+    def forward_suffix(self, hidden_states: torch.Tensor, labels=None,
+                       segment_ids: Optional[torch.Tensor] = None,
+                       loss_chunk_size: int = 0) -> CausalLMOutputWithPast:
+        """
+        Run the TTT blocks [prefix_length, N), final norm and LM head.
+        
+        Args:
+            hidden_states: Output of forward_prefix for the same input_ids
+            labels: Optional token ids; if given, the shifted causal LM loss is returned
+            segment_ids: Optional [batch, seq] ids; 0 = padding, 1..k = packed sequences
+            loss_chunk_size: If > 0 (and labels are given), compute the loss in
+                blocks of this many positions without ever building the full
+                [seq, vocab] logits; the returned logits are then None
+        """
+        inner = self.model.model
+        # Local W_h updates must not pair tokens across segments or padding
+        for layer in self.ttt_layers:
+            layer.segment_ids = segment_ids
+        try:
+            hidden_states = self._run_layers(hidden_states, inner.layers[self.prefix_length:], segment_ids)
+        finally:
+            for layer in self.ttt_layers:
+                layer.segment_ids = None
+        hidden_states = inner.norm(hidden_states)
+        if labels is not None and loss_chunk_size > 0:
+            loss = self._chunked_lm_loss(hidden_states, labels, loss_chunk_size)
+            return CausalLMOutputWithPast(loss=loss, logits=None)
+        logits = self.model.lm_head(hidden_states)
+        
+        loss = None
+        if labels is not None:
+            # Same shift/upcast as the HF causal LM loss
+            shift_logits = logits[:, :-1, :].float()
+            shift_labels = labels[:, 1:].to(logits.device)
+            loss = F.cross_entropy(
+                shift_logits.reshape(-1, shift_logits.size(-1)),
+                shift_labels.reshape(-1),
+                ignore_index=-100
+            )
+        return CausalLMOutputWithPast(loss=loss, logits=logits)
+
+    def _chunked_lm_loss(self, hidden_states: torch.Tensor, labels: torch.Tensor, chunk_size: int) -> torch.Tensor:
+        """
+        Shifted causal LM loss, chunk_size positions at a time.
+        
+        Only positions with a label are projected. Each block's logits are
+        recomputed in backward (checkpointed) rather than kept, so peak
+        memory holds one [chunk_size, vocab] block instead of [seq, vocab].
+        """
+        hidden = hidden_states[:, :-1, :].reshape(-1, hidden_states.size(-1))
+        targets = labels[:, 1:].reshape(-1).to(hidden.device)
+        keep = targets != -100
+        hidden, targets = hidden[keep], targets[keep]
+        if targets.numel() == 0:
+            return hidden_states.new_tensor(float('nan'), dtype=torch.float32)
+        
+        def block_loss(h, t):
+            logits = self.model.lm_head(h).float()
+            return F.cross_entropy(logits, t, reduction="sum")
+        
+        total = 0.0
+        for start in range(0, targets.numel(), chunk_size):
+            h, t = hidden[start:start + chunk_size], targets[start:start + chunk_size]
+            if torch.is_grad_enabled():
+                total = total + checkpoint(block_loss, h, t, use_reentrant=False)
+            else:
+                total = total + block_loss(h, t)
+        return total / targets.numel()
+
+    def _run_layers(self, hidden_states: torch.Tensor, layers,
+                    segment_ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """
+        Run a slice of decoder layers.
+        
+        Without segment_ids this is a plain causal mask. With segment_ids, tokens
+        only attend within their own segment and positions restart at each
+        segment, so packed/padded rows match running each chunk on its own.
+        """
+        inner = self.model.model
+        batch, seq_len = hidden_states.shape[:2]
+        device = hidden_states.device
+        
+        allowed = torch.ones(seq_len, seq_len, dtype=torch.bool, device=device).tril()
+        if segment_ids is None:
+            position_ids = torch.arange(seq_len, device=device).unsqueeze(0).expand(batch, -1)
+            allowed = allowed.expand(batch, seq_len, seq_len)
+        else:
+            arange = torch.arange(seq_len, device=device).expand(batch, -1)
+            starts = torch.ones_like(segment_ids, dtype=torch.bool)
+            starts[:, 1:] = segment_ids[:, 1:] != segment_ids[:, :-1]
+            position_ids = arange - torch.cummax(arange * starts, dim=1).values
+            
+            same_segment = segment_ids.unsqueeze(2) == segment_ids.unsqueeze(1)
+            real_key = (segment_ids != 0).unsqueeze(1)
+            # Padding rows attend to themselves so softmax never sees an all-masked row
+            eye = torch.eye(seq_len, dtype=torch.bool, device=device)
+            allowed = (allowed & same_segment & real_key) | eye
+        
+        attention_mask = torch.zeros(batch, 1, seq_len, seq_len, dtype=hidden_states.dtype, device=device)
+        attention_mask.masked_fill_(~allowed.unsqueeze(1), torch.finfo(hidden_states.dtype).min)
+        
+        layer_kwargs = {"attention_mask": attention_mask, "position_ids": position_ids}
+        if hasattr(inner, "rotary_emb"):
+            layer_kwargs["position_embeddings"] = inner.rotary_emb(hidden_states, position_ids)
+        
+        for layer in layers:
+            if self.activation_checkpointing and torch.is_grad_enabled() and isinstance(layer.mlp, TTTLinear):
+                out = checkpoint(layer, hidden_states, use_reentrant=False, **layer_kwargs)
+            else:
+                out = layer(hidden_states, **layer_kwargs)
+            # Older transformers return (hidden_states, ...) tuples
+            hidden_states = out[0] if isinstance(out, tuple) else out
+        return hidden_states
+
     def generate(self, prompt: str, max_new_tokens: int = 100, temperature: float = 0.7, **kwargs) -> str:
         # Tokenize
         inputs = self.tokenizer(prompt, return_tensors="pt")
         inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
         
-        # Config
+        # Generate
+        with torch.no_grad():
+            outputs = self.model.generate(**inputs, **self._generation_kwargs(max_new_tokens, temperature))
+            
+        return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: int = 100, temperature: float = 0.7,
+                       prefix: Optional[str] = None) -> List[List[int]]:
+        """
+        Generate for several prompts in one left-padded model.generate call.
+
+        With prefix (shared by every prompt, e.g. the system prompt) its
+        cached KV is expanded across the batch, as in stream(), and only the
+        prompts are prefilled. Returns only the newly generated token ids per
+        prompt (padding and anything after EOS removed).
+        """
+        # Left padding keeps every prompt's last token at the end of the row.
+        # Built here rather than via tokenizer.padding_side: the tokenizer is
+        # shared by concurrent daemon threads
+        encoded = self.tokenizer(prompts, add_special_tokens=prefix is None)["input_ids"]
+        length = max(len(ids) for ids in encoded)
+        input_ids = torch.full((len(prompts), length), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+        for row, ids in enumerate(encoded):
+            input_ids[row, length - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, length - len(ids):] = 1
+        inputs = {"input_ids": input_ids.to(self.model.device), "attention_mask": attention_mask.to(self.model.device)}
+        if prefix is not None:
+            # The padding sits between prefix and prompt; the mask hides it and
+            # position ids follow the mask, so each row matches its unpadded prompt
+            prefix_ids, prefix_cache = self._cached_prefix(prefix)
+            cache = copy.deepcopy(prefix_cache)
+            cache.batch_repeat_interleave(len(prompts))
+            inputs = {
+                "input_ids": torch.cat([prefix_ids.expand(len(prompts), -1), inputs["input_ids"]], dim=1),
+                "attention_mask": torch.cat([torch.ones_like(prefix_ids).expand(len(prompts), -1),
+                                             inputs["attention_mask"]], dim=1),
+                "past_key_values": cache,
+            }
+        
+        with torch.no_grad():
+            outputs = self.model.generate(**inputs, **self._generation_kwargs(max_new_tokens, temperature))
+        
+        new_tokens = outputs[:, inputs["input_ids"].shape[1]:].tolist()
+        stop_ids = {self.tokenizer.eos_token_id, self.tokenizer.pad_token_id}
+        results = []
+        for row in new_tokens:
+            # Rows that finish early are filled with pad tokens after EOS
+            end = next((i for i, t in enumerate(row) if t in stop_ids), len(row))
+            results.append(row[:end])
+        return results
+
+    def stream(self, prompt: str, max_new_tokens: int = 100, temperature: float = 0.7,
+               prefix: Optional[str] = None) -> Iterator[int]:
+        """
+        Yield generated token ids one at a time.
+
+        Same sampling as generate() (repetition penalty, temperature, top-p),
+        decoded step by step over a KV cache so callers can print as tokens
+        arrive and stop early by simply not asking for more. Ends at EOS,
+        <|im_end|> / <|im_start|>, or max_new_tokens.
+        """
+        prompt_ids = self.tokenizer(prompt, return_tensors="pt", add_special_tokens=prefix is None)["input_ids"]
+        prompt_ids = prompt_ids.to(self.model.device)
+        if prefix is None:
+            input_ids, cache = prompt_ids, None
+        else:
+            prefix_ids, prefix_cache = self._cached_prefix(prefix)
+            input_ids = torch.cat([prefix_ids, prompt_ids], dim=1)
+            cache = copy.deepcopy(prefix_cache)
+        
+        processors = self._logits_processors(temperature)
+        stop_ids = self._stop_token_ids()
+        # Only the tokens not already in the cache are prefilled
+        step_ids = input_ids if cache is None else prompt_ids
+        with torch.no_grad():
+            for _ in range(max_new_tokens):
+                out = self.model(input_ids=step_ids, past_key_values=cache, use_cache=True)
+                cache = out.past_key_values
+                scores = processors(input_ids, out.logits[:, -1, :].float())
+                if temperature > 0:
+                    next_id = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)
+                else:
+                    next_id = scores.argmax(dim=-1, keepdim=True)
+                token = next_id.item()
+                if token in stop_ids:
+                    return
+                yield token
+                input_ids = torch.cat([input_ids, next_id], dim=1)
+                step_ids = next_id
+
+    def _logits_processors(self, temperature: float) -> LogitsProcessorList:
+        # Mirrors _generation_kwargs
+        processors = LogitsProcessorList([RepetitionPenaltyLogitsProcessor(1.2)])
+        if temperature > 0:
+            processors.append(TemperatureLogitsWarper(temperature))
+            processors.append(TopPLogitsWarper(0.9))
+        return processors
+
+    def _stop_token_ids(self) -> set:
+        stop_ids = {self.tokenizer.eos_token_id, self.tokenizer.pad_token_id}
+        vocab = self.tokenizer.get_vocab()
+        for token in ("<|im_end|>", "<|im_start|>"):
+            if token in vocab:
+                stop_ids.add(vocab[token])
+        return stop_ids
+
+    def _cached_prefix(self, prefix: str):
+        """Token ids and KV cache for prefix under the current TTT weights."""
+        if prefix not in self._prompt_cache:
+            ids = self.tokenizer(prefix, return_tensors="pt", add_special_tokens=False)["input_ids"]
+            ids = ids.to(self.model.device)
+            with torch.no_grad():
+                out = self.model(input_ids=ids, use_cache=True)
+            self._prompt_cache[prefix] = (ids, out.past_key_values)
+        return self._prompt_cache[prefix]
+
+    def _generation_kwargs(self, max_new_tokens: int, temperature: float) -> dict:
         do_sample = temperature > 0
         gen_kwargs = {
             "max_new_tokens": max_new_tokens,
@@ -107,9 +463,4 @@ class TTTModel(nn.Module):
         if do_sample:
             gen_kwargs["temperature"] = temperature
             gen_kwargs["top_p"] = 0.9
-
-        # Generate
-        with torch.no_grad():
-            outputs = self.model.generate(**inputs, **gen_kwargs)
-            
-        return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
\ No newline at end of file
+        return gen_kwargs
\ No newline at end of file